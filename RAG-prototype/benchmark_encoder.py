@@ -0,0 +1,70 @@
+"""
+Compare embedding encoder backends.
+
+Encodes the chunked corpus with each backend and reports corpus
+throughput (chunks/sec), p50/p99 single-query latency and the parity
+check against the float32 encoder, so a faster backend can be picked
+without silently degrading retrieval.
+
+    python benchmark_encoder.py --backends torch int8 onnx --batch-size 32 --tolerance 0.02
+"""
+import argparse
+import time
+import numpy as np
+from src.document_processor import EMBEDDING_MODEL_NAME, load_documents, chunk_documents, load_embedding_model
+from src.encoder_backend import EMBEDDING_BACKENDS, PARITY_TEXTS, check_parity
+
+def load_queries(args):
+    if not args.queries:
+        return PARITY_TEXTS
+    with open(args.queries, 'r', encoding='utf-8') as f:
+        return [line.strip() for line in f if line.strip()]
+
+def measure(model, texts, queries, batch_size):
+    """Return corpus chunks/sec and per-query latencies in ms"""
+    # Warm up so lazy initialisation is not counted
+    model.encode(queries[:1])
+
+    start = time.perf_counter()
+    model.encode(texts, batch_size=batch_size, convert_to_numpy=True)
+    throughput = len(texts) / (time.perf_counter() - start)
+
+    latencies = []
+    for query in queries:
+        start = time.perf_counter()
+        model.encode([query], convert_to_numpy=True)
+        latencies.append((time.perf_counter() - start) * 1000)
+    return throughput, np.array(latencies)
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark embedding encoder backends")
+    parser.add_argument("--model", default=EMBEDDING_MODEL_NAME)
+    parser.add_argument("--backends", nargs="+", default=list(EMBEDDING_BACKENDS), choices=EMBEDDING_BACKENDS)
+    parser.add_argument("--data", default="data")
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--tolerance", type=float, default=0.02)
+    parser.add_argument("--queries", default=None, help="text file with one query per line")
+    args = parser.parse_args()
+
+    texts = [doc['text'] for doc in chunk_documents(load_documents(args.data))]
+    queries = load_queries(args)
+    reference = load_embedding_model(args.model)
+    print(f"📚 {len(texts)} chunks, {len(queries)} queries")
+
+    print(f"\n{'backend':<8} {'chunks/s':>9} {'p50(ms)':>8} {'p99(ms)':>8} {'min cos':>8} {'sim err':>8}  parity")
+    for backend in args.backends:
+        try:
+            model = reference if backend == "torch" else load_embedding_model(args.model, backend=backend)
+        except Exception as e:
+            print(f"{backend:<8} ❌ {e}")
+            continue
+        throughput, latencies = measure(model, texts, queries, args.batch_size)
+        parity = check_parity(model, reference, queries + texts[:64], tolerance=args.tolerance)
+        print(
+            f"{backend:<8} {throughput:>9.1f} {np.percentile(latencies, 50):>8.2f} "
+            f"{np.percentile(latencies, 99):>8.2f} {parity['min_cosine']:>8.4f} "
+            f"{parity['max_similarity_error']:>8.4f}  {'✅' if parity['passed'] else '❌'}"
+        )
+
+if __name__ == "__main__":
+    main()
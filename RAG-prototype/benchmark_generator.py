@@ -0,0 +1,132 @@
+"""
+Compare generator inference backends.
+
+Loads the generator once per backend (each in its own process so peak
+memory is measured in isolation) and reports weight footprint, peak
+process RSS, load time and decode throughput. The answers are printed
+next to each other so quality can be checked by eye before picking the
+cheapest acceptable mode.
+
+    python benchmark_generator.py --backends fp32 bf16 int8 onnx --max-new-tokens 64
+"""
+import argparse
+import queue
+import resource
+import time
+import multiprocessing as mp
+import torch
+from src.generator_backend import GENERATOR_BACKENDS, GENERATOR_MODEL_NAME, load_generator, model_footprint
+from src.rag_system import LOCAL_PROMPT_PREFIX
+
+DEFAULT_QUESTIONS = [
+    "When was FUTA created?",
+    "What faculties are in FUTA?",
+    "How is the grading system calculated?"
+]
+
+DEFAULT_CONTEXT = (
+    "The Federal University of Technology, Akure (FUTA) was established in 1981. "
+    "It has schools of agriculture, engineering, sciences, earth and mineral sciences "
+    "and environmental technology. Grades are computed on a five point scale."
+)
+
+def load_questions(args):
+    if not args.questions:
+        return DEFAULT_QUESTIONS
+    with open(args.questions, 'r', encoding='utf-8') as f:
+        return [line.strip() for line in f if line.strip()]
+
+def run_backend(backend, args, questions, results):
+    """Load one backend, time greedy generation and report back through results"""
+    torch.manual_seed(0)
+    start = time.perf_counter()
+    try:
+        model, tokenizer, used = load_generator(args.model, backend)
+    except Exception as e:
+        results.put({'backend': backend, 'error': str(e)})
+        return
+    load_time = time.perf_counter() - start
+    
+    answers = []
+    new_tokens = 0
+    generation_time = 0.0
+    for question in questions:
+        suffix = f"            {DEFAULT_CONTEXT}\n\n            Question: {question}\n\n            Answer:\n            "
+        prompt = LOCAL_PROMPT_PREFIX + suffix
+        inputs = tokenizer(prompt, return_tensors="pt")
+        start = time.perf_counter()
+        with torch.no_grad():
+            outputs = model.generate(
+                **inputs,
+                max_new_tokens=args.max_new_tokens,
+                do_sample=False,
+                pad_token_id=tokenizer.eos_token_id
+            )
+        generation_time += time.perf_counter() - start
+        generated = outputs[0][inputs['input_ids'].shape[1]:]
+        new_tokens += len(generated)
+        answers.append(tokenizer.decode(generated, skip_special_tokens=True).strip())
+    
+    results.put({
+        'backend': used if used == backend else f"{backend}->{used}",
+        'load_time': load_time,
+        'weights_mb': model_footprint(model) / 2**20,
+        # ru_maxrss is in KB on Linux
+        'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        'tokens_per_second': new_tokens / generation_time if generation_time else 0.0,
+        'answers': answers
+    })
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark generator inference backends")
+    parser.add_argument("--model", default=GENERATOR_MODEL_NAME)
+    parser.add_argument("--backends", nargs="+", default=["fp32", "bf16", "int8"], choices=GENERATOR_BACKENDS)
+    parser.add_argument("--max-new-tokens", type=int, default=64)
+    parser.add_argument("--questions", default=None, help="text file with one question per line")
+    args = parser.parse_args()
+    
+    questions = load_questions(args)
+    context = mp.get_context("spawn")
+    reports = []
+    for backend in args.backends:
+        print(f"⏳ Benchmarking {backend}...")
+        results = context.Queue()
+        process = context.Process(target=run_backend, args=(backend, args, questions, results))
+        process.start()
+        # Read the report before joining: a child blocks on put() until a
+        # report larger than the pipe buffer has been consumed
+        report = None
+        while report is None:
+            try:
+                report = results.get(timeout=1)
+            except queue.Empty:
+                if not process.is_alive():
+                    # The report may have landed just before the exit
+                    try:
+                        report = results.get(timeout=1)
+                    except queue.Empty:
+                        pass
+                    break
+        process.join()
+        if report is None:
+            report = {'backend': backend, 'error': f"worker exited with code {process.exitcode}"}
+        reports.append(report)
+    
+    print(f"\n{'backend':<14} {'load(s)':>8} {'weights(MB)':>12} {'peak RSS(MB)':>13} {'tokens/s':>9}")
+    for report in reports:
+        if 'error' in report:
+            print(f"{report['backend']:<14} ❌ {report['error']}")
+            continue
+        print(
+            f"{report['backend']:<14} {report['load_time']:>8.1f} {report['weights_mb']:>12.1f} "
+            f"{report['peak_rss_mb']:>13.0f} {report['tokens_per_second']:>9.2f}"
+        )
+    
+    for i, question in enumerate(questions):
+        print(f"\n❓ {question}")
+        for report in reports:
+            if 'error' not in report:
+                print(f"   [{report['backend']}] {report['answers'][i]}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+"""
+Compare ANN index specs against the exact flat index.
+
+Reports recall@k (overlap with the flat top-k) next to p50/p99
+single-query latency for each spec, using the embeddings stored in the
+on-disk RAG index. By default some stored chunks are held out of the
+indexes and used as queries, so no query has an indexed near-copy.
+
+    python benchmark_index.py --specs flat ivf_flat ivf_pq hnsw --k 3 --nprobe 8 --ef-search 64
+    python benchmark_index.py --queries questions.txt
+"""
+import argparse
+import time
+import numpy as np
+from src.index_store import IndexStore
+from src.retriever import INDEX_SPECS, build_index, set_search_params
+
+def load_queries(args, embeddings):
+    """
+    Query vectors and the vectors to index.
+    
+    --queries encodes real questions and searches every stored vector.
+    Otherwise num_queries stored vectors (at most a fifth) are held out of
+    the index and used as queries. --perturb instead queries indexed
+    vectors plus noise; each query then has a near-copy in the index, which
+    inflates recall.
+    
+    Returns:
+        tuple: (queries, vectors to index)
+    """
+    if args.queries:
+        from src.document_processor import load_embedding_model
+        with open(args.queries, 'r', encoding='utf-8') as f:
+            texts = [line.strip() for line in f if line.strip()]
+        model = load_embedding_model()
+        queries = model.encode(texts, convert_to_numpy=True, normalize_embeddings=True).astype('float32')
+        return queries, embeddings
+    
+    rng = np.random.default_rng(args.seed)
+    if args.perturb:
+        rows = rng.choice(len(embeddings), size=min(args.num_queries, len(embeddings)), replace=False)
+        queries = embeddings[rows] + rng.normal(0, args.noise, size=(len(rows), embeddings.shape[1]))
+        return queries.astype('float32'), embeddings
+    
+    held_out = np.zeros(len(embeddings), dtype=bool)
+    held_out[rng.choice(len(embeddings), size=min(args.num_queries, len(embeddings) // 5), replace=False)] = True
+    return embeddings[held_out], np.ascontiguousarray(embeddings[~held_out])
+
+def measure(index, queries, k):
+    """Run queries one at a time, returning result ids and per-query latency in ms"""
+    results = np.empty((len(queries), k), dtype=np.int64)
+    latencies = []
+    for i in range(len(queries)):
+        start = time.perf_counter()
+        _, ids = index.search(queries[i:i + 1], k)
+        latencies.append((time.perf_counter() - start) * 1000)
+        results[i] = ids[0]
+    return results, np.array(latencies)
+
+def recall_at_k(results, baseline):
+    """Average fraction of the exact top-k found by the ANN index"""
+    hits = 0
+    for found, expected in zip(results, baseline):
+        hits += len(set(found[found >= 0]) & set(expected[expected >= 0]))
+    return hits / max(1, baseline.size)
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark FAISS index specs for the RAG retriever")
+    parser.add_argument("--index-dir", default="rag_index")
+    parser.add_argument("--specs", nargs="+", default=list(INDEX_SPECS), choices=INDEX_SPECS)
+    parser.add_argument("--k", type=int, default=3)
+    parser.add_argument("--nprobe", type=int, default=None)
+    parser.add_argument("--ef-search", type=int, default=None)
+    parser.add_argument("--queries", default=None, help="text file with one query per line")
+    parser.add_argument("--num-queries", type=int, default=200)
+    parser.add_argument("--perturb", action="store_true",
+                        help="query indexed vectors plus noise instead of held-out ones (inflates recall)")
+    parser.add_argument("--noise", type=float, default=0.01, help="noise of --perturb queries")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    
+    stored = IndexStore(args.index_dir).load()
+    if stored is None:
+        print(f"❌ No index found in {args.index_dir}. Build it first with trrain_rag_model.py")
+        return
+    
+    embeddings = np.ascontiguousarray(stored['embeddings'], dtype='float32')
+    queries, embeddings = load_queries(args, embeddings)
+    if not len(queries):
+        print("❌ Too few stored vectors to hold any out as queries; pass --queries or --perturb")
+        return
+    k = min(args.k, len(embeddings))
+    print(f"📊 {len(embeddings)} indexed vectors, {len(queries)} queries, k={k}")
+    
+    baseline_index = build_index(embeddings, "flat")
+    baseline, _ = measure(baseline_index, queries, k)
+    
+    print(f"\n{'spec':<10} {'build(s)':>9} {'recall@k':>9} {'p50(ms)':>9} {'p99(ms)':>9}")
+    for spec in args.specs:
+        start = time.perf_counter()
+        try:
+            index = build_index(embeddings, spec)
+        except Exception as e:
+            print(f"{spec:<10} ❌ {e}")
+            continue
+        build_time = time.perf_counter() - start
+        set_search_params(index, nprobe=args.nprobe, ef_search=args.ef_search)
+        
+        results, latencies = measure(index, queries, k)
+        print(
+            f"{spec:<10} {build_time:>9.2f} {recall_at_k(results, baseline):>9.3f} "
+            f"{np.percentile(latencies, 50):>9.3f} {np.percentile(latencies, 99):>9.3f}"
+        )
+
+if __name__ == "__main__":
+    main()
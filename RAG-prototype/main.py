@@ -1,9 +1,12 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify, stream_with_context
 from flask_cors import CORS
 import os
+import json
 import logging
+import threading
 from datetime import datetime
-from trrain_rag_model import main, rebuild_rag_system, get_rag_manager
+from trrain_rag_model import main, main_stream, rebuild_rag_system, get_rag_manager
+from src.retriever import filter_key
 
 # Configure logging
 logging.basicConfig(
@@ -18,6 +21,7 @@ app = Flask(__name__)
 # Configure CORS
 CORS(app, resources={
     r"/ask": {"origins": ["https://starel-frontend.vercel.app", "http://localhost:3000"]},
+    r"/ask/stream": {"origins": ["https://starel-frontend.vercel.app", "http://localhost:3000"]},
     r"/health": {"origins": "*"},
     r"/rebuild": {"origins": ["https://starel-frontend.vercel.app", "http://localhost:3000"]}
 })
@@ -25,10 +29,14 @@ CORS(app, resources={
 # Global variables for system state
 system_initialized = False
 initialization_error = None
+initialization_attempted = False
+_initialization_lock = threading.Lock()
+_initialization_thread = None
+_initialization_thread_lock = threading.Lock()
 
 def initialize_system():
     """Initialize RAG system on startup"""
-    global system_initialized, initialization_error
+    global system_initialized, initialization_error, initialization_attempted
     try:
         logger.info("Initializing RAG system on startup...")
         rag_manager = get_rag_manager()
@@ -40,25 +48,76 @@ def initialize_system():
         system_initialized = False
         initialization_error = str(e)
         logger.error(f"Failed to initialize RAG system: {e}")
+    finally:
+        # Set last: callers that find it unset wait on the lock for the outcome
+        initialization_attempted = True
 
-# Initialize system on startup
-initialize_system()
+def ensure_initialized():
+    """
+    Initialize the RAG system on first use.
+    
+    Nothing is built at import time: ingestion workers are spawned
+    processes that re-import this module as __mp_main__, and they must not
+    open an index writer or load models of their own. A failed
+    initialization is not retried here; /rebuild retries it.
+    """
+    if initialization_attempted:
+        return
+    with _initialization_lock:
+        if not initialization_attempted:
+            initialize_system()
+
+def start_initialization():
+    """
+    Initialize the RAG system in a background thread, once.
+    
+    Under a WSGI server the __main__ block never runs, so the first health
+    probe starts initialization without waiting for it.
+    """
+    global _initialization_thread
+    with _initialization_thread_lock:
+        if _initialization_thread is None and not initialization_attempted:
+            _initialization_thread = threading.Thread(
+                target=ensure_initialized, name="rag-initialization", daemon=True
+            )
+            _initialization_thread.start()
 
 @app.route("/health", methods=['GET'])
 def health_check():
-    """Health check endpoint"""
+    """Health check endpoint; reports "initializing" until the first initialization finishes"""
+    start_initialization()
+    if system_initialized:
+        health = "healthy"
+    elif initialization_attempted:
+        health = "unhealthy"
+    else:
+        health = "initializing"
     return jsonify({
-        "status": "healthy" if system_initialized else "unhealthy",
+        "status": health,
         "initialized": system_initialized,
         "error": initialization_error,
         "timestamp": datetime.now().isoformat()
     })
 
+def _request_filters():
+    """Optional retrieval filters of a request, as (filters, error message)"""
+    filters = request.json.get("filters")
+    if filters is None:
+        return None, None
+    if not isinstance(filters, dict):
+        return None, 'filters must be an object, e.g. {"category": "academic_docs"}'
+    try:
+        filter_key(filters)
+    except (ValueError, TypeError) as e:
+        return None, str(e)
+    return filters, None
+
 @app.route("/ask", methods=['POST'])
 def ask():
     """Main endpoint for asking questions"""
     try:
         # Check if system is initialized
+        ensure_initialized()
         if not system_initialized:
             return jsonify({
                 "error": "RAG system not initialized",
@@ -73,11 +132,15 @@ def ask():
         if not user_prompt:
             return jsonify({"error": "User prompt not specified or empty"}), 400
         
+        filters, filters_error = _request_filters()
+        if filters_error:
+            return jsonify({"error": filters_error}), 400
+        
         # Log the request
         logger.info(f"Received query: {user_prompt[:100]}...")
         
         # Generate response
-        response = main(user_prompt)
+        response = main(user_prompt, filters=filters)
         
         # Check if response indicates an error
         if response.startswith("Error:"):
@@ -101,6 +164,51 @@ def ask():
             "details": error_msg
         }), 500
 
+def _sse(data, event=None):
+    """Format a server-sent event"""
+    message = f"event: {event}\n" if event else ""
+    return message + f"data: {json.dumps(data)}\n\n"
+
+@app.route("/ask/stream", methods=['POST'])
+def ask_stream():
+    """Streaming endpoint: sends the answer as server-sent events while it is generated"""
+    ensure_initialized()
+    if not system_initialized:
+        return jsonify({
+            "error": "RAG system not initialized",
+            "details": initialization_error
+        }), 503
+    
+    if not request.json:
+        return jsonify({"error": "Request must contain JSON data"}), 400
+    
+    user_prompt = request.json.get("prompt", "").strip()
+    if not user_prompt:
+        return jsonify({"error": "User prompt not specified or empty"}), 400
+    
+    filters, filters_error = _request_filters()
+    if filters_error:
+        return jsonify({"error": filters_error}), 400
+    
+    logger.info(f"Received streaming query: {user_prompt[:100]}...")
+    
+    def generate():
+        try:
+            for text in main_stream(user_prompt, filters=filters):
+                yield _sse({"token": text})
+            yield _sse({"timestamp": datetime.now().isoformat()}, event="done")
+            logger.info("Streaming response completed")
+        except Exception as e:
+            error_msg = f"Unexpected error: {str(e)}"
+            logger.error(error_msg)
+            yield _sse({"error": "Internal server error", "details": error_msg}, event="error")
+    
+    return Response(
+        stream_with_context(generate()),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 @app.route("/rebuild", methods=['POST'])
 def rebuild():
     """Endpoint to rebuild RAG system"""
@@ -109,8 +217,9 @@ def rebuild():
         rebuild_rag_system()
         
         # Re-initialize system state
-        global system_initialized, initialization_error
+        global system_initialized, initialization_error, initialization_attempted
         system_initialized = True
+        initialization_attempted = True
         initialization_error = None
         
         logger.info("RAG system rebuilt successfully")
@@ -132,13 +241,34 @@ def status():
     """Get detailed system status"""
     try:
         rag_manager = get_rag_manager()
-        cache_exists = os.path.exists(rag_manager.cache_file)
+        cache_exists = rag_manager.index_store.exists()
+        rag_system = rag_manager.rag_system
+        generation_batcher = rag_system.generation_batcher if rag_system else None
         
         return jsonify({
             "system_initialized": system_initialized,
             "cache_exists": cache_exists,
-            "cache_file": rag_manager.cache_file,
-            "data_directory": rag_manager.data_directory,
+            "index_dir": rag_manager.config.index_dir,
+            "pipeline_mode": rag_manager.config.pipeline_mode,
+            "retrieval_batch_window_ms": rag_manager.config.retrieval_batch_window_ms,
+            "query_cache": rag_manager.query_cache.stats() if rag_manager.query_cache else None,
+            "answer_cache": rag_manager.answer_cache.stats() if rag_manager.answer_cache else None,
+            "web_cache": rag_manager.web_cache.stats() if rag_manager.web_cache else None,
+            "prompt_screening": rag_system.checkPrompt.stats if rag_system else None,
+            "generator": {
+                "backend": rag_system.generator_backend,
+                "weights_mb": round(rag_system.generator_footprint / 2**20, 1)
+            } if rag_system else None,
+            "retrieval_mode": rag_manager.config.retrieval_mode,
+            "web_augmentation": rag_system.web_augmentation_stats() if rag_system else None,
+            "embedding_backend": rag_manager.config.embedding_backend,
+            "embedding_parity": rag_manager.embedding_parity,
+            "ingestion": rag_manager.ingestion_stats,
+            "generation_batching": generation_batcher.stats() if generation_batcher else None,
+            "prefix_cache": rag_system.prefix_cache.stats() if rag_system and rag_system.prefix_cache else None,
+            "prompt_packing": rag_system.context_packer.stats() if rag_system else None,
+            "reranker": rag_manager.reranker.stats() if rag_manager.reranker else None,
+            "data_directory": rag_manager.config.data_directory,
             "initialization_error": initialization_error,
             "timestamp": datetime.now().isoformat()
         })
@@ -154,7 +284,7 @@ def not_found(error):
     """Handle 404 errors"""
     return jsonify({
         "error": "Endpoint not found",
-        "available_endpoints": ["/ask", "/health", "/rebuild", "/status"]
+        "available_endpoints": ["/ask", "/ask/stream", "/health", "/rebuild", "/status"]
     }), 404
 
 @app.errorhandler(500)
@@ -170,6 +300,9 @@ if __name__ == '__main__':
     port = int(os.environ.get("PORT", 5000))
     debug_mode = os.environ.get("FLASK_ENV") == "development"
     
+    # Build or load the index before serving instead of on the first request
+    ensure_initialized()
+    
     logger.info(f"Starting Flask app on port {port}")
     logger.info(f"Debug mode: {debug_mode}")
     logger.info(f"System initialized: {system_initialized}")
@@ -0,0 +1,106 @@
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+import numpy as np
+
+def chunk_set_key(chunks, mode="default"):
+    """Order-independent key for a set of retrieved chunks"""
+    digests = sorted(
+        hashlib.md5((chunk['source'] + "\0" + chunk['text']).encode('utf-8')).hexdigest()
+        for chunk in chunks
+    )
+    return mode + ":" + hashlib.md5("|".join(digests).encode('utf-8')).hexdigest()
+
+class SemanticAnswerCache:
+    """
+    Answer cache keyed on query-embedding similarity.
+    
+    A lookup hits when a stored question has cosine similarity of at least
+    similarity_threshold with the new one *and* was answered from the same
+    retrieved chunk set, so a cached answer is only reused when the model
+    would have seen the same context. Entries expire after ttl_seconds and
+    the least recently used entry is evicted beyond max_size.
+    """
+
+    def __init__(self, similarity_threshold=0.95, max_size=512, ttl_seconds=3600):
+        self.similarity_threshold = similarity_threshold
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()
+        self._next_id = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def _normalize(vector):
+        vector = np.asarray(vector, dtype='float32').reshape(-1)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm > 0 else vector
+
+    def _expired(self, created_at):
+        return self.ttl_seconds is not None and time.time() - created_at > self.ttl_seconds
+
+    def _drop_expired(self):
+        expired = [key for key, entry in self._entries.items() if self._expired(entry['created_at'])]
+        for key in expired:
+            del self._entries[key]
+            self.evictions += 1
+
+    def lookup(self, query_vector, context_key):
+        """Return the cached answer for a similar question over the same chunks, or None"""
+        query_vector = self._normalize(query_vector)
+        with self._lock:
+            self._drop_expired()
+            candidates = [
+                (key, entry) for key, entry in self._entries.items()
+                if entry['context_key'] == context_key
+            ]
+            if not candidates:
+                self.misses += 1
+                return None
+            
+            similarities = np.stack([entry['vector'] for _, entry in candidates]) @ query_vector
+            best = int(np.argmax(similarities))
+            if similarities[best] < self.similarity_threshold:
+                self.misses += 1
+                return None
+            
+            key, entry = candidates[best]
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry['answer']
+
+    def store(self, query_vector, context_key, answer):
+        """Cache an answer for a question embedding and its chunk set"""
+        with self._lock:
+            self._entries[self._next_id] = {
+                'vector': self._normalize(query_vector),
+                'context_key': context_key,
+                'answer': answer,
+                'created_at': time.time()
+            }
+            self._next_id += 1
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        """Invalidate every cached answer, e.g. after the index is rebuilt"""
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'max_size': self.max_size,
+                'similarity_threshold': self.similarity_threshold,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': self.hits / lookups if lookups else 0.0
+            }
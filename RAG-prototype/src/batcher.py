@@ -0,0 +1,292 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future
+import torch
+from .retriever import filter_key
+
+class RetrievalBatcher:
+    """
+    Coalesces concurrent retrieve() calls into Retriever.retrieve_batch.
+    
+    Each caller enqueues its query and blocks on a future. A worker thread
+    takes the first waiting query, keeps collecting for up to
+    max_wait_ms (or until max_batch_size queries are waiting), then runs a
+    single batched encode + search and hands every caller its own result.
+    Other attributes are forwarded to the wrapped retriever, so it can be
+    dropped in wherever a Retriever is expected.
+    """
+
+    def __init__(self, retriever, max_wait_ms=5, max_batch_size=32):
+        self.retriever = retriever
+        self.max_wait = max_wait_ms / 1000.0
+        self.max_batch_size = max_batch_size
+        self._queue = queue.Queue()
+        self._closed = False
+        # Orders enqueues before close()'s sentinel, so the worker sees every request
+        self._close_lock = threading.Lock()
+        self._worker = threading.Thread(target=self._run, name="retrieval-batcher", daemon=True)
+        self._worker.start()
+
+    def __getattr__(self, name):
+        return getattr(self.retriever, name)
+
+    def retrieve_with_scores(self, query, top_k=3, filters=None):
+        """Queue a query and wait for its (chunk, score) results"""
+        future = Future()
+        with self._close_lock:
+            closed = self._closed
+            if not closed:
+                self._queue.put((query, top_k, filters, future))
+        if closed:
+            return self.retriever.retrieve_batch([query], top_k, filters=filters)[0]
+        return future.result()
+
+    def retrieve(self, query, top_k=3, filters=None):
+        """Same contract as Retriever.retrieve, served from a shared batch"""
+        return [chunk for chunk, _ in self.retrieve_with_scores(query, top_k, filters=filters)]
+
+    def retrieve_batch(self, queries, top_k=3, filters=None):
+        return self.retriever.retrieve_batch(queries, top_k, filters=filters)
+
+    def close(self):
+        """Stop the worker thread; later calls go straight to the retriever"""
+        with self._close_lock:
+            if self._closed:
+                return
+            self._closed = True
+            self._queue.put(None)
+
+    def _collect(self, first):
+        """Gather requests that arrive within the batching window"""
+        batch = [first]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                item = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if item is None:
+                self._queue.put(None)
+                break
+            batch.append(item)
+        return batch
+
+    def _dispatch(self, batch):
+        """Search once per distinct filter with the largest top_k and trim per request"""
+        groups = {}
+        for item in batch:
+            try:
+                key = filter_key(item[2])
+            except ValueError as e:
+                item[3].set_exception(e)
+                continue
+            groups.setdefault(key, []).append(item)
+        
+        for group in groups.values():
+            queries = [query for query, _, _, _ in group]
+            top_k = max(k for _, k, _, _ in group)
+            try:
+                results = self.retriever.retrieve_batch(queries, top_k, filters=group[0][2])
+            except Exception as e:
+                for _, _, _, future in group:
+                    future.set_exception(e)
+                continue
+            for (_, k, _, future), result in zip(group, results):
+                future.set_result(result[:k])
+
+    def _run(self):
+        while True:
+            first = self._queue.get()
+            if first is None:
+                break
+            self._dispatch(self._collect(first))
+        
+        # Serve anything that raced with close()
+        pending = []
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is not None:
+                pending.append(item)
+        if pending:
+            self._dispatch(pending)
+
+class GenerationBatcher:
+    """
+    Dynamic batching for LLM generation.
+    
+    Callers tokenize their prompt and block on a future. A worker thread
+    gathers waiting prompts for up to max_wait_ms, as long as the batch
+    stays within max_batch_size requests and max_batch_tokens padded
+    tokens (prompt plus new tokens per row). It left-pads them, runs one
+    generate() call and returns each caller only its own new text.
+    """
+
+    def __init__(self, model, tokenizer, generation_kwargs=None, max_batch_size=8,
+                 max_wait_ms=20, max_batch_tokens=16384):
+        self.model = model
+        self.tokenizer = tokenizer
+        self.generation_kwargs = dict(generation_kwargs or {})
+        self.max_new_tokens = self.generation_kwargs.get('max_new_tokens', 256)
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self.max_batch_tokens = max_batch_tokens
+        self.pad_token_id = tokenizer.eos_token_id
+        
+        self._queue = queue.Queue()
+        self._carry = None
+        self._closed = False
+        # Orders enqueues before close()'s sentinel, so the worker sees every request
+        self._close_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._stats = {
+            'batches': 0,
+            'requests': 0,
+            'padded_tokens': 0,
+            'prompt_tokens': 0,
+            'total_queue_wait': 0.0,
+            'max_queue_wait': 0.0
+        }
+        self._worker = threading.Thread(target=self._run, name="generation-batcher", daemon=True)
+        self._worker.start()
+
+    def generate(self, input_ids, prefix=None):
+        """
+        Queue a tokenized prompt and wait for its generated text.
+        
+        A cached prefix is not reused here: left padding would put pad
+        tokens between it and the rest of the prompt, so every row is
+        prefilled in full.
+        """
+        future = Future()
+        item = (input_ids, time.monotonic(), future)
+        with self._close_lock:
+            closed = self._closed
+            if not closed:
+                self._queue.put(item)
+        if closed:
+            self._dispatch([item])
+        return future.result()
+
+    def close(self):
+        """Stop the worker thread; later calls generate unbatched"""
+        with self._close_lock:
+            if self._closed:
+                return
+            self._closed = True
+            self._queue.put(None)
+
+    def _batch_cost(self, batch):
+        longest = max(len(input_ids) for input_ids, _, _ in batch)
+        return (longest + self.max_new_tokens) * len(batch)
+
+    def _collect(self):
+        """Gather requests within the wait window, size limit and token budget"""
+        first = self._carry if self._carry is not None else self._queue.get()
+        self._carry = None
+        if first is None:
+            return None
+        
+        batch = [first]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                item = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if item is None:
+                self._queue.put(None)
+                break
+            if self._batch_cost(batch + [item]) > self.max_batch_tokens:
+                # Starts the next batch instead
+                self._carry = item
+                break
+            batch.append(item)
+        return batch
+
+    def _run_batch(self, batch):
+        started = time.monotonic()
+        longest = max(len(input_ids) for input_ids, _, _ in batch)
+        
+        # Left padding keeps every prompt's last token aligned for decoding
+        input_ids = torch.full((len(batch), longest), self.pad_token_id, dtype=torch.long)
+        attention_mask = torch.zeros((len(batch), longest), dtype=torch.long)
+        for row, (ids, _, _) in enumerate(batch):
+            input_ids[row, longest - len(ids):] = torch.tensor(ids, dtype=torch.long)
+            attention_mask[row, longest - len(ids):] = 1
+        
+        with torch.no_grad():
+            outputs = self.model.generate(
+                input_ids=input_ids.to(self.model.device),
+                attention_mask=attention_mask.to(self.model.device),
+                **self.generation_kwargs,
+                pad_token_id=self.pad_token_id
+            )
+        texts = self.tokenizer.batch_decode(outputs[:, longest:], skip_special_tokens=True)
+        
+        with self._stats_lock:
+            self._stats['batches'] += 1
+            self._stats['requests'] += len(batch)
+            self._stats['padded_tokens'] += longest * len(batch)
+            self._stats['prompt_tokens'] += sum(len(ids) for ids, _, _ in batch)
+            for _, enqueued_at, _ in batch:
+                wait_time = started - enqueued_at
+                self._stats['total_queue_wait'] += wait_time
+                self._stats['max_queue_wait'] = max(self._stats['max_queue_wait'], wait_time)
+        return texts
+
+    def _dispatch(self, batch):
+        try:
+            texts = self._run_batch(batch)
+        except Exception as e:
+            for _, _, future in batch:
+                future.set_exception(e)
+            return
+        for (_, _, future), text in zip(batch, texts):
+            future.set_result(text)
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            if batch is None:
+                break
+            self._dispatch(batch)
+        
+        # Serve anything that raced with close(), one prompt at a time
+        pending = [self._carry] if self._carry is not None else []
+        self._carry = None
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is not None:
+                pending.append(item)
+        for item in pending:
+            self._dispatch([item])
+
+    def stats(self):
+        """Batch fill and queue wait metrics"""
+        with self._stats_lock:
+            stats = dict(self._stats)
+        batches = stats['batches'] or 1
+        requests = stats['requests'] or 1
+        return {
+            'mode': 'static',
+            'batches': stats['batches'],
+            'requests': stats['requests'],
+            'avg_batch_size': stats['requests'] / batches,
+            'avg_batch_fill': stats['requests'] / (batches * self.max_batch_size),
+            'padding_efficiency': stats['prompt_tokens'] / (stats['padded_tokens'] or 1),
+            'avg_queue_wait_ms': 1000 * stats['total_queue_wait'] / requests,
+            'max_queue_wait_ms': 1000 * stats['max_queue_wait']
+        }
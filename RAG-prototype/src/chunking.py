@@ -0,0 +1,171 @@
+import os
+import re
+import hashlib
+from bisect import bisect_right
+import logging
+# Not AutoTokenizer: importing it pulls in torch, which the chunking
+# workers never need
+from transformers import PreTrainedTokenizerFast
+from .document_loaders import LOADERS, supported_extensions, load_units
+
+logger = logging.getLogger(__name__)
+
+CHUNK_TOKENIZER_NAME = "google/gemma-2b-it"
+CHUNK_MAX_TOKENS = 256  # Max tokens per chunk
+CHUNK_OVERLAP_TOKENS = 0
+CHUNK_BOUNDARIES = ("none", "sentence", "paragraph")
+
+PARAGRAPH_BREAK = re.compile(r'\r?\n[ \t]*\r?\n\s*')
+SENTENCE_BREAK = re.compile(r'[.!?]["\')\]]*\s+')
+
+def iter_document_paths(directory="data"):
+    """
+    Yields the path of every file under the directory that has a usable
+    loader, in walk order. Files whose loader needs a missing optional
+    package are skipped with a warning.
+    """
+    usable = supported_extensions()
+    for root, _, files in os.walk(directory):
+        for file in files:
+            extension = os.path.splitext(file)[1].lower()
+            if extension in usable:
+                yield os.path.join(root, file)
+            elif extension in LOADERS:
+                logger.warning(f"Skipping {file}: the {extension} loader's optional dependency is not installed")
+
+def document_category(file_path, directory="data"):
+    """
+    Category of a document: its top-level folder under the data directory
+    (e.g. "academic_docs"), or "" for files directly in it.
+    """
+    relative = os.path.relpath(file_path, directory)
+    parts = relative.split(os.sep)
+    return parts[0] if len(parts) > 1 else ""
+
+def file_hash(file_path, block_size=1 << 20):
+    """
+    MD5 of a file's raw bytes, read in blocks.
+    """
+    digest = hashlib.md5()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def iter_documents(directory="data"):
+    """
+    Lazily yields document units (a text block, page or section) one at a
+    time, so a large file never sits in memory whole. Each unit has 'text',
+    'source' and 'offset', plus 'page' and 'heading' where the format has them.
+    """
+    for file_path in iter_document_paths(directory):
+        yield from load_units(file_path)
+
+def load_documents(directory="data"):
+    """
+    Loads all supported files from the specified directory and its subdirectories.
+    Returns a list of document units with 'text' and 'source'.
+    """
+    return list(iter_documents(directory))
+
+def load_chunk_tokenizer():
+    """
+    Loads the fast (Rust) tokenizer used to split documents into chunks.
+    Only offset mappings are needed, so the slow tokenizer is never used.
+    """
+    return PreTrainedTokenizerFast.from_pretrained(CHUNK_TOKENIZER_NAME)
+
+def _break_tokens(text, offsets, boundary):
+    """
+    Map paragraph/sentence boundaries in text to token indices.
+    Returns {token index: strength}, where cutting before that token ends a
+    sentence (1) or a paragraph (2).
+    """
+    patterns = []
+    if boundary in ("sentence", "paragraph"):
+        patterns.append((SENTENCE_BREAK, 1))
+    if boundary == "paragraph":
+        patterns.append((PARAGRAPH_BREAK, 2))
+    
+    token_ends = [end for _, end in offsets]
+    breaks = {}
+    for pattern, strength in patterns:
+        for match in pattern.finditer(text):
+            # First token that ends after the boundary starts the next unit
+            k = bisect_right(token_ends, match.end())
+            if 0 < k < len(offsets):
+                breaks[k] = max(breaks.get(k, 0), strength)
+    return breaks
+
+def chunk_text(text, tokenizer, max_length=CHUNK_MAX_TOKENS, overlap=CHUNK_OVERLAP_TOKENS, boundary="paragraph"):
+    """
+    Splits one text into chunks of at most max_length tokens.
+    
+    The text is tokenized once and cut by the tokens' character offsets, so
+    every chunk is an exact slice of the original text. With a boundary
+    other than "none", a chunk is ended at the last paragraph (or failing
+    that, sentence) break in the second half of its window. Consecutive
+    chunks share overlap tokens.
+    
+    Returns:
+        list: (chunk text, start offset, end offset) tuples
+    """
+    if boundary not in CHUNK_BOUNDARIES:
+        raise ValueError(f"Unknown chunk boundary '{boundary}', expected one of {CHUNK_BOUNDARIES}")
+    if not 0 <= overlap < max_length:
+        raise ValueError("overlap must be smaller than max_length")
+    
+    offsets = tokenizer(text, add_special_tokens=False, return_offsets_mapping=True)['offset_mapping']
+    breaks = _break_tokens(text, offsets, boundary)
+    min_length = max(1, max_length // 2)
+    
+    chunks = []
+    i = 0
+    while i < len(offsets):
+        cut = min(i + max_length, len(offsets))
+        if cut < len(offsets) and breaks:
+            candidates = [k for k in range(cut, i + min_length, -1) if k in breaks]
+            if candidates:
+                strongest = max(breaks[k] for k in candidates)
+                cut = next(k for k in candidates if breaks[k] == strongest)
+        
+        start, end = offsets[i][0], offsets[cut - 1][1]
+        # Trim surrounding whitespace but keep the offsets exact
+        while start < end and text[start].isspace():
+            start += 1
+        while end > start and text[end - 1].isspace():
+            end -= 1
+        if end > start:
+            chunks.append((text[start:end], start, end))
+        
+        if cut >= len(offsets):
+            break
+        i = max(cut - overlap, i + 1)
+    return chunks
+
+def chunk_unit(unit, tokenizer, max_length=CHUNK_MAX_TOKENS, overlap=CHUNK_OVERLAP_TOKENS, boundary="paragraph"):
+    """
+    Chunks one document unit. Each chunk records its character span (in the
+    file for text formats, in the page/section otherwise) and carries the
+    unit's page and heading.
+    """
+    offset = unit.get('offset', 0)
+    chunks = []
+    for chunk, start, end in chunk_text(unit['text'], tokenizer, max_length, overlap, boundary):
+        chunk_doc = {"text": chunk, "source": unit['source'], "start": offset + start, "end": offset + end}
+        for key in ("page", "heading"):
+            if key in unit:
+                chunk_doc[key] = unit[key]
+        chunks.append(chunk_doc)
+    return chunks
+
+def chunk_documents(documents, max_length=CHUNK_MAX_TOKENS, overlap=CHUNK_OVERLAP_TOKENS, boundary="paragraph"):
+    """
+    Splits documents into smaller chunks for better retrieval.
+    """
+    tokenizer = load_chunk_tokenizer()
+    chunked_docs = []
+
+    for doc in documents:
+        chunked_docs.extend(chunk_unit(doc, tokenizer, max_length, overlap, boundary))
+    return chunked_docs
@@ -0,0 +1,138 @@
+import os
+from dataclasses import dataclass
+from typing import Optional
+from .chunking import CHUNK_MAX_TOKENS, CHUNK_OVERLAP_TOKENS
+from .generator_backend import ONNX_EXPORT_DIR
+
+def _flag(value):
+    return value != "0"
+
+@dataclass
+class RAGConfig:
+    """
+    Settings of a RAGManager and the RAGSystem it builds.
+
+    Defaults keep the baseline behaviour: chunk deduplication, hybrid
+    retrieval, web-search skipping and reranking are opt-in. from_env()
+    reads every field listed in ENV_VARS from the environment.
+    """
+    # Corpus and on-disk index
+    data_directory: str = "data"
+    index_dir: str = "rag_index"
+    embedding_dtype: str = "float32"
+    index_spec: str = "flat"
+    index_params: Optional[dict] = None
+    nprobe: Optional[int] = None
+    ef_search: Optional[int] = None
+
+    # Ingestion
+    embedding_backend: str = "torch"
+    embedding_parity_tolerance: float = 0.02
+    ingestion_workers: Optional[int] = None
+    ingestion_batch_size: int = 64
+    ingestion_queue_size: int = 8
+    chunk_max_tokens: int = CHUNK_MAX_TOKENS
+    chunk_overlap: int = CHUNK_OVERLAP_TOKENS
+    chunk_boundary: str = "paragraph"
+    # Falsy turns chunk deduplication off
+    dedup_threshold: Optional[float] = None
+
+    # Retrieval
+    retrieval_mode: str = "dense"
+    hybrid_candidates: int = 20
+    retrieval_top_k: int = 3
+    retrieval_batch_window_ms: float = 0
+    retrieval_max_batch_size: int = 32
+    reranking: bool = False
+    rerank_candidates: int = 50
+    rerank_budget_ms: Optional[float] = 250
+    rerank_batch_size: int = 16
+
+    # Caches
+    query_cache_size: int = 1024
+    query_cache_ttl: Optional[float] = None
+    query_cache_path: Optional[str] = None
+    answer_cache_size: int = 512
+    answer_cache_ttl: Optional[float] = 3600
+    answer_cache_threshold: float = 0.95
+    web_cache_path: Optional[str] = "web_cache.sqlite"
+
+    # Request pipeline and generation
+    pipeline_mode: str = "sequential"
+    stage_timeouts: Optional[dict] = None
+    remote_screening_fallback: bool = True
+    web_skip_threshold: Optional[float] = None
+    prompt_token_budget: int = 2048
+    local_prompt_token_budget: int = 1024
+    web_context_share: float = 0.25
+    generator_backend: str = "default"
+    onnx_export_dir: str = ONNX_EXPORT_DIR
+    generation_batch_size: int = 1
+    generation_max_wait_ms: float = 20
+    generation_max_batch_tokens: int = 16384
+    generation_batching: str = "static"
+    prefix_caching: bool = True
+
+    @classmethod
+    def from_env(cls, environ=None, **overrides):
+        """
+        Build a config from environment variables. Unset ones keep their
+        default; an empty one sets the field to None, which turns optional
+        settings off (e.g. WEB_CACHE_PATH= disables the web cache).
+
+        Args:
+            environ (dict): variables to read, os.environ by default
+            overrides: fields set explicitly, taking precedence over environ
+        """
+        environ = os.environ if environ is None else environ
+        values = {}
+        for name, (variable, parse) in ENV_VARS.items():
+            value = environ.get(variable)
+            if value is not None:
+                values[name] = parse(value) if value else None
+        values.update(overrides)
+        return cls(**values)
+
+# Field -> (environment variable, parser)
+ENV_VARS = {
+    'index_spec': ("RAG_INDEX_SPEC", str),
+    'nprobe': ("RAG_NPROBE", int),
+    'ef_search': ("RAG_EF_SEARCH", int),
+    'embedding_backend': ("EMBEDDING_BACKEND", str),
+    'embedding_parity_tolerance': ("EMBEDDING_PARITY_TOLERANCE", float),
+    'ingestion_workers': ("INGEST_WORKERS", int),
+    'ingestion_batch_size': ("INGEST_BATCH_SIZE", int),
+    'ingestion_queue_size': ("INGEST_QUEUE_SIZE", int),
+    'chunk_max_tokens': ("CHUNK_MAX_TOKENS", int),
+    'chunk_overlap': ("CHUNK_OVERLAP", int),
+    'chunk_boundary': ("CHUNK_BOUNDARY", str),
+    'dedup_threshold': ("DEDUP_THRESHOLD", float),
+    'retrieval_mode': ("RETRIEVAL_MODE", str),
+    'hybrid_candidates': ("HYBRID_CANDIDATES", int),
+    'retrieval_top_k': ("RETRIEVAL_TOP_K", int),
+    'retrieval_batch_window_ms': ("RETRIEVAL_BATCH_WINDOW_MS", float),
+    'reranking': ("RERANKING", _flag),
+    'rerank_candidates': ("RERANK_CANDIDATES", int),
+    'rerank_budget_ms': ("RERANK_BUDGET_MS", float),
+    'rerank_batch_size': ("RERANK_BATCH_SIZE", int),
+    'query_cache_size': ("QUERY_CACHE_SIZE", int),
+    'query_cache_ttl': ("QUERY_CACHE_TTL", float),
+    'query_cache_path': ("QUERY_CACHE_PATH", str),
+    'answer_cache_size': ("ANSWER_CACHE_SIZE", int),
+    'answer_cache_ttl': ("ANSWER_CACHE_TTL", float),
+    'answer_cache_threshold': ("ANSWER_CACHE_THRESHOLD", float),
+    'web_cache_path': ("WEB_CACHE_PATH", str),
+    'pipeline_mode': ("PIPELINE_MODE", str),
+    'remote_screening_fallback': ("REMOTE_SCREENING_FALLBACK", _flag),
+    'web_skip_threshold': ("WEB_SKIP_THRESHOLD", float),
+    'prompt_token_budget': ("PROMPT_TOKEN_BUDGET", int),
+    'local_prompt_token_budget': ("LOCAL_PROMPT_TOKEN_BUDGET", int),
+    'web_context_share': ("WEB_CONTEXT_SHARE", float),
+    'generator_backend': ("GENERATOR_BACKEND", str),
+    'onnx_export_dir': ("ONNX_EXPORT_DIR", str),
+    'generation_batch_size': ("GENERATION_MAX_BATCH_SIZE", int),
+    'generation_max_wait_ms': ("GENERATION_MAX_WAIT_MS", float),
+    'generation_max_batch_tokens': ("GENERATION_MAX_BATCH_TOKENS", int),
+    'generation_batching': ("GENERATION_BATCHING", str),
+    'prefix_caching': ("PREFIX_CACHE", _flag),
+}
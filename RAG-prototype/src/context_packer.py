@@ -0,0 +1,162 @@
+import threading
+
+# Scaffolding of the prompt suffix that follows the instruction prefix:
+# context, optional web section, then the question and the answer cue
+CONTEXT_OPEN = "            "
+CHUNK_SEPARATOR = "\n"
+WEB_HEADER = "\n\n            Additional Web Information:\n            "
+QUESTION_HEADER = "\n\n            Question: "
+ANSWER_CUE = "\n\n            Answer:\n            "
+
+PROMPT_SECTIONS = ("instructions", "template", "question", "context", "web")
+
+class PackedPrompt:
+    """Token ids of a packed prompt and how its token budget was spent"""
+
+    def __init__(self, prefix_ids, suffix_ids, chunks, tokens, dropped_chunks, truncated):
+        self.prefix_ids = prefix_ids
+        self.suffix_ids = suffix_ids
+        # The retrieved chunks that made it into the context, in prompt order
+        self.chunks = chunks
+        # Tokens per section, see PROMPT_SECTIONS
+        self.tokens = tokens
+        self.dropped_chunks = dropped_chunks
+        self.truncated = truncated
+
+    @property
+    def total_tokens(self):
+        return sum(self.tokens.values())
+
+class ContextPacker:
+    """
+    Fits a prompt into a token budget instead of letting the tokenizer
+    truncate it.
+
+    Every piece (question, retrieved chunks, web summary) is tokenized
+    once, in one batched call. The instructions, the template scaffolding
+    and the question are always kept. Retrieved chunks then fill the rest
+    of the budget in relevance order (the retriever's ranking), skipping
+    chunks that no longer fit. The web summary is guaranteed up to
+    web_share of the remaining tokens, plus whatever the chunks leave
+    unused, and is cut at a token boundary. Prompt ids are assembled from
+    the pieces, so nothing is re-tokenized or truncated afterwards.
+    """
+
+    def __init__(self, tokenizer, web_share=0.25):
+        if not 0.0 <= web_share <= 1.0:
+            raise ValueError("web_share must be between 0 and 1")
+        self.tokenizer = tokenizer
+        self.web_share = web_share
+        # Static strings (instruction prefixes, scaffolding) -> token ids
+        self._static = {}
+        self._lock = threading.Lock()
+        self._stats = {'prompts': 0, 'dropped_chunks': 0, 'truncated_prompts': 0, 'max_prompt_tokens': 0}
+        self._stats.update({f'{section}_tokens': 0 for section in PROMPT_SECTIONS})
+
+    def _static_ids(self, text, add_special_tokens=False):
+        key = (text, add_special_tokens)
+        ids = self._static.get(key)
+        if ids is None:
+            ids = self.tokenizer(text, add_special_tokens=add_special_tokens)['input_ids']
+            self._static[key] = ids
+        return ids
+
+    def pack(self, prefix, query, chunks, budget, web_summary=None):
+        """
+        Packs a prompt into at most budget tokens.
+
+        Args:
+            prefix (str): static instruction prefix, tokenized with special tokens
+            query (str): the user's question
+            chunks (list): retrieved chunks, most relevant first
+            budget (int): total prompt tokens, instructions included
+            web_summary (str): web augmentation text, None for local-only prompts
+
+        Returns:
+            PackedPrompt: prefix and suffix token ids plus per-section token counts
+        """
+        texts = [query] + [chunk['text'] for chunk in chunks]
+        if web_summary is not None:
+            texts.append(web_summary)
+        pieces = self.tokenizer(texts, add_special_tokens=False)['input_ids']
+        query_ids, chunk_ids = pieces[0], pieces[1:1 + len(chunks)]
+        web_ids = pieces[-1] if web_summary is not None else None
+
+        prefix_ids = self._static_ids(prefix, add_special_tokens=True)
+        open_ids = self._static_ids(CONTEXT_OPEN)
+        separator_ids = self._static_ids(CHUNK_SEPARATOR)
+        web_header_ids = self._static_ids(WEB_HEADER) if web_ids is not None else []
+        question_ids = self._static_ids(QUESTION_HEADER)
+        answer_ids = self._static_ids(ANSWER_CUE)
+        template_tokens = len(open_ids) + len(web_header_ids) + len(question_ids) + len(answer_ids)
+
+        truncated = False
+        room = max(budget - len(prefix_ids) - template_tokens, 0)
+        # Only a question longer than the whole budget is cut
+        if len(query_ids) > room:
+            query_ids = query_ids[:room]
+            truncated = True
+        available = room - len(query_ids)
+
+        web_reserve = min(len(web_ids), int(available * self.web_share)) if web_ids is not None else 0
+        context_budget = available - web_reserve
+        context_ids, packed_chunks = [], []
+        for chunk, token_ids in zip(chunks, chunk_ids):
+            cost = len(token_ids) + (len(separator_ids) if context_ids else 0)
+            if len(context_ids) + cost > context_budget:
+                continue
+            if context_ids:
+                context_ids.extend(separator_ids)
+            context_ids.extend(token_ids)
+            packed_chunks.append(chunk)
+        if not packed_chunks and chunks and context_budget > 0:
+            # Keep at least the start of the best chunk
+            context_ids = list(chunk_ids[0][:context_budget])
+            packed_chunks.append(chunks[0])
+            truncated = True
+
+        suffix_ids = open_ids + context_ids
+        if web_ids is not None:
+            web_budget = available - len(context_ids)
+            if len(web_ids) > web_budget:
+                web_ids = web_ids[:web_budget]
+                truncated = True
+            suffix_ids += web_header_ids + web_ids
+        suffix_ids += question_ids + query_ids + answer_ids
+
+        tokens = {
+            'instructions': len(prefix_ids),
+            'template': template_tokens,
+            'question': len(query_ids),
+            'context': len(context_ids),
+            'web': len(web_ids) if web_ids is not None else 0
+        }
+        packed = PackedPrompt(
+            prefix_ids, suffix_ids, packed_chunks, tokens, len(chunks) - len(packed_chunks), truncated
+        )
+        self._record(packed)
+        return packed
+
+    def _record(self, packed):
+        with self._lock:
+            self._stats['prompts'] += 1
+            self._stats['dropped_chunks'] += packed.dropped_chunks
+            self._stats['truncated_prompts'] += int(packed.truncated)
+            self._stats['max_prompt_tokens'] = max(self._stats['max_prompt_tokens'], packed.total_tokens)
+            for section, count in packed.tokens.items():
+                self._stats[f'{section}_tokens'] += count
+
+    def stats(self):
+        """Average tokens per prompt section, dropped chunks and truncations"""
+        with self._lock:
+            stats = dict(self._stats)
+        prompts = stats['prompts'] or 1
+        return {
+            'prompts': stats['prompts'],
+            'avg_tokens': {section: stats[f'{section}_tokens'] / prompts for section in PROMPT_SECTIONS},
+            'avg_prompt_tokens': sum(stats[f'{section}_tokens'] for section in PROMPT_SECTIONS) / prompts,
+            'max_prompt_tokens': stats['max_prompt_tokens'],
+            'dropped_chunks': stats['dropped_chunks'],
+            'truncated_prompts': stats['truncated_prompts'],
+            'web_share': self.web_share
+        }
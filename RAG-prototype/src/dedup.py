@@ -0,0 +1,125 @@
+import re
+import zlib
+import hashlib
+import numpy as np
+
+# Mersenne prime for the MinHash permutations: with a, b and shingle
+# hashes below 2**31, a * x + b fits in uint64
+MINHASH_PRIME = (1 << 31) - 1
+
+WORD = re.compile(r'\w+')
+
+def normalize(text):
+    """Lowercase and collapse whitespace, so formatting-only differences are exact duplicates"""
+    return " ".join(text.lower().split())
+
+class ChunkDeduplicator:
+    """
+    Exact and near-duplicate detection for chunks.
+
+    Exact duplicates are found through an MD5 of the normalized text. Near
+    duplicates use MinHash signatures over word shingles, bucketed with LSH
+    (bands x rows = num_perm). A candidate from a shared bucket counts as a
+    duplicate when its estimated Jaccard similarity reaches the threshold.
+
+    Kept chunks get consecutive ids in the order they are added, which the
+    ingestion pipeline keeps equal to their row in the index.
+    """
+
+    def __init__(self, threshold=0.85, num_perm=128, bands=32, shingle_size=3, seed=1):
+        if num_perm % bands:
+            raise ValueError("num_perm must be divisible by bands")
+        self.threshold = threshold
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.shingle_size = shingle_size
+        self.seed = seed
+        rng = np.random.default_rng(seed)
+        self._a = rng.integers(1, MINHASH_PRIME, size=num_perm, dtype=np.uint64)
+        self._b = rng.integers(0, MINHASH_PRIME, size=num_perm, dtype=np.uint64)
+
+        self._exact = {}
+        self._buckets = [{} for _ in range(bands)]
+        self._signatures = []
+        self.exact_duplicates = 0
+        self.near_duplicates = 0
+
+    @property
+    def config(self):
+        """
+        Settings that change which chunks are kept. Recorded in the index
+        manifest, and enough to rebuild an identical fingerprinter in a worker.
+        """
+        return {'threshold': self.threshold, 'num_perm': self.num_perm, 'bands': self.bands,
+                'shingle_size': self.shingle_size, 'seed': self.seed}
+
+    def __len__(self):
+        return len(self._signatures)
+
+    def fingerprint(self, text):
+        """
+        Exact key and MinHash signature of a chunk. Pure function of the
+        text, so it can be computed in worker processes.
+        """
+        normalized = normalize(text)
+        exact_key = hashlib.md5(normalized.encode()).hexdigest()
+
+        words = WORD.findall(normalized)
+        size = self.shingle_size
+        shingles = {" ".join(words[i:i + size]) for i in range(max(1, len(words) - size + 1))}
+        hashes = np.fromiter(
+            (zlib.crc32(shingle.encode()) % MINHASH_PRIME for shingle in shingles),
+            dtype=np.uint64, count=len(shingles)
+        )
+        # One universal hash (a * x + b) mod p per permutation, minimum over shingles
+        permuted = (hashes[:, None] * self._a[None, :] + self._b[None, :]) % np.uint64(MINHASH_PRIME)
+        signature = permuted.min(axis=0).astype(np.uint32)
+        return exact_key, signature
+
+    def _band_keys(self, signature):
+        return [signature[band * self.rows:(band + 1) * self.rows].tobytes() for band in range(self.bands)]
+
+    def add(self, fingerprint):
+        """
+        Register a chunk by its fingerprint.
+
+        Returns:
+            tuple: (id, is_duplicate). For a duplicate, id is that of the
+            kept chunk it repeats and nothing is registered.
+        """
+        exact_key, signature = fingerprint
+        if exact_key in self._exact:
+            self.exact_duplicates += 1
+            return self._exact[exact_key], True
+
+        band_keys = self._band_keys(signature)
+        candidates = set()
+        for band, key in enumerate(band_keys):
+            candidates.update(self._buckets[band].get(key, ()))
+        best, best_similarity = None, 0.0
+        for candidate in candidates:
+            similarity = float(np.mean(self._signatures[candidate] == signature))
+            if similarity > best_similarity:
+                best, best_similarity = candidate, similarity
+        if best is not None and best_similarity >= self.threshold:
+            self.near_duplicates += 1
+            return best, True
+        return self.keep(fingerprint), False
+
+    def keep(self, fingerprint):
+        """Register a chunk as kept without checking it, e.g. one already in the index. Returns its id."""
+        exact_key, signature = fingerprint
+        chunk_id = len(self._signatures)
+        self._signatures.append(signature)
+        self._exact.setdefault(exact_key, chunk_id)
+        for band, key in enumerate(self._band_keys(signature)):
+            self._buckets[band].setdefault(key, []).append(chunk_id)
+        return chunk_id
+
+    def stats(self):
+        return {
+            'kept': len(self),
+            'exact_duplicates': self.exact_duplicates,
+            'near_duplicates': self.near_duplicates
+        }
@@ -0,0 +1,163 @@
+import os
+import re
+import logging
+import importlib.util
+
+logger = logging.getLogger(__name__)
+
+# Extension -> (loader function, module the loader needs or None)
+LOADERS = {}
+
+# Plain text is read in units of about this many characters, cut at blank lines
+TEXT_UNIT_CHARS = 64 * 1024
+
+MARKDOWN_HEADING = re.compile(r'^\s{0,3}(#{1,6})\s+(.*?)\s*#*\s*$')
+
+def register_loader(*extensions, requires=None):
+    """
+    Register a loader for the given file extensions.
+
+    A loader takes a file path and lazily yields units: dicts with 'text',
+    'source' and 'offset' (character offset of the unit in the decoded file,
+    so file_text[start:end] gives a chunk back, or 0 when the unit is a
+    page/section of a binary format), plus optional
+    'page' and 'heading'. requires names the optional module the loader
+    imports, so files are skipped instead of failing when it is missing.
+    """
+    def decorator(loader):
+        for extension in extensions:
+            LOADERS[extension.lower()] = (loader, requires)
+        return loader
+    return decorator
+
+def _available(requires):
+    return requires is None or importlib.util.find_spec(requires) is not None
+
+def supported_extensions():
+    """Extensions with a registered loader whose dependency is installed"""
+    return {extension for extension, (_, requires) in LOADERS.items() if _available(requires)}
+
+def get_loader(file_path):
+    """Return the loader for a file, or None if its type is not supported"""
+    entry = LOADERS.get(os.path.splitext(file_path)[1].lower())
+    if entry is None:
+        return None
+    loader, requires = entry
+    if not _available(requires):
+        raise ImportError(f"Loading {file_path} needs the optional '{requires}' package")
+    return loader
+
+def load_units(file_path):
+    """Lazily yield the units of one file through its registered loader"""
+    loader = get_loader(file_path)
+    if loader is None:
+        raise ValueError(f"No loader registered for {file_path}")
+    yield from loader(file_path)
+
+def _unit(text, source, offset=0, page=None, heading=None):
+    unit = {"text": text, "source": source, "offset": offset}
+    if page is not None:
+        unit["page"] = page
+    if heading:
+        unit["heading"] = heading
+    return unit
+
+@register_loader(".txt")
+def load_text(file_path):
+    """Plain text, in blocks of roughly TEXT_UNIT_CHARS ending at a blank line"""
+    # newline='': no newline translation, so offsets count "\r\n" as in the file
+    with open(file_path, 'r', encoding='utf-8', newline='') as f:
+        buffer = []
+        size = 0
+        offset = 0
+        for line in f:
+            buffer.append(line)
+            size += len(line)
+            if size >= TEXT_UNIT_CHARS and not line.strip():
+                yield _unit("".join(buffer), file_path, offset)
+                offset += size
+                buffer, size = [], 0
+        if buffer:
+            yield _unit("".join(buffer), file_path, offset)
+
+@register_loader(".md", ".markdown")
+def load_markdown(file_path):
+    """Markdown, one unit per heading section (text before the first heading has none)"""
+    with open(file_path, 'r', encoding='utf-8', newline='') as f:
+        buffer = []
+        heading = None
+        offset = 0
+        position = 0
+        in_code = False
+        for line in f:
+            if line.lstrip().startswith(("```", "~~~")):
+                in_code = not in_code
+            match = None if in_code else MARKDOWN_HEADING.match(line)
+            if match and buffer:
+                yield _unit("".join(buffer), file_path, offset, heading=heading)
+                buffer = []
+                offset = position
+            if match:
+                heading = match.group(2)
+            buffer.append(line)
+            position += len(line)
+        if buffer:
+            yield _unit("".join(buffer), file_path, offset, heading=heading)
+
+@register_loader(".pdf", requires="pypdf")
+def load_pdf(file_path):
+    """PDF, one unit per page; pages are parsed one at a time"""
+    from pypdf import PdfReader
+    reader = PdfReader(file_path)
+    for number, page in enumerate(reader.pages, start=1):
+        text = page.extract_text() or ""
+        if text.strip():
+            yield _unit(text, file_path, page=number)
+
+@register_loader(".html", ".htm", requires="bs4")
+def load_html(file_path):
+    """HTML, one unit per h1-h6 section of the visible text"""
+    from bs4 import BeautifulSoup
+    with open(file_path, 'r', encoding='utf-8', errors='replace') as f:
+        soup = BeautifulSoup(f, "lxml")
+    for tag in soup(["script", "style", "noscript", "nav", "footer"]):
+        tag.decompose()
+    body = soup.body or soup
+
+    heading = soup.title.get_text(strip=True) if soup.title else None
+    lines = []
+    for element in body.find_all(["h1", "h2", "h3", "h4", "h5", "h6", "p", "li", "td", "pre"]):
+        if element.name.startswith("h") and len(element.name) == 2:
+            if lines:
+                yield _unit("\n\n".join(lines), file_path, heading=heading)
+                lines = []
+            heading = element.get_text(" ", strip=True)
+            continue
+        # Nested blocks (e.g. p inside li) are picked up through their parent
+        if element.find_parent(["p", "li", "td", "pre"]) is not None:
+            continue
+        text = element.get_text(" ", strip=True)
+        if text:
+            lines.append(text)
+    if lines:
+        yield _unit("\n\n".join(lines), file_path, heading=heading)
+
+@register_loader(".docx", requires="docx")
+def load_docx(file_path):
+    """Word documents, one unit per section started by a Heading/Title paragraph"""
+    import docx
+    document = docx.Document(file_path)
+    heading = None
+    lines = []
+    for paragraph in document.paragraphs:
+        style = paragraph.style.name if paragraph.style is not None else ""
+        text = paragraph.text.strip()
+        if style.startswith(("Heading", "Title")) and text:
+            if lines:
+                yield _unit("\n\n".join(lines), file_path, heading=heading)
+                lines = []
+            heading = text
+        elif text:
+            lines.append(text)
+    if lines:
+        yield _unit("\n\n".join(lines), file_path, heading=heading)
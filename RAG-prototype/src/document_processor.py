@@ -1,47 +1,31 @@
-import os
-from sentence_transformers import SentenceTransformer
-from transformers import AutoTokenizer
+import logging
+from .encoder_backend import load_encoder
+# Chunking lives in its own module so ingestion workers can use it without
+# importing torch; re-exported here for existing callers
+from .chunking import (
+    CHUNK_TOKENIZER_NAME, CHUNK_MAX_TOKENS, CHUNK_OVERLAP_TOKENS, CHUNK_BOUNDARIES,
+    iter_document_paths, document_category, file_hash, iter_documents, load_documents,
+    load_chunk_tokenizer, chunk_text, chunk_unit, chunk_documents
+)
 
-def load_documents(directory="data"):
-    """
-    Loads all text files from the specified directory and its subdirectories.
-    Returns a list of dictionaries with 'text' and 'source'.
-    """
-    documents = []
-    for root, _, files in os.walk(directory):
-        for file in files:
-            if file.endswith(".txt"):
-                file_path = os.path.join(root, file)
-                with open(file_path, 'r', encoding='utf-8') as f:
-                    text = f.read()
-                    documents.append({"text": text, "source": file_path})
-    return documents
+logger = logging.getLogger(__name__)
 
-def chunk_documents(documents):
+EMBEDDING_MODEL_NAME = 'all-MiniLM-L6-v2'
+
+def load_embedding_model(model_name=EMBEDDING_MODEL_NAME, backend="torch"):
     """
-    Splits documents into smaller chunks for better retrieval.
+    Loads the sentence transformer used for chunk and query embeddings.
+    backend selects the inference mode (see encoder_backend.EMBEDDING_BACKENDS).
     """
-    tokenizer = AutoTokenizer.from_pretrained("google/gemma-2b-it")
-    chunked_docs = []
-    max_length = 256  # Max tokens per chunk
-
-    for doc in documents:
-        tokens = tokenizer.tokenize(doc['text'])
-        # A simple chunking method: split into chunks of max_length tokens
-        for i in range(0, len(tokens), max_length):
-            chunk_tokens = tokens[i:i+max_length]
-            chunk_text = tokenizer.convert_tokens_to_string(chunk_tokens)
-            chunked_docs.append({
-                "text": chunk_text,
-                "source": doc['source']
-            })
-    return chunked_docs
+    return load_encoder(model_name, backend)
 
-def generate_embeddings(chunked_docs):
+def generate_embeddings(chunked_docs, model=None):
     """
     Generates embeddings for each document chunk.
+    An already loaded model can be passed in to avoid reloading it.
     """
-    model = SentenceTransformer('all-MiniLM-L6-v2')
+    if model is None:
+        model = load_embedding_model()
     texts = [doc['text'] for doc in chunked_docs]
     embeddings = model.encode(texts, convert_to_tensor=True)
     return embeddings, model
\ No newline at end of file
@@ -0,0 +1,76 @@
+import logging
+import numpy as np
+import torch
+from sentence_transformers import SentenceTransformer
+
+logger = logging.getLogger(__name__)
+
+# "torch" is the original eager float32 SentenceTransformer
+EMBEDDING_BACKENDS = ("torch", "int8", "onnx")
+
+# Sample texts for the parity check when no corpus chunks are at hand
+PARITY_TEXTS = [
+    "When was FUTA created?",
+    "What faculties are in FUTA?",
+    "How is the grading system calculated?",
+    "Which hostels are available for first year students?",
+    "The university library opens from 8am to 10pm on weekdays.",
+    "Students must register their courses before the end of the second week of the semester."
+]
+
+def load_encoder(model_name, backend="torch"):
+    """
+    Load the sentence embedding model in the requested inference mode.
+
+    The tokenizer, pooling and normalization modules are always the ones of
+    the original model; only the transformer forward pass changes.
+
+    Args:
+        model_name (str): sentence-transformers model id
+        backend (str): one of EMBEDDING_BACKENDS
+            - torch: eager float32 (original behaviour)
+            - int8: dynamic int8 quantization of every Linear layer (CPU)
+            - onnx: ONNX Runtime export (needs optimum)
+    """
+    if backend not in EMBEDDING_BACKENDS:
+        raise ValueError(f"Unknown embedding backend '{backend}', expected one of {EMBEDDING_BACKENDS}")
+
+    if backend == "onnx":
+        try:
+            return SentenceTransformer(model_name, backend="onnx")
+        except (ImportError, TypeError) as e:
+            # TypeError: sentence-transformers older than 3.2 has no backend argument
+            raise ImportError(
+                "The onnx embedding backend needs sentence-transformers>=3.2 and optimum with onnxruntime: "
+                "pip install -U sentence-transformers optimum[onnxruntime]"
+            ) from e
+
+    if backend == "int8":
+        model = SentenceTransformer(model_name, device="cpu")
+        return torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8, inplace=True)
+
+    return SentenceTransformer(model_name)
+
+def check_parity(model, reference, texts=None, tolerance=0.02):
+    """
+    Compare an encoder against the float32 reference.
+
+    Passes when every text's embedding has cosine similarity of at least
+    1 - tolerance with its reference embedding, and no pairwise cosine
+    similarity between texts moves by more than tolerance.
+
+    Returns:
+        dict: min/mean cosine to the reference, max pairwise similarity error, passed
+    """
+    texts = list(texts or PARITY_TEXTS)
+    candidate = np.asarray(model.encode(texts, convert_to_numpy=True, normalize_embeddings=True), dtype='float32')
+    expected = np.asarray(reference.encode(texts, convert_to_numpy=True, normalize_embeddings=True), dtype='float32')
+
+    cosines = np.sum(candidate * expected, axis=1)
+    similarity_error = float(np.max(np.abs(candidate @ candidate.T - expected @ expected.T)))
+    return {
+        'min_cosine': float(cosines.min()),
+        'mean_cosine': float(cosines.mean()),
+        'max_similarity_error': similarity_error,
+        'passed': bool(cosines.min() >= 1 - tolerance and similarity_error <= tolerance)
+    }
@@ -0,0 +1,360 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future
+import torch
+import torch.nn.functional as F
+from transformers import DynamicCache
+from transformers.generation.logits_process import (
+    LogitsProcessorList,
+    TemperatureLogitsWarper,
+    TopKLogitsWarper,
+    TopPLogitsWarper
+)
+from .prefix_cache import kv_layers, kv_cache
+
+class _Sequence:
+    """One request in flight: its prompt, generated tokens and its own KV cache"""
+
+    def __init__(self, input_ids, max_new_tokens, future, prefix=None):
+        self.input_ids = input_ids
+        self.prefix = prefix
+        self.max_new_tokens = max_new_tokens
+        self.future = future
+        self.generated = []
+        # Prompt and generated ids for the sampling warpers, allocated on first use
+        self.history = None
+        self.layers = None
+        self.length = 0
+        self.done = False
+        self.enqueued_at = time.monotonic()
+        self.first_token_at = None
+
+    @property
+    def cost(self):
+        return len(self.input_ids) + self.max_new_tokens
+
+def _left_pad(layers, padding):
+    """Prepend padding empty positions to every layer's keys and values"""
+    if not padding:
+        return layers
+    return [
+        (F.pad(keys, (0, 0, padding, 0)), F.pad(values, (0, 0, padding, 0)))
+        for keys, values in layers
+    ]
+
+class _Batch:
+    """
+    Running sequences sharing one batched KV cache.
+    
+    Row i of the cache holds sequences[i], left-padded to the common
+    length. Padding only changes when a sequence joins or leaves; decode
+    steps just append one position to every row.
+    """
+
+    def __init__(self):
+        self.sequences = []
+        self.cache = None
+        # Positions per row, padding included
+        self.length = 0
+
+    def add(self, sequence):
+        """Append a prefilled sequence as a new row, taking over its KV cache"""
+        layers = sequence.layers
+        if self.cache is None:
+            self.cache, self.length = kv_cache(layers), sequence.length
+        else:
+            longest = max(self.length, sequence.length)
+            rows = _left_pad(kv_layers(self.cache), longest - self.length)
+            layers = _left_pad(layers, longest - sequence.length)
+            self.cache = kv_cache([
+                (torch.cat([keys, new_keys]), torch.cat([values, new_values]))
+                for (keys, values), (new_keys, new_values) in zip(rows, layers)
+            ])
+            self.length = longest
+        sequence.layers = None
+        self.sequences.append(sequence)
+
+    def drop_finished(self):
+        """Remove finished rows and the padding no remaining row needs"""
+        keep = [row for row, sequence in enumerate(self.sequences) if not sequence.done]
+        if len(keep) == len(self.sequences):
+            return
+        self.sequences = [self.sequences[row] for row in keep]
+        if not keep:
+            self.cache, self.length = None, 0
+            return
+        longest = max(sequence.length for sequence in self.sequences)
+        start = self.length - longest
+        layers = kv_layers(self.cache)
+        index = torch.tensor(keep, dtype=torch.long, device=layers[0][0].device)
+        self.cache = kv_cache([
+            (keys.index_select(0, index)[:, :, start:], values.index_select(0, index)[:, :, start:])
+            for keys, values in layers
+        ])
+        self.length = longest
+
+class ContinuousBatchingEngine:
+    """
+    Iteration-level (continuous) batching for LLM generation.
+    
+    Unlike GenerationBatcher, which runs a batch until its longest answer
+    is done, this engine works one decoding step at a time. New requests
+    are prefilled and join the running batch between steps, and finished
+    sequences leave it as soon as they emit EOS or reach max_new_tokens.
+    
+    Running sequences share one batched KV cache, left-padded to a common
+    length. A sequence's prefilled cache is padded into it once, when it
+    joins; finished rows are dropped when they leave. In between, every
+    step decodes one token per sequence straight into the shared cache.
+    Sampling follows generation_kwargs (temperature, top_k/top_p,
+    do_sample), so answers match what model.generate() would produce.
+    """
+
+    def __init__(self, model, tokenizer, generation_kwargs=None, max_batch_size=8,
+                 max_batch_tokens=16384):
+        self.model = model
+        self.tokenizer = tokenizer
+        self.generation_kwargs = dict(generation_kwargs or {})
+        self.max_new_tokens = self.generation_kwargs.get('max_new_tokens', 256)
+        self.do_sample = self.generation_kwargs.get('do_sample', False)
+        self.max_batch_size = max_batch_size
+        self.max_batch_tokens = max_batch_tokens
+        self.eos_token_ids = self._eos_token_ids()
+        self.logits_warper = self._build_logits_warper()
+        
+        self._queue = queue.Queue()
+        self._batch = _Batch()
+        self._carry = None
+        self._closed = False
+        # Orders enqueues before close()'s sentinel, so the worker sees every request
+        self._close_lock = threading.Lock()
+        self._stopping = False
+        self._stats_lock = threading.Lock()
+        self._stats = {
+            'requests': 0,
+            'steps': 0,
+            'active_per_step': 0,
+            'generated_tokens': 0,
+            'decode_time': 0.0,
+            'total_queue_wait': 0.0,
+            'total_first_token_latency': 0.0
+        }
+        self._worker = threading.Thread(target=self._run, name="generation-engine", daemon=True)
+        self._worker.start()
+
+    def _eos_token_ids(self):
+        eos = self.generation_kwargs.get('eos_token_id', self.model.generation_config.eos_token_id)
+        if eos is None:
+            eos = self.tokenizer.eos_token_id
+        return set(eos) if isinstance(eos, (list, tuple)) else {eos}
+
+    def _build_logits_warper(self):
+        """Same warpers generate() applies for these settings"""
+        generation_config = self.model.generation_config
+        temperature = self.generation_kwargs.get('temperature', generation_config.temperature)
+        top_k = self.generation_kwargs.get('top_k', generation_config.top_k)
+        top_p = self.generation_kwargs.get('top_p', generation_config.top_p)
+        
+        warpers = LogitsProcessorList()
+        if temperature is not None and temperature != 1.0:
+            warpers.append(TemperatureLogitsWarper(temperature))
+        if top_k is not None and top_k != 0:
+            warpers.append(TopKLogitsWarper(top_k=top_k, min_tokens_to_keep=1))
+        if top_p is not None and top_p < 1.0:
+            warpers.append(TopPLogitsWarper(top_p=top_p, min_tokens_to_keep=1))
+        return warpers
+
+    def generate(self, input_ids, prefix=None):
+        """
+        Queue a tokenized prompt and wait for its generated text.
+        
+        Args:
+            input_ids (list): prompt token ids
+            prefix (CachedPrefix): cached KV of the leading prompt tokens, so
+                only the rest of the prompt is prefilled
+        """
+        sequence = _Sequence(input_ids, self.max_new_tokens, Future(), prefix=prefix)
+        with self._close_lock:
+            closed = self._closed
+            if not closed:
+                self._queue.put(sequence)
+        if closed:
+            # The engine of a replaced system still answers requests already holding it
+            self._generate_alone(sequence)
+        return sequence.future.result()
+
+    def close(self):
+        """Stop admitting requests; sequences already queued or running still finish"""
+        with self._close_lock:
+            if self._closed:
+                return
+            self._closed = True
+            self._queue.put(None)
+
+    def _admit(self):
+        """
+        Move waiting requests into the running batch.
+        
+        Blocks only while nothing is running. Returns False once the engine
+        is closed and every request has been served.
+        """
+        running = self._batch.sequences
+        admitted = []
+        budget = self.max_batch_tokens - sum(sequence.cost for sequence in running)
+        while len(running) + len(admitted) < self.max_batch_size:
+            if self._carry is not None:
+                sequence, self._carry = self._carry, None
+            else:
+                idle = not running and not admitted
+                try:
+                    sequence = self._queue.get(block=idle and not self._stopping)
+                except queue.Empty:
+                    break
+                if sequence is None:
+                    self._stopping = True
+                    continue
+            if (running or admitted) and sequence.cost > budget:
+                # Joins once running sequences free up room
+                self._carry = sequence
+                break
+            budget -= sequence.cost
+            admitted.append(sequence)
+        
+        for sequence in admitted:
+            self._try([sequence], self._join, self._batch, sequence)
+        return bool(self._batch.sequences) or self._carry is not None or not self._stopping
+
+    def _run(self):
+        while self._admit():
+            if self._batch.sequences:
+                self._try(self._batch.sequences, self._decode_step, self._batch)
+                self._batch.drop_finished()
+
+    def _generate_alone(self, sequence):
+        batch = _Batch()
+        self._try([sequence], self._join, batch, sequence)
+        while not sequence.done:
+            self._try(batch.sequences, self._decode_step, batch)
+
+    def _try(self, sequences, step, *args):
+        try:
+            step(*args)
+        except Exception as e:
+            for sequence in sequences:
+                if not sequence.done:
+                    sequence.done = True
+                    sequence.future.set_exception(e)
+
+    def _join(self, batch, sequence):
+        """Prefill a new sequence and add it to the running batch"""
+        self._prefill(sequence)
+        if not sequence.done:
+            batch.add(sequence)
+
+    def _prefill(self, sequence):
+        """Run the prompt through the model, filling the sequence's KV cache"""
+        started = time.monotonic()
+        
+        # Start from a copy of the cached prefix and prefill only the rest
+        cache, prefilled = DynamicCache(), 0
+        if sequence.prefix is not None:
+            cache, prefilled = kv_cache(sequence.prefix.layers), len(sequence.prefix)
+        input_ids = torch.tensor([sequence.input_ids[prefilled:]], dtype=torch.long, device=self.model.device)
+        with torch.no_grad():
+            outputs = self.model(input_ids=input_ids, past_key_values=cache, use_cache=True)
+        sequence.layers = kv_layers(outputs.past_key_values)
+        sequence.length = len(sequence.input_ids)
+        
+        with self._stats_lock:
+            self._stats['requests'] += 1
+            self._stats['total_queue_wait'] += started - sequence.enqueued_at
+        self._emit(sequence, outputs.logits[:, -1, :])
+
+    def _decode_step(self, batch):
+        """Decode one token for every running sequence in a single forward pass"""
+        started = time.monotonic()
+        sequences = batch.sequences
+        device = self.model.device
+        
+        # Row i is padded on the left by batch.length - its own length
+        lengths = torch.tensor([sequence.length for sequence in sequences], dtype=torch.long, device=device)
+        positions = torch.arange(batch.length + 1, device=device)
+        attention_mask = (positions[None, :] >= (batch.length - lengths)[:, None]).long()
+        input_ids = torch.tensor([[sequence.generated[-1]] for sequence in sequences], dtype=torch.long, device=device)
+        
+        with torch.no_grad():
+            outputs = self.model(
+                input_ids=input_ids,
+                attention_mask=attention_mask,
+                position_ids=lengths[:, None],
+                past_key_values=batch.cache,
+                use_cache=True
+            )
+        batch.cache = outputs.past_key_values
+        batch.length += 1
+        for row, sequence in enumerate(sequences):
+            sequence.length += 1
+            self._emit(sequence, outputs.logits[row:row + 1, -1, :])
+        
+        with self._stats_lock:
+            self._stats['steps'] += 1
+            self._stats['active_per_step'] += len(sequences)
+            self._stats['decode_time'] += time.monotonic() - started
+
+    def _emit(self, sequence, logits):
+        """Pick the next token and retire the sequence when it is finished"""
+        if self.do_sample:
+            seen = len(sequence.input_ids) + len(sequence.generated)
+            if sequence.history is None:
+                # Room for every new token, written in place as tokens are picked
+                sequence.history = torch.empty(
+                    (1, len(sequence.input_ids) + sequence.max_new_tokens), dtype=torch.long, device=logits.device
+                )
+                sequence.history[0, :seen] = torch.tensor(
+                    sequence.input_ids + sequence.generated, dtype=torch.long, device=logits.device
+                )
+            scores = self.logits_warper(sequence.history[:, :seen], logits.float())
+            token = int(torch.multinomial(F.softmax(scores, dim=-1), num_samples=1)[0, 0])
+        else:
+            token = int(torch.argmax(logits, dim=-1)[0])
+        
+        if sequence.first_token_at is None:
+            sequence.first_token_at = time.monotonic()
+            with self._stats_lock:
+                self._stats['total_first_token_latency'] += sequence.first_token_at - sequence.enqueued_at
+        
+        finished = token in self.eos_token_ids
+        if not finished:
+            if sequence.history is not None:
+                sequence.history[0, len(sequence.input_ids) + len(sequence.generated)] = token
+            sequence.generated.append(token)
+            with self._stats_lock:
+                self._stats['generated_tokens'] += 1
+        if finished or len(sequence.generated) >= sequence.max_new_tokens:
+            sequence.done = True
+            sequence.layers = None
+            sequence.history = None
+            sequence.prefix = None
+            sequence.future.set_result(
+                self.tokenizer.decode(sequence.generated, skip_special_tokens=True)
+            )
+
+    def stats(self):
+        """Batch occupancy, throughput and latency metrics"""
+        with self._stats_lock:
+            stats = dict(self._stats)
+        steps = stats['steps'] or 1
+        requests = stats['requests'] or 1
+        return {
+            'mode': 'continuous',
+            'requests': stats['requests'],
+            'running': len(self._batch.sequences),
+            'decode_steps': stats['steps'],
+            'avg_active_sequences': stats['active_per_step'] / steps,
+            'avg_batch_fill': stats['active_per_step'] / (steps * self.max_batch_size),
+            'generated_tokens': stats['generated_tokens'],
+            'decode_tokens_per_second': stats['active_per_step'] / stats['decode_time'] if stats['decode_time'] else 0.0,
+            'avg_queue_wait_ms': 1000 * stats['total_queue_wait'] / requests,
+            'avg_time_to_first_token_ms': 1000 * stats['total_first_token_latency'] / requests
+        }
@@ -0,0 +1,132 @@
+import os
+import shutil
+import logging
+import tempfile
+import torch
+from transformers import AutoTokenizer, AutoModelForCausalLM
+
+logger = logging.getLogger(__name__)
+
+GENERATOR_MODEL_NAME = "google/gemma-2b-it"
+
+# "default" keeps the original loading path (device_map="auto" + Accelerator)
+GENERATOR_BACKENDS = ("default", "fp32", "bf16", "int8", "onnx")
+
+# ONNX exports are written here once, one subdirectory per model
+ONNX_EXPORT_DIR = "onnx_export"
+
+def bf16_supported():
+    """Whether bf16 matmuls are natively supported on this machine"""
+    if torch.cuda.is_available():
+        return torch.cuda.is_bf16_supported()
+    for check in ("_is_avx512_bf16_supported", "_is_amx_tile_supported"):
+        if getattr(torch.cpu, check, lambda: False)():
+            return True
+    return False
+
+def model_footprint(model):
+    """Bytes held by the model's weights, including dynamically quantized ones"""
+    model_dir = getattr(model, 'model_save_dir', None)
+    if model_dir is not None:
+        # Exported graphs live in onnxruntime; count the files it loaded
+        return sum(
+            os.path.getsize(os.path.join(root, name))
+            for root, _, names in os.walk(model_dir) for name in names
+            if name.endswith(('.onnx', '.onnx_data'))
+        )
+    
+    total = sum(t.numel() * t.element_size() for t in model.parameters())
+    total += sum(t.numel() * t.element_size() for t in model.buffers())
+    for module in model.modules():
+        # Dynamic int8 Linear layers keep packed weights outside parameters()
+        if hasattr(module, '_packed_params') and callable(getattr(module, 'weight', None)):
+            weight = module.weight()
+            total += weight.numel() * weight.element_size()
+    return total
+
+def _has_onnx_export(path):
+    return os.path.isdir(path) and any(name.endswith('.onnx') for name in os.listdir(path))
+
+def _load_onnx(model_name, export_dir=ONNX_EXPORT_DIR):
+    """
+    Load the ONNX graph of a model, exporting it only the first time.
+    
+    Exporting Gemma takes minutes and several GB, so the export is saved
+    under export_dir and later processes and rebuilds load it from there.
+    """
+    try:
+        from optimum.onnxruntime import ORTModelForCausalLM
+    except ImportError as e:
+        raise ImportError(
+            "The onnx generator backend needs optimum with onnxruntime: pip install optimum[onnxruntime]"
+        ) from e
+    
+    model_dir = os.path.join(export_dir, model_name.replace("/", "--"))
+    if _has_onnx_export(model_dir):
+        return ORTModelForCausalLM.from_pretrained(model_dir, use_cache=True)
+    
+    logger.info(f"Exporting {model_name} to ONNX in {model_dir} (one-time)")
+    model = ORTModelForCausalLM.from_pretrained(model_name, export=True, use_cache=True)
+    # Saved to a scratch directory and renamed, so a concurrent or interrupted
+    # export never leaves a partial model where it would be loaded
+    os.makedirs(export_dir, exist_ok=True)
+    scratch_dir = tempfile.mkdtemp(dir=export_dir, prefix=os.path.basename(model_dir) + ".")
+    try:
+        model.save_pretrained(scratch_dir)
+        if _has_onnx_export(model_dir):
+            shutil.rmtree(scratch_dir)
+        else:
+            shutil.rmtree(model_dir, ignore_errors=True)
+            os.replace(scratch_dir, model_dir)
+    except BaseException:
+        shutil.rmtree(scratch_dir, ignore_errors=True)
+        raise
+    return ORTModelForCausalLM.from_pretrained(model_dir, use_cache=True)
+
+def load_generator(model_name=GENERATOR_MODEL_NAME, backend="default", accelerator=None,
+                   onnx_export_dir=ONNX_EXPORT_DIR):
+    """
+    Load the generator model in the requested inference mode.
+    
+    Args:
+        model_name (str): Hugging Face model id
+        backend (str): one of GENERATOR_BACKENDS
+            - default: original full-precision load through the accelerator
+            - fp32: float32 on CPU
+            - bf16: bfloat16, falls back to fp32 without native support
+            - int8: dynamic int8 quantization of every Linear layer (CPU)
+            - onnx: exported ONNX graph run by onnxruntime (needs optimum)
+        accelerator: Accelerator used by the default backend
+        onnx_export_dir (str): where the onnx backend keeps its one-time export
+    
+    Returns:
+        tuple: (model, tokenizer, backend actually used)
+    """
+    if backend not in GENERATOR_BACKENDS:
+        raise ValueError(f"Unknown generator backend '{backend}', expected one of {GENERATOR_BACKENDS}")
+    
+    tokenizer = AutoTokenizer.from_pretrained(model_name)
+    
+    if backend == "bf16" and not bf16_supported():
+        logger.warning("bf16 is not natively supported on this machine, using fp32")
+        backend = "fp32"
+    
+    if backend == "default":
+        model = AutoModelForCausalLM.from_pretrained(
+            model_name,
+            device_map="auto"
+        )
+        if accelerator is not None:
+            model, tokenizer = accelerator.prepare(model, tokenizer)
+    elif backend == "onnx":
+        model = _load_onnx(model_name, onnx_export_dir)
+    else:
+        dtype = torch.bfloat16 if backend == "bf16" else torch.float32
+        model = AutoModelForCausalLM.from_pretrained(model_name, dtype=dtype).eval()
+        if backend == "int8":
+            model = torch.ao.quantization.quantize_dynamic(
+                model, {torch.nn.Linear}, dtype=torch.qint8, inplace=True
+            )
+    
+    logger.info(f"Loaded {model_name} with the {backend} backend ({model_footprint(model) / 2**20:.0f} MB of weights)")
+    return model, tokenizer, backend
@@ -0,0 +1,155 @@
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+import logging
+
+logger = logging.getLogger(__name__)
+
+class HTTPCache:
+    """
+    Persistent SQLite cache for web augmentation results.
+    
+    Entries are grouped by namespace ('keyword', 'search', 'page') and hold a
+    JSON value together with the ETag/Last-Modified validators of the
+    response they came from. Fresh entries are served directly; stale ones
+    keep their validators so the caller can revalidate with a conditional
+    request. Total size is bounded by entry count and stored bytes, evicting
+    the least recently used rows first. WAL mode lets several worker
+    processes share one cache file.
+    """
+
+    def __init__(self, path="web_cache.sqlite", max_entries=5000, max_bytes=50 * 1024 * 1024):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=10)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS entries (
+                key TEXT PRIMARY KEY,
+                namespace TEXT NOT NULL,
+                value TEXT NOT NULL,
+                etag TEXT,
+                last_modified TEXT,
+                expires_at REAL NOT NULL,
+                last_access REAL NOT NULL,
+                size INTEGER NOT NULL
+            )
+            """
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS entries_last_access ON entries(last_access)")
+        self._conn.commit()
+        self.hits = 0
+        self.misses = 0
+        self.revalidations = 0
+
+    @staticmethod
+    def _key(namespace, key):
+        return namespace + ":" + hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+    def get(self, namespace, key):
+        """
+        Look up an entry.
+        
+        Returns:
+            dict or None: value, etag, last_modified and whether it is still fresh
+        """
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, etag, last_modified, expires_at FROM entries WHERE key = ?",
+                (self._key(namespace, key),)
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self._conn.execute(
+                "UPDATE entries SET last_access = ? WHERE key = ?", (now, self._key(namespace, key))
+            )
+            self._conn.commit()
+            value, etag, last_modified, expires_at = row
+            fresh = expires_at > now
+            if fresh:
+                self.hits += 1
+            else:
+                self.misses += 1
+        
+        return {
+            'value': json.loads(value),
+            'etag': etag,
+            'last_modified': last_modified,
+            'fresh': fresh
+        }
+
+    def is_fresh(self, namespace, key):
+        """Whether a fresh entry exists, without counting a hit or touching it"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT expires_at FROM entries WHERE key = ?", (self._key(namespace, key),)
+            ).fetchone()
+        return row is not None and row[0] > time.time()
+
+    def set(self, namespace, key, value, ttl, etag=None, last_modified=None):
+        """Store a JSON-serializable value for ttl seconds"""
+        now = time.time()
+        payload = json.dumps(value)
+        with self._lock:
+            self._conn.execute(
+                """
+                INSERT OR REPLACE INTO entries
+                    (key, namespace, value, etag, last_modified, expires_at, last_access, size)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                """,
+                (self._key(namespace, key), namespace, payload, etag, last_modified,
+                 now + ttl, now, len(payload))
+            )
+            self._evict()
+            self._conn.commit()
+
+    def refresh(self, namespace, key, ttl):
+        """Extend a stale entry after the origin confirmed it (HTTP 304)"""
+        with self._lock:
+            self.revalidations += 1
+            self._conn.execute(
+                "UPDATE entries SET expires_at = ?, last_access = ? WHERE key = ?",
+                (time.time() + ttl, time.time(), self._key(namespace, key))
+            )
+            self._conn.commit()
+
+    def _evict(self):
+        """Drop least recently used rows until both bounds hold (caller holds the lock)"""
+        count, total = self._conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries").fetchone()
+        if count <= self.max_entries and total <= self.max_bytes:
+            return
+        rows = self._conn.execute("SELECT key, size FROM entries ORDER BY last_access ASC").fetchall()
+        stale_keys = []
+        for key, size in rows:
+            if count <= self.max_entries and total <= self.max_bytes:
+                break
+            stale_keys.append((key,))
+            count -= 1
+            total -= size
+        self._conn.executemany("DELETE FROM entries WHERE key = ?", stale_keys)
+        logger.info(f"Evicted {len(stale_keys)} web cache entries")
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM entries")
+            self._conn.commit()
+
+    def stats(self):
+        with self._lock:
+            count, total = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries"
+            ).fetchone()
+            return {
+                'entries': count,
+                'bytes': total,
+                'hits': self.hits,
+                'misses': self.misses,
+                'revalidations': self.revalidations
+            }
@@ -0,0 +1,520 @@
+import os
+import json
+import mmap
+import tempfile
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+import numpy as np
+import faiss
+try:
+    import fcntl
+except ImportError:  # Windows: builds are only serialized within a process
+    fcntl = None
+from .lexical_index import BM25Builder, BM25Index
+
+INDEX_FORMAT_VERSION = 9
+
+MANIFEST_FILE = "manifest.json"
+EMBEDDINGS_FILE = "embeddings.npy"
+CHUNK_TEXT_FILE = "chunks.bin"
+CHUNK_OFFSETS_FILE = "chunk_offsets.npy"
+CHUNK_SOURCES_FILE = "chunk_source_ids.npy"
+CHUNK_SPANS_FILE = "chunk_spans.npy"
+CHUNK_PAGES_FILE = "chunk_pages.npy"
+CHUNK_HEADINGS_FILE = "chunk_heading_ids.npy"
+CHUNK_CATEGORIES_FILE = "chunk_category_ids.npy"
+CHUNK_DUPLICATES_FILE = "chunk_duplicates.npy"
+
+# Columns of the duplicates table
+DUPLICATE_COLUMNS = ("row", "source_id", "start", "end", "page", "heading_id", "category_id")
+FAISS_INDEX_FILE = "index.faiss"
+
+
+class ChunkStore:
+    """
+    Read-only, list-like view over the chunk text store.
+    Chunk text lives in one memory-mapped UTF-8 file and is sliced out
+    through an offsets table, so workers share the same pages.
+    """
+
+    def __init__(self, text_path, offsets, source_ids, sources, spans=None, pages=None,
+                 heading_ids=None, headings=None, duplicates=None, category_ids=None, categories=None):
+        self.offsets = offsets
+        self.source_ids = source_ids
+        self.sources = sources
+        self.spans = spans
+        self.pages = pages
+        self.heading_ids = heading_ids
+        self.headings = headings
+        self.category_ids = category_ids
+        self.categories = categories
+        # Sorted by row, see DUPLICATE_COLUMNS
+        self.duplicates = duplicates
+        self._file = open(text_path, 'rb')
+        if os.path.getsize(text_path) > 0:
+            self._data = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        else:
+            self._data = b""
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        if i < 0 or i >= len(self):
+            raise IndexError("chunk index out of range")
+        start, end = int(self.offsets[i]), int(self.offsets[i + 1])
+        chunk = {
+            "text": self._data[start:end].decode('utf-8'),
+            "source": self.sources[int(self.source_ids[i])]
+        }
+        # Character span of the chunk in its source document, when known
+        if self.spans is not None and self.spans[i][0] >= 0:
+            chunk["start"], chunk["end"] = int(self.spans[i][0]), int(self.spans[i][1])
+        if self.pages is not None and self.pages[i] >= 0:
+            chunk["page"] = int(self.pages[i])
+        if self.heading_ids is not None and self.heading_ids[i] >= 0:
+            chunk["heading"] = self.headings[int(self.heading_ids[i])]
+        if self.category_ids is not None and self.category_ids[i] >= 0:
+            chunk["category"] = self.categories[int(self.category_ids[i])]
+        locations = self.duplicate_locations(i)
+        if locations:
+            chunk["duplicates"] = locations
+        return chunk
+
+    def duplicate_locations(self, i):
+        """Other places (source, span, page, heading, category) where chunk i's text was found"""
+        if self.duplicates is None or len(self.duplicates) == 0:
+            return []
+        rows = self.duplicates[:, 0]
+        first, last = np.searchsorted(rows, i, side='left'), np.searchsorted(rows, i, side='right')
+        locations = []
+        for _, source_id, start, end, page, heading_id, category_id in self.duplicates[first:last]:
+            location = {"source": self.sources[int(source_id)]}
+            if start >= 0:
+                location["start"], location["end"] = int(start), int(end)
+            if page >= 0:
+                location["page"] = int(page)
+            if heading_id >= 0:
+                location["heading"] = self.headings[int(heading_id)]
+            if category_id >= 0:
+                location["category"] = self.categories[int(category_id)]
+            locations.append(location)
+        return locations
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def close(self):
+        """Release the memory map and file handle"""
+        if isinstance(self._data, mmap.mmap):
+            self._data.close()
+        self._file.close()
+
+
+class IndexStore:
+    """
+    Versioned on-disk layout for the RAG index:
+        
+        manifest.json         format version, model name, counts, document hashes
+        embeddings.npy        raw float32/float16 matrix of unit-length rows, opened with mmap
+        chunks.bin            concatenated UTF-8 chunk text
+        chunk_offsets.npy     int64 offsets table (num_chunks + 1 entries)
+        chunk_source_ids.npy  int32 index into the manifest's source list
+        chunk_spans.npy       int64 (start, end) character offsets in the source, -1 if unknown
+        chunk_pages.npy       int32 page number, -1 for formats without pages
+        chunk_heading_ids.npy int32 index into the manifest's heading list, -1 if none
+        chunk_category_ids.npy int32 index into the manifest's category list, -1 if none
+        chunk_duplicates.npy  int64 table of where dropped duplicates of a chunk were found
+        lexical_*             BM25 inverted index over the chunk text (see lexical_index)
+        index.faiss           optional serialized FAISS index, opened with mmap
+    
+    Nothing in the layout is pickled; the embedding model is referenced by
+    name in the manifest and loaded separately.
+    
+    Scratch files get unique names, and lock() serializes building,
+    publishing, loading and clearing across processes (e.g. several
+    gunicorn workers sharing index_dir) through an flock on a file next
+    to the directory.
+    """
+
+    def __init__(self, index_dir="rag_index", dtype="float32"):
+        if dtype not in ("float32", "float16"):
+            raise ValueError(f"Unsupported embedding dtype: {dtype}")
+        self.index_dir = index_dir
+        self.dtype = dtype
+        # Outside index_dir, so clear() can remove the directory while holding it
+        self.lock_path = os.path.normpath(index_dir) + ".lock"
+        self._thread_lock = threading.RLock()
+        self._lock_depth = 0
+        self._lock_file = None
+
+    @contextmanager
+    def lock(self):
+        """
+        Exclusive lock on the store, re-entrant within this IndexStore.
+        Held by the caller around a whole check-and-build, and taken
+        internally when files are published, loaded or removed.
+        """
+        with self._thread_lock:
+            if self._lock_depth == 0:
+                self._lock_file = open(self.lock_path, 'a')
+                if fcntl is not None:
+                    fcntl.flock(self._lock_file, fcntl.LOCK_EX)
+            self._lock_depth += 1
+            try:
+                yield
+            finally:
+                self._lock_depth -= 1
+                if self._lock_depth == 0:
+                    if fcntl is not None:
+                        fcntl.flock(self._lock_file, fcntl.LOCK_UN)
+                    self._lock_file.close()
+                    self._lock_file = None
+
+    def _path(self, name):
+        return os.path.join(self.index_dir, name)
+
+    def _temp_path(self, name):
+        """A new, uniquely named scratch file in index_dir"""
+        os.makedirs(self.index_dir, exist_ok=True)
+        fd, path = tempfile.mkstemp(dir=self.index_dir, prefix=name + ".", suffix=".tmp")
+        os.close(fd)
+        return path
+
+    def _write_atomic(self, name, write_fn):
+        """Write a file next to its final path and move it into place"""
+        tmp_path = self._temp_path(name)
+        try:
+            write_fn(tmp_path)
+            os.replace(tmp_path, self._path(name))
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def _write_manifest(self, manifest):
+        def write(path):
+            with open(path, 'w', encoding='utf-8') as f:
+                json.dump(manifest, f, indent=2)
+        self._write_atomic(MANIFEST_FILE, write)
+
+    def exists(self):
+        """Check if a manifest is present"""
+        return os.path.exists(self._path(MANIFEST_FILE))
+
+    def writer(self):
+        """Open an IndexWriter that streams chunks and embeddings into this store"""
+        return IndexWriter(self)
+
+    def save(self, embeddings, chunked_docs, embedding_model_name, data_hash, doc_hashes,
+             index=None, index_spec="flat", chunking=None):
+        """
+        Persist embeddings, chunks and manifest.
+        
+        Args:
+            embeddings: torch tensor or numpy array of shape (num_chunks, dim)
+            chunked_docs (list): chunk dicts with 'text' and 'source'
+            embedding_model_name (str): name used to reload the encoder
+            data_hash (str): hash of the whole corpus
+            doc_hashes (dict): per-source content hashes
+            index: optional FAISS index to serialize next to the embeddings
+            index_spec (str): spec the index was built with
+            chunking (dict): chunking settings the chunks were made with
+        """
+        if hasattr(embeddings, 'cpu'):
+            embeddings = embeddings.cpu().numpy()
+        if embeddings.ndim != 2 or embeddings.shape[0] != len(chunked_docs):
+            raise ValueError("Embeddings and chunks are out of sync")
+        
+        writer = self.writer()
+        try:
+            writer.append(embeddings, chunked_docs)
+            return writer.finish(
+                embedding_model_name, data_hash, doc_hashes, index=index, index_spec=index_spec, chunking=chunking
+            )
+        except BaseException:
+            writer.abort()
+            raise
+
+    def save_index(self, index, index_spec):
+        """Replace only the serialized FAISS index, e.g. after switching index spec"""
+        with self.lock():
+            manifest = self.load_manifest()
+            if manifest is None:
+                raise ValueError("Cannot save an index without stored embeddings")
+            
+            self._write_atomic(FAISS_INDEX_FILE, lambda path: faiss.write_index(index, path))
+            manifest['index_file'] = FAISS_INDEX_FILE
+            manifest['index_spec'] = index_spec
+            self._write_manifest(manifest)
+            return manifest
+
+    def load_manifest(self):
+        """Load the manifest, or None if it is missing or from another format version"""
+        if not self.exists():
+            return None
+        with open(self._path(MANIFEST_FILE), 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+        if manifest.get('format_version') != INDEX_FORMAT_VERSION:
+            return None
+        return manifest
+
+    def load(self):
+        """
+        Open the stored index without copying it into process memory.
+        
+        Returns:
+            dict or None: manifest, embeddings (memory-mapped), chunks (ChunkStore),
+            index (memory-mapped FAISS index or None) and lexical (BM25Index or None)
+        """
+        # Files are opened under the lock, so a concurrent publish cannot mix
+        # old and new ones; the open mmaps stay valid after they are replaced
+        with self.lock():
+            return self._open()
+
+    def _open(self):
+        manifest = self.load_manifest()
+        if manifest is None:
+            return None
+        
+        embeddings = np.load(self._path(EMBEDDINGS_FILE), mmap_mode='r')
+        offsets = np.load(self._path(CHUNK_OFFSETS_FILE), mmap_mode='r')
+        source_ids = np.load(self._path(CHUNK_SOURCES_FILE), mmap_mode='r')
+        spans = np.load(self._path(CHUNK_SPANS_FILE), mmap_mode='r')
+        pages = np.load(self._path(CHUNK_PAGES_FILE), mmap_mode='r')
+        heading_ids = np.load(self._path(CHUNK_HEADINGS_FILE), mmap_mode='r')
+        duplicates = np.load(self._path(CHUNK_DUPLICATES_FILE), mmap_mode='r')
+        category_ids = np.load(self._path(CHUNK_CATEGORIES_FILE), mmap_mode='r')
+        
+        num_chunks = manifest['num_chunks']
+        per_chunk = (embeddings, source_ids, spans, pages, heading_ids, category_ids)
+        if len(offsets) != num_chunks + 1 or any(len(array) != num_chunks for array in per_chunk):
+            raise ValueError("Index files do not match the manifest")
+        
+        chunks = ChunkStore(
+            self._path(CHUNK_TEXT_FILE), offsets, source_ids, manifest['sources'], spans=spans,
+            pages=pages, heading_ids=heading_ids, headings=manifest.get('headings', []), duplicates=duplicates,
+            category_ids=category_ids, categories=manifest.get('categories', [])
+        )
+        
+        index = None
+        if manifest.get('index_file'):
+            index = faiss.read_index(self._path(manifest['index_file']), faiss.IO_FLAG_MMAP)
+        
+        lexical = BM25Index.load(self.index_dir) if manifest.get('lexical_index') else None
+        if lexical is not None and lexical.num_rows != num_chunks:
+            raise ValueError("Lexical index does not match the manifest")
+        
+        return {
+            'manifest': manifest,
+            'embeddings': embeddings,
+            'chunks': chunks,
+            'index': index,
+            'lexical': lexical
+        }
+
+    def clear(self):
+        """Remove all index files"""
+        with self.lock():
+            if not os.path.exists(self.index_dir):
+                return False
+            for name in os.listdir(self.index_dir):
+                os.remove(self._path(name))
+            os.rmdir(self.index_dir)
+            return True
+
+
+class IndexWriter:
+    """
+    Appends chunks and their embeddings to an IndexStore as they are produced.
+    
+    Embedding rows go to a raw scratch file and chunk text straight into the
+    chunk store, so memory use does not grow with the corpus. Only the small
+    per-chunk tables and the BM25 postings are kept in memory. Nothing is visible to
+    readers until finish() writes the manifest.
+    """
+
+    def __init__(self, store):
+        self.store = store
+        self.num_chunks = 0
+        self.dimension = None
+        self.sources = []
+        self._source_lookup = {}
+        self._source_ids = []
+        self._offsets = [0]
+        self._spans = []
+        self._pages = []
+        self.headings = []
+        self._heading_lookup = {}
+        self._heading_ids = []
+        self._duplicates = []
+        self.categories = []
+        self._category_lookup = {}
+        self._category_ids = []
+        self.lexical = BM25Builder()
+        # Unique scratch names, so concurrent writers never share a file
+        self._raw_path = store._temp_path("embeddings.raw")
+        self._text_path = store._temp_path(CHUNK_TEXT_FILE)
+        self._embeddings_file = open(self._raw_path, 'wb')
+        self._text_file = open(self._text_path, 'wb')
+
+    def append(self, embeddings, chunks):
+        """
+        Append a batch of chunk dicts and their embedding rows.
+        
+        Args:
+            embeddings: torch tensor or numpy array of shape (len(chunks), dim)
+            chunks (list): chunk dicts with 'text' and 'source'
+        """
+        if hasattr(embeddings, 'cpu'):
+            embeddings = embeddings.cpu().numpy()
+        embeddings = np.ascontiguousarray(embeddings, dtype=self.store.dtype)
+        if embeddings.ndim != 2 or embeddings.shape[0] != len(chunks):
+            raise ValueError("Embeddings and chunks are out of sync")
+        if self.dimension is None:
+            self.dimension = int(embeddings.shape[1])
+        elif embeddings.shape[1] != self.dimension:
+            raise ValueError(f"Expected {self.dimension}-dimensional embeddings, got {embeddings.shape[1]}")
+        
+        self._embeddings_file.write(embeddings.tobytes())
+        for chunk in chunks:
+            self._source_ids.append(self._source_id(chunk['source']))
+            encoded = chunk['text'].encode('utf-8')
+            self._text_file.write(encoded)
+            self._offsets.append(self._offsets[-1] + len(encoded))
+            self._spans.append((chunk.get('start', -1), chunk.get('end', -1)))
+            self._pages.append(chunk.get('page', -1))
+            self._heading_ids.append(self._heading_id(chunk.get('heading')))
+            self._category_ids.append(self._category_id(chunk.get('category')))
+            self.lexical.add(chunk['text'])
+        self.num_chunks += len(chunks)
+
+    def _source_id(self, source):
+        if source not in self._source_lookup:
+            self._source_lookup[source] = len(self.sources)
+            self.sources.append(source)
+        return self._source_lookup[source]
+
+    def _heading_id(self, heading):
+        if not heading:
+            return -1
+        if heading not in self._heading_lookup:
+            self._heading_lookup[heading] = len(self.headings)
+            self.headings.append(heading)
+        return self._heading_lookup[heading]
+
+    def _category_id(self, category):
+        if category is None:
+            return -1
+        if category not in self._category_lookup:
+            self._category_lookup[category] = len(self.categories)
+            self.categories.append(category)
+        return self._category_lookup[category]
+
+    def add_duplicate(self, row, chunk):
+        """
+        Record that chunk was dropped as a duplicate of the chunk at row.
+        row may refer to a chunk that is appended later.
+        """
+        self._duplicates.append((
+            row, self._source_id(chunk['source']), chunk.get('start', -1), chunk.get('end', -1),
+            chunk.get('page', -1), self._heading_id(chunk.get('heading')),
+            self._category_id(chunk.get('category'))
+        ))
+
+    def finish(self, embedding_model_name, data_hash, doc_hashes, index=None, index_spec="flat",
+               chunking=None, dedup=None):
+        """
+        Move the written files into place and write the manifest last.
+        
+        Returns:
+            dict: the new manifest
+        """
+        store = self.store
+        self._embeddings_file.close()
+        self._text_file.close()
+        dimension = self.dimension or 0
+        
+        # Copy the raw rows into a proper .npy file block by block through mmaps
+        raw_path = self._raw_path
+        def write_embeddings(path):
+            target = np.lib.format.open_memmap(
+                path, mode='w+', dtype=store.dtype, shape=(self.num_chunks, dimension)
+            )
+            if self.num_chunks and dimension:
+                source = np.memmap(raw_path, dtype=store.dtype, mode='r', shape=(self.num_chunks, dimension))
+                for start in range(0, self.num_chunks, 65536):
+                    target[start:start + 65536] = source[start:start + 65536]
+                del source
+            target.flush()
+            del target
+        
+        def write_array(array):
+            def write(path):
+                with open(path, 'wb') as f:
+                    np.save(f, array)
+            return write
+        
+        # Other processes see either the old or the new file set, never a mix
+        with store.lock():
+            store._write_atomic(EMBEDDINGS_FILE, write_embeddings)
+            os.remove(raw_path)
+            os.replace(self._text_path, store._path(CHUNK_TEXT_FILE))
+            store._write_atomic(CHUNK_OFFSETS_FILE, write_array(np.asarray(self._offsets, dtype=np.int64)))
+            store._write_atomic(CHUNK_SOURCES_FILE, write_array(np.asarray(self._source_ids, dtype=np.int32)))
+            store._write_atomic(CHUNK_SPANS_FILE, write_array(np.asarray(self._spans, dtype=np.int64).reshape(-1, 2)))
+            store._write_atomic(CHUNK_PAGES_FILE, write_array(np.asarray(self._pages, dtype=np.int32)))
+            store._write_atomic(CHUNK_HEADINGS_FILE, write_array(np.asarray(self._heading_ids, dtype=np.int32)))
+            store._write_atomic(CHUNK_CATEGORIES_FILE, write_array(np.asarray(self._category_ids, dtype=np.int32)))
+        
+            duplicates = np.asarray(self._duplicates, dtype=np.int64).reshape(-1, len(DUPLICATE_COLUMNS))
+            if len(duplicates) and duplicates[:, 0].max() >= self.num_chunks:
+                raise ValueError("A duplicate refers to a chunk that was never written")
+            duplicates = duplicates[np.argsort(duplicates[:, 0], kind='stable')]
+            store._write_atomic(CHUNK_DUPLICATES_FILE, write_array(duplicates))
+            self.lexical.write(store._write_atomic)
+        
+            index_file = None
+            if index is not None:
+                store._write_atomic(FAISS_INDEX_FILE, lambda path: faiss.write_index(index, path))
+                index_file = FAISS_INDEX_FILE
+            elif os.path.exists(store._path(FAISS_INDEX_FILE)):
+                os.remove(store._path(FAISS_INDEX_FILE))
+        
+            manifest = {
+                'format_version': INDEX_FORMAT_VERSION,
+                'created_at': datetime.now().isoformat(),
+                'embedding_model': embedding_model_name,
+                'chunking': chunking,
+                'dedup': dedup,
+                'num_duplicates': len(duplicates),
+                'lexical_index': True,
+                'dtype': store.dtype,
+                'num_chunks': self.num_chunks,
+                'dimension': dimension,
+                'data_hash': data_hash,
+                'doc_hashes': doc_hashes,
+                'sources': self.sources,
+                'headings': self.headings,
+                'categories': self.categories,
+                'index_file': index_file,
+                'index_spec': index_spec if index_file else None
+            }
+        
+            # The manifest is written last so a partial write is never picked up
+            store._write_manifest(manifest)
+            return manifest
+
+    def abort(self):
+        """Discard everything written so far"""
+        self._embeddings_file.close()
+        self._text_file.close()
+        for path in (self._raw_path, self._text_path):
+            if os.path.exists(path):
+                os.remove(path)
@@ -0,0 +1,237 @@
+import os
+import sys
+import time
+import queue
+import logging
+import threading
+import multiprocessing as mp
+from collections import deque
+from itertools import chain, islice
+import numpy as np
+from .chunking import iter_document_paths, document_category, load_chunk_tokenizer, chunk_unit
+from .document_loaders import load_units
+from .dedup import ChunkDeduplicator
+
+logger = logging.getLogger(__name__)
+
+# Set in each chunking worker by _init_worker
+_worker_tokenizer = None
+_worker_chunking = {}
+_worker_fingerprinter = None
+
+def _init_worker(chunking, dedup_config=None):
+    global _worker_tokenizer, _worker_chunking, _worker_fingerprinter
+    # The pool already gives one process per core
+    os.environ.setdefault("TOKENIZERS_PARALLELISM", "false")
+    _worker_tokenizer = load_chunk_tokenizer()
+    _worker_chunking = chunking
+    _worker_fingerprinter = ChunkDeduplicator(**dedup_config) if dedup_config else None
+
+def _chunk_file(file_path):
+    """
+    Load and chunk one file in a worker, unit by unit.
+    Returns (chunks, dedup fingerprints or None, seconds spent).
+    """
+    start = time.perf_counter()
+    chunks = []
+    for unit in load_units(file_path):
+        chunks.extend(chunk_unit(unit, _worker_tokenizer, **_worker_chunking))
+    fingerprints = None
+    if _worker_fingerprinter is not None:
+        fingerprints = [_worker_fingerprinter.fingerprint(chunk['text']) for chunk in chunks]
+    return chunks, fingerprints, time.perf_counter() - start
+
+def _start_pool(processes, initargs):
+    """
+    Start a spawn pool of chunking workers.
+    
+    A spawned process first re-runs the parent's __main__ script, and the
+    entry scripts import torch and the whole model stack. Workers only need
+    src.chunking, so the script is hidden from multiprocessing while the
+    pool starts its processes (a Pool starts them all up front).
+    """
+    main = sys.modules['__main__']
+    main_file, main_spec = main.__dict__.pop('__file__', None), getattr(main, '__spec__', None)
+    main.__spec__ = None
+    try:
+        # spawn: forking a process that has loaded torch is not safe
+        return mp.get_context("spawn").Pool(processes, initializer=_init_worker, initargs=initargs)
+    finally:
+        main.__spec__ = main_spec
+        if main_file is not None:
+            main.__file__ = main_file
+
+
+class IngestionPipeline:
+    """
+    Streaming document ingestion: file walker -> loading and chunking -> embedding -> index writer.
+
+    Files are loaded through their format's loader and chunked unit by unit
+    in a process pool, at most max_pending files at a time, in file order.
+    The pool gets no more workers than there are files, and a single file
+    (or workers=0) is chunked in-process.
+    Chunks are grouped into batches on a bounded queue; when the embedder
+    falls behind, the queue fills and no more files are handed to the pool
+    (backpressure). Each embedded batch is appended
+    to the IndexWriter straight away, so peak memory is a few batches and
+    not the whole corpus.
+
+    With a deduplicator, workers also fingerprint each chunk and duplicates
+    are dropped before embedding. They are recorded on the writer as extra
+    locations of the chunk they repeat.
+    """
+
+    def __init__(self, embedding_model, workers=None, batch_size=64, queue_size=8, max_pending=None,
+                 chunking=None, deduplicator=None, data_directory="data"):
+        self.embedding_model = embedding_model
+        # Chunks are tagged with their category (top-level folder) under this directory
+        self.data_directory = data_directory
+        self.deduplicator = deduplicator
+        # Keyword arguments for chunk_text (max_length, overlap, boundary)
+        self.chunking = dict(chunking or {})
+        # One core is left to the embedder; on a single core chunk in-process
+        self.workers = max(0, (os.cpu_count() or 2) - 1) if workers is None else workers
+        self.batch_size = batch_size
+        self.queue_size = queue_size
+        self.max_pending = max_pending or max(2, self.workers * 2)
+
+    def _produce(self, paths, batches, stats, stop):
+        """Walk and chunk files, putting chunk batches on the queue. Runs in its own thread."""
+        def put(item):
+            start = time.perf_counter()
+            while not stop.is_set():
+                try:
+                    batches.put(item, timeout=0.1)
+                    break
+                except queue.Full:
+                    continue
+            stats['backpressure_seconds'] += time.perf_counter() - start
+
+        dedup_config = self.deduplicator.config if self.deduplicator is not None else None
+
+        def chunked_files(pool):
+            if pool is None:
+                _init_worker(self.chunking, dedup_config)
+                for path in paths:
+                    yield _chunk_file(path)
+                return
+            pending = deque()
+            for path in paths:
+                pending.append(pool.apply_async(_chunk_file, (path,)))
+                if len(pending) >= self.max_pending:
+                    yield pending.popleft().get()
+            while pending:
+                yield pending.popleft().get()
+
+        pool = None
+        try:
+            # Peek far enough to size the pool: a worker per file, at most self.workers
+            head = list(islice(paths, max(2, self.workers)))
+            paths = chain(head, paths)
+            stats['workers'] = min(self.workers, len(head)) if len(head) > 1 else 0
+            if stats['workers'] > 0:
+                pool = _start_pool(stats['workers'], (self.chunking, dedup_config))
+            # A duplicate may point at a kept chunk still waiting in batch; the
+            # writer only checks duplicate rows when the index is finished
+            batch, duplicates = [], []
+            for chunks, fingerprints, seconds in chunked_files(pool):
+                if stop.is_set():
+                    break
+                stats['files'] += 1
+                stats['chunk_seconds'] += seconds
+                for chunk in chunks:
+                    chunk['category'] = document_category(chunk['source'], self.data_directory)
+                if fingerprints is None:
+                    batch.extend(chunks)
+                else:
+                    for chunk, fingerprint in zip(chunks, fingerprints):
+                        row, is_duplicate = self.deduplicator.add(fingerprint)
+                        if is_duplicate:
+                            duplicates.append((row, chunk))
+                        else:
+                            batch.append(chunk)
+                while len(batch) >= self.batch_size:
+                    put((batch[:self.batch_size], duplicates))
+                    batch, duplicates = batch[self.batch_size:], []
+            if batch or duplicates:
+                put((batch, duplicates))
+            put(None)
+        except BaseException as e:
+            put(e)
+        finally:
+            if pool is not None:
+                pool.terminate()
+                pool.join()
+
+    def run(self, writer, paths):
+        """
+        Chunk, embed and append every file in paths to the writer.
+
+        Args:
+            writer (IndexWriter): destination for chunks and embeddings
+            paths (iterable): file paths, consumed lazily
+
+        Returns:
+            dict: file/chunk counts, throughput and per-stage timings
+        """
+        if self.deduplicator is not None and len(self.deduplicator) != writer.num_chunks:
+            raise ValueError("Deduplicator ids must match the writer's rows")
+        stats = {
+            'files': 0, 'chunks': 0, 'duplicates': 0, 'workers': 0,
+            'chunk_seconds': 0.0, 'embed_seconds': 0.0, 'write_seconds': 0.0,
+            'backpressure_seconds': 0.0, 'starved_seconds': 0.0
+        }
+        batches = queue.Queue(maxsize=self.queue_size)
+        stop = threading.Event()
+        producer = threading.Thread(
+            target=self._produce, args=(iter(paths), batches, stats, stop), name="ingestion-chunker", daemon=True
+        )
+
+        start = time.perf_counter()
+        producer.start()
+        try:
+            while True:
+                wait_start = time.perf_counter()
+                batch = batches.get()
+                stats['starved_seconds'] += time.perf_counter() - wait_start
+                if batch is None:
+                    break
+                if isinstance(batch, BaseException):
+                    raise batch
+                chunks, duplicates = batch
+
+                if chunks:
+                    embed_start = time.perf_counter()
+                    embeddings = self.embedding_model.encode(
+                        [chunk['text'] for chunk in chunks], batch_size=self.batch_size,
+                        convert_to_numpy=True, normalize_embeddings=True
+                    )
+                    stats['embed_seconds'] += time.perf_counter() - embed_start
+
+                write_start = time.perf_counter()
+                if chunks:
+                    writer.append(np.asarray(embeddings, dtype='float32'), chunks)
+                for row, chunk in duplicates:
+                    writer.add_duplicate(row, chunk)
+                stats['write_seconds'] += time.perf_counter() - write_start
+                stats['chunks'] += len(chunks)
+                stats['duplicates'] += len(duplicates)
+        finally:
+            stop.set()
+            producer.join()
+
+        stats['wall_seconds'] = time.perf_counter() - start
+        stats['chunks_per_second'] = stats['chunks'] / stats['wall_seconds'] if stats['wall_seconds'] else 0.0
+        logger.info(
+            f"Ingested {stats['files']} files into {stats['chunks']} chunks "
+            f"({stats['duplicates']} duplicates dropped) in {stats['wall_seconds']:.1f}s "
+            f"({stats['chunks_per_second']:.1f} chunks/s)"
+        )
+        return stats
+
+
+def ingest_directory(writer, embedding_model, directory="data", **kwargs):
+    """Run an IngestionPipeline over every supported file under directory"""
+    return IngestionPipeline(embedding_model, data_directory=directory, **kwargs).run(
+        writer, iter_document_paths(directory)
+    )
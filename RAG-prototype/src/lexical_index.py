@@ -0,0 +1,145 @@
+import os
+import re
+import json
+import math
+import numpy as np
+
+VOCAB_FILE = "lexical_vocab.json"
+TERM_OFFSETS_FILE = "lexical_term_offsets.npy"
+POSTING_ROWS_FILE = "lexical_posting_rows.npy"
+POSTING_WEIGHTS_FILE = "lexical_posting_weights.npy"
+
+# Keeps decimals ("4.5") and alphanumeric codes ("csc101") as single terms
+TOKEN = re.compile(r'\d+(?:\.\d+)+|\w+')
+
+STOPWORDS = frozenset(
+    "a an and are as at be by for from has have how i in is it its of on or that the this to was were "
+    "what when where which who why will with".split()
+)
+
+def tokenize(text):
+    """Lowercased terms without stopwords"""
+    return [term for term in TOKEN.findall(text.lower()) if term not in STOPWORDS]
+
+
+class BM25Builder:
+    """
+    Collects term frequencies row by row and writes a BM25 inverted index.
+
+    Postings are stored in CSR form: for term id t, rows and precomputed
+    BM25 weights live at term_offsets[t]:term_offsets[t + 1]. Scoring a
+    query is then a sum of weights over its terms' postings.
+    """
+
+    def __init__(self, k1=1.5, b=0.75):
+        self.k1 = k1
+        self.b = b
+        self.vocab = {}
+        self._postings = []
+        self._lengths = []
+
+    def add(self, text):
+        """Index the next row"""
+        row = len(self._lengths)
+        counts = {}
+        terms = tokenize(text)
+        for term in terms:
+            counts[term] = counts.get(term, 0) + 1
+        for term, count in counts.items():
+            term_id = self.vocab.setdefault(term, len(self.vocab))
+            if term_id == len(self._postings):
+                self._postings.append([])
+            self._postings[term_id].append((row, count))
+        self._lengths.append(len(terms))
+
+    def write(self, write_atomic):
+        """
+        Write the index through an IndexStore-style write_atomic(name, write_fn).
+        """
+        num_rows = len(self._lengths)
+        lengths = np.asarray(self._lengths, dtype=np.float32)
+        average_length = float(lengths.mean()) if num_rows and lengths.mean() > 0 else 1.0
+
+        term_offsets = np.zeros(len(self._postings) + 1, dtype=np.int64)
+        for term_id, postings in enumerate(self._postings):
+            term_offsets[term_id + 1] = term_offsets[term_id] + len(postings)
+        rows = np.empty(int(term_offsets[-1]), dtype=np.int32)
+        weights = np.empty(int(term_offsets[-1]), dtype=np.float32)
+        for term_id, postings in enumerate(self._postings):
+            start, end = term_offsets[term_id], term_offsets[term_id + 1]
+            posting_rows = np.fromiter((row for row, _ in postings), dtype=np.int32, count=len(postings))
+            frequencies = np.fromiter((count for _, count in postings), dtype=np.float32, count=len(postings))
+            idf = math.log(1 + (num_rows - len(postings) + 0.5) / (len(postings) + 0.5))
+            norm = self.k1 * (1 - self.b + self.b * lengths[posting_rows] / average_length)
+            rows[start:end] = posting_rows
+            weights[start:end] = idf * frequencies * (self.k1 + 1) / (frequencies + norm)
+
+        def write_array(array):
+            def write(path):
+                with open(path, 'wb') as f:
+                    np.save(f, array)
+            return write
+
+        def write_vocab(path):
+            with open(path, 'w', encoding='utf-8') as f:
+                json.dump({'num_rows': num_rows, 'k1': self.k1, 'b': self.b, 'terms': self.vocab}, f)
+
+        write_atomic(TERM_OFFSETS_FILE, write_array(term_offsets))
+        write_atomic(POSTING_ROWS_FILE, write_array(rows))
+        write_atomic(POSTING_WEIGHTS_FILE, write_array(weights))
+        write_atomic(VOCAB_FILE, write_vocab)
+
+
+class BM25Index:
+    """
+    Read side of the BM25 inverted index, with postings memory-mapped.
+    """
+
+    def __init__(self, vocab, term_offsets, posting_rows, posting_weights, num_rows):
+        self.vocab = vocab
+        self.term_offsets = term_offsets
+        self.posting_rows = posting_rows
+        self.posting_weights = posting_weights
+        self.num_rows = num_rows
+
+    @classmethod
+    def load(cls, directory):
+        """Open the index written next to the other index files, or None if absent"""
+        vocab_path = os.path.join(directory, VOCAB_FILE)
+        if not os.path.exists(vocab_path):
+            return None
+        with open(vocab_path, 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+        return cls(
+            meta['terms'],
+            np.load(os.path.join(directory, TERM_OFFSETS_FILE), mmap_mode='r'),
+            np.load(os.path.join(directory, POSTING_ROWS_FILE), mmap_mode='r'),
+            np.load(os.path.join(directory, POSTING_WEIGHTS_FILE), mmap_mode='r'),
+            meta['num_rows']
+        )
+
+    def search(self, query, top_k=20, rows=None):
+        """
+        Returns (rows, scores) of the top_k rows by BM25 score, best first.
+        Rows without any query term are never returned. With rows (a sorted
+        array of row ids), only those rows are ranked.
+        """
+        term_ids = {self.vocab[term] for term in tokenize(query) if term in self.vocab}
+        if not term_ids:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+
+        slices = [slice(int(self.term_offsets[t]), int(self.term_offsets[t + 1])) for t in term_ids]
+        posting_rows = np.concatenate([self.posting_rows[s] for s in slices])
+        weights = np.concatenate([self.posting_weights[s] for s in slices])
+
+        # Sum the weights of each matched row; only rows with postings are touched
+        matched, inverse = np.unique(posting_rows, return_inverse=True)
+        scores = np.bincount(inverse, weights=weights).astype(np.float32)
+        if rows is not None:
+            allowed = np.isin(matched, rows, assume_unique=True)
+            matched, scores = matched[allowed], scores[allowed]
+        if len(matched) > top_k:
+            best = np.argpartition(-scores, top_k)[:top_k]
+            matched, scores = matched[best], scores[best]
+        order = np.argsort(-scores, kind='stable')
+        return matched[order].astype(np.int64), scores[order]
@@ -0,0 +1,92 @@
+import threading
+import torch
+from transformers import DynamicCache
+
+def kv_layers(cache):
+    """Return the (keys, values) tensors of every layer of a KV cache"""
+    if hasattr(cache, 'layers'):
+        return [(layer.keys, layer.values) for layer in cache.layers]
+    return [cache[layer_idx] for layer_idx in range(len(cache))]
+
+def kv_cache(layers):
+    """Build a fresh DynamicCache holding the given (keys, values) layers"""
+    cache = DynamicCache()
+    for layer_idx, (keys, values) in enumerate(layers):
+        cache.update(keys, values, layer_idx)
+    return cache
+
+class CachedPrefix:
+    """Token ids of a static prompt prefix and the model's KV cache for them"""
+
+    def __init__(self, input_ids, layers):
+        self.input_ids = input_ids
+        self.layers = layers
+
+    def __len__(self):
+        return len(self.input_ids)
+
+class PromptPrefixCache:
+    """
+    KV cache for the fixed instruction preamble of the prompt templates.
+    
+    The past-key-values of each distinct prefix are computed once, on first
+    use. encode() tokenizes the prefix and the variable suffix separately,
+    so requests that share a template only need to prefill their own
+    context and question on top of a copy of the cached prefix.
+    """
+
+    def __init__(self, model, tokenizer):
+        self.model = model
+        self.tokenizer = tokenizer
+        self._prefixes = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.reused_tokens = 0
+
+    def get(self, prefix):
+        """Return the CachedPrefix for a prefix string, computing it once"""
+        with self._lock:
+            cached = self._prefixes.get(prefix)
+            if cached is None:
+                input_ids = self.tokenizer(prefix)['input_ids']
+                with torch.no_grad():
+                    outputs = self.model(
+                        input_ids=torch.tensor([input_ids], dtype=torch.long, device=self.model.device),
+                        past_key_values=DynamicCache(),
+                        use_cache=True
+                    )
+                cached = CachedPrefix(input_ids, kv_layers(outputs.past_key_values))
+                self._prefixes[prefix] = cached
+                self.misses += 1
+            else:
+                self.hits += 1
+            return cached
+
+    def encode(self, prefix, suffix_ids):
+        """
+        Prepend the cached prefix to already tokenized suffix ids.
+        
+        Returns:
+            tuple: (input_ids, CachedPrefix or None when nothing is left to prefill)
+        """
+        cached = self.get(prefix)
+        if not suffix_ids:
+            return list(cached.input_ids), None
+        with self._lock:
+            self.reused_tokens += len(cached)
+        return cached.input_ids + list(suffix_ids), cached
+
+    def clear(self):
+        with self._lock:
+            self._prefixes.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'prefixes': len(self._prefixes),
+                'prefix_tokens': sum(len(cached) for cached in self._prefixes.values()),
+                'hits': self.hits,
+                'misses': self.misses,
+                'reused_tokens': self.reused_tokens
+            }
@@ -0,0 +1,131 @@
+import os
+import re
+import time
+import threading
+import logging
+from collections import OrderedDict
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+def normalize_query(query):
+    """Normalize query text so trivially different phrasings share a cache entry"""
+    query = re.sub(r'\s+', ' ', query.strip().lower())
+    return query.rstrip('?!. ')
+
+class QueryEmbeddingCache:
+    """
+    Bounded LRU cache of query embeddings with an optional TTL.
+    
+    Keys are normalized query strings, values are float32 vectors. The
+    cache can be saved to and restored from an .npz file so popular
+    questions stay warm across restarts; entries are tagged with the
+    encoder name and discarded if the encoder changes.
+    """
+
+    def __init__(self, max_size=1024, ttl_seconds=None, persist_path=None, model_name=None):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self.persist_path = persist_path
+        self.model_name = model_name
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        
+        if persist_path:
+            self.load()
+
+    def _expired(self, created_at):
+        return self.ttl_seconds is not None and time.time() - created_at > self.ttl_seconds
+
+    def get(self, query):
+        """Return the cached vector for a query, or None"""
+        key = normalize_query(query)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            vector, created_at = entry
+            if self._expired(created_at):
+                del self._entries[key]
+                self.evictions += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return vector
+
+    def put(self, query, vector, created_at=None):
+        """Store a query vector, evicting the least recently used entry when full"""
+        key = normalize_query(query)
+        vector = np.asarray(vector, dtype='float32')
+        with self._lock:
+            self._entries[key] = (vector, created_at if created_at is not None else time.time())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        """Return hit/miss/eviction counters"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'max_size': self.max_size,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': self.hits / lookups if lookups else 0.0
+            }
+
+    def save(self):
+        """Persist unexpired entries to persist_path"""
+        if not self.persist_path:
+            return False
+        try:
+            with self._lock:
+                items = [(k, v, t) for k, (v, t) in self._entries.items() if not self._expired(t)]
+            if not items:
+                return False
+            keys, vectors, created = zip(*items)
+            tmp_path = self.persist_path + ".tmp"
+            with open(tmp_path, 'wb') as f:
+                np.savez(
+                    f,
+                    keys=np.array(keys),
+                    vectors=np.stack(vectors),
+                    created_at=np.array(created, dtype='float64'),
+                    model_name=np.array(self.model_name or "")
+                )
+            os.replace(tmp_path, self.persist_path)
+            logger.info(f"Saved {len(keys)} query embeddings to {self.persist_path}")
+            return True
+        except Exception as e:
+            logger.error(f"Error saving query cache: {e}")
+            return False
+
+    def load(self):
+        """Restore entries from persist_path, oldest first so LRU order is kept"""
+        if not self.persist_path or not os.path.exists(self.persist_path):
+            return False
+        try:
+            with np.load(self.persist_path) as data:
+                if str(data['model_name']) != (self.model_name or ""):
+                    logger.info("Query cache was built with a different encoder, ignoring it")
+                    return False
+                for key, vector, created_at in zip(data['keys'], data['vectors'], data['created_at']):
+                    if not self._expired(float(created_at)):
+                        self.put(str(key), vector, created_at=float(created_at))
+            logger.info(f"Loaded {len(self._entries)} query embeddings from {self.persist_path}")
+            return True
+        except Exception as e:
+            logger.error(f"Error loading query cache: {e}")
+            return False
@@ -1,125 +1,453 @@
+import time
 import torch
-from transformers import AutoTokenizer, AutoModelForCausalLM
+import threading
+from threading import Thread
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from transformers import StoppingCriteria, StoppingCriteriaList, TextIteratorStreamer
 from accelerate import Accelerator
 from .web_scraper import FetchFromNet
 from .secure_input import SecurePrompt
+from .answer_cache import chunk_set_key
+from .context_packer import ContextPacker
+from .batcher import GenerationBatcher
+from .generation_engine import ContinuousBatchingEngine
+from .prefix_cache import PromptPrefixCache, kv_cache
+from .generator_backend import GENERATOR_MODEL_NAME, load_generator, model_footprint
+from .config import RAGConfig
+
+PIPELINE_MODES = ("sequential", "concurrent")
+
+GENERATION_BATCHING_MODES = ("static", "continuous")
+
+DEFAULT_STAGE_TIMEOUTS = {
+    'screen': 20,
+    'retrieve': 10,
+    'web': 15
+}
+
+GENERATION_KWARGS = {
+    'max_new_tokens': 256,
+    'num_return_sequences': 1,
+    'temperature': 0.7,
+    'do_sample': True
+}
+
+class EventStoppingCriteria(StoppingCriteria):
+    """Stops generate() once the event is set, e.g. when a stream's client is gone"""
+
+    def __init__(self, event):
+        self.event = event
+
+    def __call__(self, input_ids, scores, **kwargs):
+        return torch.full((input_ids.shape[0],), self.event.is_set(), dtype=torch.bool, device=input_ids.device)
+
+# Static instruction preambles of the prompt templates. Their KV cache is
+# computed once and only the context and question after them are prefilled.
+WEB_PROMPT_PREFIX = """
+            Answer the following question using both the provided context and additional web information.
+            Prioritize the context information, but supplement with web information when relevant.
+            If you cannot find a complete answer, state what you know and mention the limitations.
+
+            Local Knowledge Base Context:
+"""
+
+LOCAL_PROMPT_PREFIX = """
+            Answer the following question based only on the provided context. 
+            If the answer cannot be found in the context, state 
+            "I'm sorry, I cannot find the answer to that in my knowledge base."
+
+            Context:
+"""
+
+REFUSAL_MESSAGE = "Sorry, I don't have the permission to process this request."
+NO_WEB_RESULTS = "No additional information found online."
+
+class WebStage:
+    """
+    Web augmentation for one request. In concurrent mode the search is
+    already running and result() waits for it up to its deadline; in
+    sequential mode it is fetched on demand.
+    """
+    
+    def __init__(self, fetch, future=None, cancel_event=None, timeout=None):
+        self.fetch = fetch
+        self.future = future
+        self.cancel_event = cancel_event
+        self.timeout = timeout
+        # The deadline counts from when the stage was started, not from result()
+        self.deadline = time.monotonic() + timeout if timeout is not None else None
+    
+    def result(self):
+        if self.future is None:
+            return self.fetch()
+        remaining = None
+        if self.deadline is not None:
+            remaining = max(0, self.deadline - time.monotonic())
+        try:
+            return self.future.result(timeout=remaining)
+        except FutureTimeoutError:
+            print(f"Web augmentation exceeded its {self.timeout}s deadline, continuing without it")
+            self.cancel()
+            return NO_WEB_RESULTS
+    
+    def cancel(self):
+        if self.cancel_event is not None:
+            self.cancel_event.set()
+        if self.future is not None:
+            self.future.cancel()
 
 class RAGSystem:
-    def __init__(self, retriever):
+    def __init__(self, retriever, config=None, answer_cache=None, web_cache=None, reranker=None):
+        """
+        Args:
+            retriever: Retriever or RetrievalBatcher over the loaded index
+            config (RAGConfig): pipeline and generation settings; the defaults when None
+            answer_cache (SemanticAnswerCache): optional cache of generated answers
+            web_cache (HTTPCache): optional cache of fetched web pages
+            reranker (CrossEncoderReranker): optional second-stage reranker
+        """
+        config = config or RAGConfig()
+        pipeline_mode = config.pipeline_mode
+        generation_batching = config.generation_batching
+        prefix_caching = config.prefix_caching
+        if pipeline_mode not in PIPELINE_MODES:
+            raise ValueError(f"Unknown pipeline mode '{pipeline_mode}', expected one of {PIPELINE_MODES}")
+        if generation_batching not in GENERATION_BATCHING_MODES:
+            raise ValueError(
+                f"Unknown generation batching '{generation_batching}', expected one of {GENERATION_BATCHING_MODES}"
+            )
         self.retriever = retriever
+        # With a reranker, rerank_candidates chunks are retrieved and the
+        # best retrieval_top_k kept, within rerank_budget_ms of retrieval start
+        self.reranker = reranker
+        self.retrieval_top_k = config.retrieval_top_k
+        self.rerank_candidates = max(config.rerank_candidates, config.retrieval_top_k)
+        self.rerank_budget = config.rerank_budget_ms / 1000.0 if config.rerank_budget_ms is not None else None
+        self.answer_cache = answer_cache
+        self.pipeline_mode = pipeline_mode
+        self.stage_timeouts = {**DEFAULT_STAGE_TIMEOUTS, **(config.stage_timeouts or {})}
+        # Web augmentation is skipped when the best local chunk is at least this
+        # similar to the question (cosine, needs the "ip" metric); None disables
+        self.web_skip_threshold = config.web_skip_threshold if getattr(retriever, 'metric', None) == "ip" else None
+        self._web_lock = threading.Lock()
+        self.web_stats = {'requests': 0, 'skipped': 0, 'fallbacks': 0}
+        self.stage_pool = ThreadPoolExecutor(max_workers=12, thread_name_prefix="rag-stage")
         self.accelerator = Accelerator()
-        self.webscraper = FetchFromNet()
-        self.checkPrompt = SecurePrompt()
-        
-        model_name = "google/gemma-2b-it"
-        self.tokenizer = AutoTokenizer.from_pretrained(model_name)
-        self.model = AutoModelForCausalLM.from_pretrained(
-            model_name,
-            device_map="auto" 
+        self.webscraper = FetchFromNet(cache=web_cache)
+        # Local screening reuses the retriever's (cached) MiniLM query encoder
+        self.checkPrompt = SecurePrompt(
+            encoder=retriever.encode_queries,
+            remote_fallback=config.remote_screening_fallback
+        )
+        
+        self.model, self.tokenizer, self.generator_backend = load_generator(
+            GENERATOR_MODEL_NAME, config.generator_backend, accelerator=self.accelerator,
+            onnx_export_dir=config.onnx_export_dir
         )
+        self.generator_footprint = model_footprint(self.model)
+        
+        # Prompts are packed into these token budgets (instructions included)
+        # rather than truncated by the tokenizer
+        self.prompt_token_budget = config.prompt_token_budget
+        self.local_prompt_token_budget = config.local_prompt_token_budget
+        self.context_packer = ContextPacker(self.tokenizer, web_share=config.web_context_share)
+        
+        # The ONNX graph only supports generate(), not the manual KV-cache
+        # handling behind prefix caching and continuous batching
+        if self.generator_backend == "onnx":
+            prefix_caching = False
+            generation_batching = "static"
+        self.prefix_cache = PromptPrefixCache(self.model, self.tokenizer) if prefix_caching else None
         
-        self.model, self.tokenizer = self.accelerator.prepare(self.model, self.tokenizer)
+        # Concurrent requests share batched generate() calls when enabled:
+        # "static" batches whole generate() calls, "continuous" batches
+        # decoding steps so short answers leave without waiting for long ones
+        self.generation_batcher = None
+        generation_batch_size = config.generation_batch_size
+        if generation_batch_size > 1 and generation_batching == "continuous":
+            self.generation_batcher = ContinuousBatchingEngine(
+                self.model,
+                self.tokenizer,
+                generation_kwargs=GENERATION_KWARGS,
+                max_batch_size=generation_batch_size,
+                max_batch_tokens=config.generation_max_batch_tokens
+            )
+        elif generation_batch_size > 1:
+            self.generation_batcher = GenerationBatcher(
+                self.model,
+                self.tokenizer,
+                generation_kwargs=GENERATION_KWARGS,
+                max_batch_size=generation_batch_size,
+                max_wait_ms=config.generation_max_wait_ms,
+                max_batch_tokens=config.generation_max_batch_tokens
+            )
 
-    def generate_response(self, query):
+    def _lookup_answer(self, query, retrieved_chunks, mode):
         """
-        Performs retrieval and then generates a response with web search augmentation.
+        Checks the semantic answer cache for a near-duplicate question that was
+        answered from the same chunks. Returns (answer or None, cache entry key).
         """
-        # Step 1: Check if prompt is safe
-        is_safe = self.checkPrompt.screen_prompt(query)
-        if is_safe.lower().strip() != "yes":
-            return "Sorry, I don't have the permission to process this request."
+        if self.answer_cache is None:
+            return None, None
+        # Retrieval has just encoded the query, so this is served by the query cache
+        query_vector = self.retriever.encode_queries([query])[0]
+        context_key = chunk_set_key(retrieved_chunks, mode=mode)
+        return self.answer_cache.lookup(query_vector, context_key), (query_vector, context_key)
+    
+    def _store_answer(self, cache_entry, answer):
+        if self.answer_cache is not None and cache_entry is not None:
+            query_vector, context_key = cache_entry
+            self.answer_cache.store(query_vector, context_key, answer)
+    
+    def _gate_web_stage(self, retrieved_chunks, web_stage):
+        """
+        Drop the web stage when local retrieval is confident: a running
+        search is cancelled and the prompt gets NO_WEB_RESULTS instead.
+        """
+        if web_stage is None:
+            return None
+        confident = (
+            self.web_skip_threshold is not None and
+            max((chunk.get('score', float('-inf')) for chunk in retrieved_chunks), default=float('-inf'))
+            >= self.web_skip_threshold
+        )
+        with self._web_lock:
+            self.web_stats['requests'] += 1
+            self.web_stats['skipped' if confident else 'fallbacks'] += 1
+        if not confident:
+            return web_stage
+        web_stage.cancel()
+        return WebStage(lambda: NO_WEB_RESULTS)
+    
+    def web_augmentation_stats(self):
+        """How often web augmentation was needed (fallback_rate) or skipped"""
+        with self._web_lock:
+            stats = dict(self.web_stats)
+        stats['fallback_rate'] = stats['fallbacks'] / stats['requests'] if stats['requests'] else 0.0
+        stats['skip_threshold'] = self.web_skip_threshold
+        return stats
+    
+    def _retrieve(self, query, filters=None):
+        """
+        Local retrieval stage: the retriever's top chunks, or a wider
+        candidate set reranked by the cross-encoder when one is configured.
+        """
+        if self.reranker is None:
+            return self.retriever.retrieve(query, top_k=self.retrieval_top_k, filters=filters)
+        deadline = time.monotonic() + self.rerank_budget if self.rerank_budget is not None else None
+        candidates = self.retriever.retrieve(query, top_k=self.rerank_candidates, filters=filters)
+        return self.reranker.rerank(query, candidates, top_k=self.retrieval_top_k, deadline=deadline)
+    
+    def _run_stages(self, query, use_web=True, filters=None):
+        """
+        Runs prompt screening, local retrieval and (optionally) web augmentation.
         
-        # Step 2: Retrieve relevant documents from local knowledge base
-        retrieved_chunks = self.retriever.retrieve(query)
-        local_context = "\n".join([chunk['text'] for chunk in retrieved_chunks])
+        Sequential mode keeps the original order. Concurrent mode starts all
+        stages at once, each with its own deadline, and cancels the others as
+        soon as screening rejects the prompt. In both modes the web stage is
+        dropped when the retrieved chunks already answer confidently.
+        filters restricts local retrieval, e.g. {"category": "academic_docs"}.
         
-        # Step 3: Get additional information from web search
-        web_summary = self.webscraper.get_search_summary(query)
+        Returns:
+            tuple: (allowed, retrieved_chunks, WebStage or None)
+        """
+        if self.pipeline_mode == "sequential":
+            is_safe = self.checkPrompt.screen_prompt(query)
+            if is_safe.lower().strip() != "yes":
+                return False, [], None
+            retrieved_chunks = self._retrieve(query, filters=filters)
+            web_stage = WebStage(lambda: self.webscraper.get_search_summary(query)) if use_web else None
+            return True, retrieved_chunks, self._gate_web_stage(retrieved_chunks, web_stage)
         
-        # Step 4: Create a comprehensive prompt
-        prompt = f"""
-            Answer the following question using both the provided context and additional web information.
-            Prioritize the context information, but supplement with web information when relevant.
-            If you cannot find a complete answer, state what you know and mention the limitations.
-
-            Local Knowledge Base Context:
-            {local_context}
-
-            Additional Web Information:
-            {web_summary}
-
-            Question: {query}
-
-            Answer:
-            """
+        cancel_event = threading.Event()
+        screen_future = self.stage_pool.submit(self.checkPrompt.screen_prompt, query)
+        retrieve_future = self.stage_pool.submit(self._retrieve, query, filters=filters)
+        web_stage = None
+        if use_web:
+            web_future = self.stage_pool.submit(
+                self.webscraper.get_search_summary, query, cancel_event=cancel_event
+            )
+            web_stage = WebStage(None, web_future, cancel_event, self.stage_timeouts['web'])
+        
+        try:
+            is_safe = screen_future.result(timeout=self.stage_timeouts['screen'])
+        except BaseException:
+            retrieve_future.cancel()
+            if web_stage is not None:
+                web_stage.cancel()
+            raise
         
-        # Step 5: Generate the response from the LLM
-        inputs = self.tokenizer(prompt, return_tensors="pt", max_length=2048, truncation=True)
-        inputs = {k: v.to(self.model.device) for k, v in inputs.items()}
+        if is_safe.lower().strip() != "yes":
+            retrieve_future.cancel()
+            if web_stage is not None:
+                web_stage.cancel()
+            return False, [], None
+        
+        try:
+            retrieved_chunks = retrieve_future.result(timeout=self.stage_timeouts['retrieve'])
+        except BaseException:
+            if web_stage is not None:
+                web_stage.cancel()
+            raise
+        return True, retrieved_chunks, self._gate_web_stage(retrieved_chunks, web_stage)
+    
+    def _encode_prompt(self, prefix, query, chunks, budget, web_summary=None):
+        """
+        Packs the instructions, retrieved chunks, web summary (if any) and
+        question into budget tokens. Returns the token ids and the cached
+        prefix they start with (None without prefix caching).
+        """
+        packed = self.context_packer.pack(prefix, query, chunks, budget, web_summary)
+        if self.prefix_cache is not None:
+            return self.prefix_cache.encode(prefix, packed.suffix_ids)
+        return packed.prefix_ids + packed.suffix_ids, None
+    
+    def _model_inputs(self, input_ids, prefix):
+        """generate() inputs, resuming from a copy of the cached prefix when there is one"""
+        inputs = {
+            'input_ids': torch.tensor([input_ids], dtype=torch.long, device=self.model.device),
+            'attention_mask': torch.ones((1, len(input_ids)), dtype=torch.long, device=self.model.device)
+        }
+        if prefix is not None:
+            inputs['past_key_values'] = kv_cache(prefix.layers)
+        return inputs
+    
+    def _generate(self, prefix, query, chunks, budget, web_summary=None):
+        """
+        Generates an answer for the packed prompt and returns only the new text.
+        Requests go through the generation batcher when batching is enabled.
+        """
+        input_ids, cached_prefix = self._encode_prompt(prefix, query, chunks, budget, web_summary)
+        if self.generation_batcher is not None:
+            return self.generation_batcher.generate(input_ids, cached_prefix)
         
+        inputs = self._model_inputs(input_ids, cached_prefix)
         with torch.no_grad():
             outputs = self.model.generate(
                 **inputs,
-                max_new_tokens=256,
-                num_return_sequences=1,
-                temperature=0.7,
-                do_sample=True,
+                **GENERATION_KWARGS,
                 pad_token_id=self.tokenizer.eos_token_id
             )
         
-        response = self.tokenizer.decode(outputs[0], skip_special_tokens=True)
+        # Decode only the new tokens, so the prompt never has to be sliced off
+        return self.tokenizer.decode(outputs[0][len(input_ids):], skip_special_tokens=True)
+
+    def generate_response(self, query, filters=None):
+        """
+        Performs retrieval and then generates a response with web search augmentation.
+        filters limits retrieval to matching chunk metadata (category, source).
+        """
+        # Steps 1-3: Check if prompt is safe, retrieve relevant documents from the
+        # local knowledge base and search the web (concurrently in concurrent mode)
+        allowed, retrieved_chunks, web_stage = self._run_stages(query, filters=filters)
+        if not allowed:
+            return REFUSAL_MESSAGE
+        
+        cached_answer, cache_entry = self._lookup_answer(query, retrieved_chunks, mode="web")
+        if cached_answer is not None:
+            web_stage.cancel()
+            return cached_answer
         
-        # Step 6: Post-process the response to remove the prompt
-        response_start_index = response.find("Answer:") + len("Answer:")
-        final_response = response[response_start_index:].strip()
+        web_summary = web_stage.result()
         
-        # Clean up the response
+        # Steps 4-5: Pack the prompt into its token budget and generate the response
+        final_response = self._generate(
+            WEB_PROMPT_PREFIX, query, retrieved_chunks, self.prompt_token_budget, web_summary
+        ).strip()
+        
+        # Step 6: Clean up the response
         if not final_response or len(final_response) < 10:
             final_response = "I apologize, but I couldn't generate a proper response. Please try rephrasing your question."
+        else:
+            self._store_answer(cache_entry, final_response)
         
         return final_response
 
-    def generate_response_local_only(self, query):
+    def generate_response_stream(self, query, filters=None):
         """
-        Generate response using only local knowledge base (no web search)
+        Same pipeline as generate_response, but yields the answer text piece by
+        piece as the model produces it instead of waiting for all new tokens.
         """
-        # Check if prompt is safe
-        is_safe = self.checkPrompt.screen_prompt(query)
-        if is_safe.lower().strip() != "yes":
-            return "Sorry, I don't have the permission to process this request."
+        allowed, retrieved_chunks, web_stage = self._run_stages(query, filters=filters)
+        if not allowed:
+            yield REFUSAL_MESSAGE
+            return
         
-        # Retrieve relevant documents
-        retrieved_chunks = self.retriever.retrieve(query)
-        context = "\n".join([chunk['text'] for chunk in retrieved_chunks])
+        cached_answer, cache_entry = self._lookup_answer(query, retrieved_chunks, mode="web")
+        if cached_answer is not None:
+            web_stage.cancel()
+            yield cached_answer
+            return
         
-        prompt = f"""
-            Answer the following question based only on the provided context. 
-            If the answer cannot be found in the context, state 
-            "I'm sorry, I cannot find the answer to that in my knowledge base."
-
-            Context:
-            {context}
-
-            Question: {query}
-
-            Answer:
-            """
+        web_summary = web_stage.result()
+        input_ids, cached_prefix = self._encode_prompt(
+            WEB_PROMPT_PREFIX, query, retrieved_chunks, self.prompt_token_budget, web_summary
+        )
+        inputs = self._model_inputs(input_ids, cached_prefix)
         
-        inputs = self.tokenizer(prompt, return_tensors="pt", max_length=1024, truncation=True)
-        inputs = {k: v.to(self.model.device) for k, v in inputs.items()}
+        # The streamer only emits new tokens, so no "Answer:" slicing is needed
+        streamer = TextIteratorStreamer(self.tokenizer, skip_prompt=True, skip_special_tokens=True)
+        stop = threading.Event()
+        generation_kwargs = dict(
+            **inputs,
+            **GENERATION_KWARGS,
+            streamer=streamer,
+            stopping_criteria=StoppingCriteriaList([EventStoppingCriteria(stop)]),
+            pad_token_id=self.tokenizer.eos_token_id
+        )
         
-        with torch.no_grad():
-            outputs = self.model.generate(
-                **inputs,
-                max_new_tokens=256,
-                num_return_sequences=1,
-                temperature=0.7,
-                do_sample=True,
-                pad_token_id=self.tokenizer.eos_token_id
-            )
+        errors = []
+        
+        def run_generation():
+            try:
+                with torch.no_grad():
+                    self.model.generate(**generation_kwargs)
+            except Exception as e:
+                # Unblock the consumer, the error is re-raised below
+                errors.append(e)
+                streamer.end()
+        
+        thread = Thread(target=run_generation, daemon=True)
+        thread.start()
+        
+        pieces = []
+        try:
+            for text in streamer:
+                if text:
+                    pieces.append(text)
+                    yield text
+        finally:
+            # Closing the generator (client disconnected) stops decoding at the next token
+            stop.set()
+        thread.join()
+        if errors:
+            raise errors[0]
+        
+        final_response = "".join(pieces).strip()
+        if not final_response:
+            yield "I apologize, but I couldn't generate a proper response. Please try rephrasing your question."
+        elif len(final_response) >= 10:
+            self._store_answer(cache_entry, final_response)
+    
+    def generate_response_local_only(self, query, filters=None):
+        """
+        Generate response using only local knowledge base (no web search)
+        """
+        # Check if prompt is safe and retrieve relevant documents
+        allowed, retrieved_chunks, _ = self._run_stages(query, use_web=False, filters=filters)
+        if not allowed:
+            return REFUSAL_MESSAGE
+        
+        cached_answer, cache_entry = self._lookup_answer(query, retrieved_chunks, mode="local")
+        if cached_answer is not None:
+            return cached_answer
+        
+        final_response = self._generate(
+            LOCAL_PROMPT_PREFIX, query, retrieved_chunks, self.local_prompt_token_budget
+        ).strip()
         
-        response = self.tokenizer.decode(outputs[0], skip_special_tokens=True)
-        response_start_index = response.find("Answer:") + len("Answer:")
-        final_response = response[response_start_index:].strip()
+        if not final_response:
+            return "I couldn't generate a proper response. Please try again."
         
-        return final_response if final_response else "I couldn't generate a proper response. Please try again."
\ No newline at end of file
+        self._store_answer(cache_entry, final_response)
+        return final_response
\ No newline at end of file
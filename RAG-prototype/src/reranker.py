@@ -0,0 +1,136 @@
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+import numpy as np
+from sentence_transformers import CrossEncoder
+from .query_cache import normalize_query
+
+# 6-layer MiniLM trained on MS MARCO passage ranking: small enough to
+# score tens of pairs per request on CPU
+RERANKER_MODEL_NAME = "cross-encoder/ms-marco-MiniLM-L-6-v2"
+
+def chunk_digest(chunk):
+    """Stable key of a chunk's source and text"""
+    return hashlib.md5((chunk['source'] + "\0" + chunk['text']).encode('utf-8')).hexdigest()
+
+class CrossEncoderReranker:
+    """
+    Second-stage reranking of retrieved candidates with a cross-encoder.
+
+    The retriever cheaply returns a wide candidate set. The cross-encoder
+    reads each (query, chunk) pair jointly, and only the best top_k go on
+    to the prompt. Uncached pairs are scored in batches of batch_size.
+    Scores are kept in an LRU cache keyed by (normalized query, chunk), so
+    repeated questions skip the model.
+
+    A request's deadline bounds the added latency. Reranking is skipped,
+    and the retriever's order kept, when the deadline has already passed
+    or the next batch would overrun it. The estimate comes from a running
+    average of the time per pair. Pairs scored before a skip stay cached.
+    """
+
+    def __init__(self, model_name=RERANKER_MODEL_NAME, batch_size=16, cache_size=4096, max_length=512,
+                 model=None):
+        self.model_name = model_name
+        self.model = model if model is not None else CrossEncoder(model_name, max_length=max_length, device="cpu")
+        self.batch_size = batch_size
+        self.cache_size = cache_size
+        self._scores = OrderedDict()
+        self._lock = threading.Lock()
+        # Running average of model time per pair, for the deadline check
+        self._seconds_per_pair = 0.0
+        self._stats = {
+            'requests': 0, 'reranked': 0, 'skipped': 0,
+            'pairs_scored': 0, 'cache_hits': 0, 'rerank_seconds': 0.0
+        }
+
+    def _cached_scores(self, keys):
+        """Scores found in the cache, and the positions still to score"""
+        scores = np.zeros(len(keys), dtype='float32')
+        missing = []
+        with self._lock:
+            for i, key in enumerate(keys):
+                score = self._scores.get(key)
+                if score is None:
+                    missing.append(i)
+                else:
+                    self._scores.move_to_end(key)
+                    scores[i] = score
+            self._stats['cache_hits'] += len(keys) - len(missing)
+        return scores, missing
+
+    def _score_batch(self, query, chunks, keys, batch, scores):
+        start = time.monotonic()
+        batch_scores = self.model.predict(
+            [(query, chunks[i]['text']) for i in batch],
+            batch_size=self.batch_size, convert_to_numpy=True, show_progress_bar=False
+        )
+        elapsed = time.monotonic() - start
+        scores[batch] = batch_scores
+        with self._lock:
+            per_pair = elapsed / len(batch)
+            self._seconds_per_pair = per_pair if not self._seconds_per_pair else (
+                0.8 * self._seconds_per_pair + 0.2 * per_pair
+            )
+            self._stats['pairs_scored'] += len(batch)
+            for i, score in zip(batch, batch_scores):
+                self._scores[keys[i]] = float(score)
+                self._scores.move_to_end(keys[i])
+            while len(self._scores) > self.cache_size:
+                self._scores.popitem(last=False)
+
+    def _finish(self, outcome, start):
+        with self._lock:
+            self._stats[outcome] += 1
+            self._stats['rerank_seconds'] += time.monotonic() - start
+
+    def rerank(self, query, chunks, top_k=3, deadline=None):
+        """
+        Reorders retrieved chunks by cross-encoder relevance.
+
+        Args:
+            query (str): the user's question
+            chunks (list): candidate chunks in retrieval order
+            top_k (int): number of chunks to return
+            deadline (float): time.monotonic() after which reranking is
+                abandoned and the retrieval order is used; None for no limit
+
+        Returns:
+            list: the top_k chunks, best first. Reranked chunks carry their
+            cross-encoder score as 'rerank_score'.
+        """
+        start = time.monotonic()
+        with self._lock:
+            self._stats['requests'] += 1
+        if len(chunks) <= 1:
+            return chunks[:top_k]
+        if deadline is not None and start >= deadline:
+            self._finish('skipped', start)
+            return chunks[:top_k]
+
+        normalized = normalize_query(query)
+        keys = [(normalized, chunk_digest(chunk)) for chunk in chunks]
+        scores, missing = self._cached_scores(keys)
+        for begin in range(0, len(missing), self.batch_size):
+            batch = missing[begin:begin + self.batch_size]
+            if deadline is not None and time.monotonic() + len(batch) * self._seconds_per_pair > deadline:
+                self._finish('skipped', start)
+                return chunks[:top_k]
+            self._score_batch(query, chunks, keys, batch, scores)
+
+        order = np.argsort(-scores, kind='stable')[:top_k]
+        self._finish('reranked', start)
+        return [dict(chunks[i], rerank_score=float(scores[i])) for i in order]
+
+    def stats(self):
+        """Rerank/skip counts, cache hits and average time spent per request"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats['cached_pairs'] = len(self._scores)
+            stats['ms_per_pair'] = 1000 * self._seconds_per_pair
+        decided = stats['reranked'] + stats['skipped']
+        stats['skip_rate'] = stats['skipped'] / decided if decided else 0.0
+        stats['avg_rerank_ms'] = 1000 * stats.pop('rerank_seconds') / decided if decided else 0.0
+        stats['model'] = self.model_name
+        return stats
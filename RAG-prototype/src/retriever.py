@@ -1,32 +1,389 @@
+import math
 import faiss
 import numpy as np
 import torch
+from .query_cache import normalize_query
+from .index_store import DUPLICATE_COLUMNS
+
+INDEX_SPECS = ("flat", "ivf_flat", "ivf_pq", "hnsw")
+
+# "ip" searches unit-length vectors by inner product, i.e. cosine similarity
+INDEX_METRICS = {"ip": faiss.METRIC_INNER_PRODUCT, "l2": faiss.METRIC_L2}
+
+# Constant of reciprocal rank fusion: score = sum over rankings of 1 / (RRF_K + rank)
+RRF_K = 60
+
+# Chunk metadata that retrieval can be filtered on, with the ChunkStore
+# id column, name table and duplicates table column backing each field
+FILTER_FIELDS = {
+    "category": ("category_ids", "categories", DUPLICATE_COLUMNS.index("category_id")),
+    "source": ("source_ids", "sources", DUPLICATE_COLUMNS.index("source_id"))
+}
+
+# Partitions up to this size are scanned exactly even behind an ANN index
+EXACT_PARTITION_ROWS = 8192
+# Rows scored per step of an exact partition scan
+PARTITION_BLOCK_ROWS = 16384
+# Distinct filters whose partitions are kept
+MAX_CACHED_PARTITIONS = 256
+
+def filter_key(filters):
+    """
+    Hashable form of a filters dict such as {"category": "academic_docs"}
+    or {"source": [path, ...]}; values may be a string or a list.
+    Returns None for no filters.
+    """
+    if not filters:
+        return None
+    key = []
+    for field, values in filters.items():
+        if field not in FILTER_FIELDS:
+            raise ValueError(f"Unknown filter field '{field}', expected one of {tuple(FILTER_FIELDS)}")
+        if isinstance(values, str):
+            values = [values]
+        key.append((field, tuple(sorted(set(values)))))
+    return tuple(sorted(key))
+
+class Partition:
+    """Sorted rows matching a filter, with a FAISS ID selector built on first use"""
+    
+    def __init__(self, rows):
+        self.rows = rows
+        self.contiguous = len(rows) > 0 and int(rows[-1]) - int(rows[0]) + 1 == len(rows)
+        self._selector = None
+    
+    @property
+    def selector(self):
+        if self._selector is None:
+            if self.contiguous:
+                self._selector = faiss.IDSelectorRange(int(self.rows[0]), int(self.rows[-1]) + 1)
+            else:
+                self._selector = faiss.IDSelectorBatch(self.rows)
+        return self._selector
+
+def _default_nlist(num_vectors):
+    """Pick an IVF list count that the corpus can actually train"""
+    nlist = int(4 * math.sqrt(num_vectors))
+    # FAISS wants roughly 39 training points per centroid
+    return max(1, min(nlist, num_vectors // 39))
+
+def normalize_rows(vectors):
+    """Scale each row to unit length (zero rows are left as they are)"""
+    vectors = np.asarray(vectors, dtype='float32')
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+def build_index(embeddings, index_spec="flat", index_params=None, metric="ip"):
+    """
+    Builds and trains a FAISS index for the given embeddings.
+    
+    Args:
+        embeddings (np.ndarray): float32 matrix of shape (num_vectors, dim)
+        index_spec (str): one of "flat", "ivf_flat", "ivf_pq", "hnsw"
+        index_params (dict): optional overrides - nlist (IVF), pq_m and
+            pq_nbits (PQ), hnsw_m (HNSW)
+        metric (str): "ip" (inner product, for normalized embeddings) or "l2"
+    
+    Returns:
+        faiss.Index: trained index with all embeddings added
+    """
+    if index_spec not in INDEX_SPECS:
+        raise ValueError(f"Unknown index spec '{index_spec}', expected one of {INDEX_SPECS}")
+    if metric not in INDEX_METRICS:
+        raise ValueError(f"Unknown metric '{metric}', expected one of {tuple(INDEX_METRICS)}")
+    
+    params = index_params or {}
+    num_vectors, dimension = embeddings.shape
+    
+    if index_spec == "flat":
+        factory = "Flat"
+    elif index_spec == "ivf_flat":
+        nlist = params.get("nlist") or _default_nlist(num_vectors)
+        factory = f"IVF{nlist},Flat"
+    elif index_spec == "ivf_pq":
+        nlist = params.get("nlist") or _default_nlist(num_vectors)
+        pq_m = params.get("pq_m", 8)
+        if dimension % pq_m != 0:
+            raise ValueError(f"pq_m={pq_m} must divide the embedding dimension {dimension}")
+        # Each PQ codebook needs at least 2**nbits training points
+        pq_nbits = params.get("pq_nbits") or max(1, min(8, int(math.log2(max(2, num_vectors // 39)))))
+        factory = f"IVF{nlist},PQ{pq_m}x{pq_nbits}"
+    else:
+        hnsw_m = params.get("hnsw_m", 32)
+        factory = f"HNSW{hnsw_m},Flat"
+    
+    index = faiss.index_factory(dimension, factory, INDEX_METRICS[metric])
+    if not index.is_trained:
+        index.train(embeddings)
+    index.add(embeddings)
+    return index
+
+def set_search_params(index, nprobe=None, ef_search=None):
+    """
+    Tunes the recall/latency trade-off of an ANN index at query time.
+    nprobe applies to IVF indexes, ef_search to HNSW; flat indexes ignore both.
+    """
+    parameter_space = faiss.ParameterSpace()
+    if nprobe is not None and faiss.try_extract_index_ivf(index) is not None:
+        parameter_space.set_index_parameter(index, "nprobe", int(nprobe))
+    if ef_search is not None and isinstance(faiss.downcast_index(index), faiss.IndexHNSW):
+        parameter_space.set_index_parameter(index, "efSearch", int(ef_search))
 
 class Retriever:
-    def __init__(self, embeddings, documents, embedding_model):
+    def __init__(self, embeddings, documents, embedding_model, index=None,
+                 index_spec="flat", index_params=None, nprobe=None, ef_search=None,
+                 query_cache=None, lexical_index=None, hybrid_candidates=20, rrf_k=RRF_K, metric="ip"):
         self.documents = documents
+        self.metric = metric
         self.embedding_model = embedding_model
+        self.query_cache = query_cache
+        self.index_spec = index_spec
+        # With a BM25 index, dense and lexical rankings are fused (hybrid retrieval)
+        self.lexical_index = lexical_index
+        self.hybrid_candidates = hybrid_candidates
+        self.rrf_k = rrf_k
+        # filter_key -> Partition
+        self._partitions = {}
         
-        # Convert embeddings to numpy array for FAISS
-        embeddings_np = embeddings.cpu().numpy().astype('float32')
-        dimension = embeddings_np.shape[1]
+        # A prebuilt (e.g. memory-mapped) index is used as is
+        if index is not None:
+            self.index = index
+        else:
+            # Convert embeddings to numpy array for FAISS
+            if isinstance(embeddings, torch.Tensor):
+                embeddings = embeddings.cpu().numpy()
+            embeddings = np.ascontiguousarray(embeddings, dtype='float32')
+            if metric == "ip":
+                embeddings = normalize_rows(embeddings)
+            
+            # Create (and train, for IVF/PQ) a FAISS index
+            self.index = build_index(embeddings, index_spec, index_params, metric=metric)
+        # Kept (memory-mapped when loaded from disk) to score lexical-only hits
+        self.embeddings = embeddings
         
-        # Create a FAISS index
-        self.index = faiss.IndexFlatL2(dimension)
-        self.index.add(embeddings_np)
+        set_search_params(self.index, nprobe=nprobe, ef_search=ef_search)
 
-    def retrieve(self, query, top_k=3):
+    def encode_queries(self, queries):
         """
-        Takes a query, generates its embedding, and searches the index for
-        the top_k most similar document chunks.
+        Encodes a list of queries in one batched forward pass.
+        Queries found in the query cache skip the encoder entirely.
+        Returns a float32 matrix of shape (len(queries), dim), with unit
+        rows for the "ip" metric.
         """
-        # Generate embedding for the query
-        query_embedding = self.embedding_model.encode(query, convert_to_tensor=True).cpu().numpy().astype('float32').reshape(1, -1)
+        if self.query_cache is None:
+            query_embeddings = self.embedding_model.encode(queries, convert_to_tensor=True)
+            return self._prepare_queries(query_embeddings.cpu().numpy().astype('float32').reshape(len(queries), -1))
         
-        # Search the FAISS index
-        distances, indices = self.index.search(query_embedding, top_k)
+        vectors = [self.query_cache.get(query) for query in queries]
         
-        # Retrieve the actual document chunks based on indices
-        retrieved_chunks = [self.documents[i] for i in indices[0]]
+        # Encode each distinct missing query once
+        missing = {}
+        for i, vector in enumerate(vectors):
+            if vector is None:
+                missing.setdefault(normalize_query(queries[i]), []).append(i)
+        if missing:
+            positions = list(missing.values())
+            encoded = self.embedding_model.encode([queries[rows[0]] for rows in positions], convert_to_tensor=True)
+            encoded = encoded.cpu().numpy().astype('float32').reshape(len(positions), -1)
+            for rows, vector in zip(positions, encoded):
+                self.query_cache.put(queries[rows[0]], vector)
+                for i in rows:
+                    vectors[i] = vector
+        return self._prepare_queries(np.stack(vectors).astype('float32'))
+    
+    def _prepare_queries(self, query_embeddings):
+        # Cached vectors may predate normalization, so this is applied on the way out
+        return normalize_rows(query_embeddings) if self.metric == "ip" else query_embeddings
+    
+    def _scored(self, row, score, **extra):
+        """A copy of the chunk at row with its retrieval score attached"""
+        return dict(self.documents[row], score=score, **extra)
+    
+    def partition(self, filters):
+        """
+        The rows whose metadata matches every field of filters (None for no
+        filters). Read from the ChunkStore's id columns without touching
+        chunk text, and cached per distinct filter. A row also matches when
+        one of its dropped duplicates was found at a matching location, so
+        deduplication never hides text from a category or source.
+        """
+        key = filter_key(filters)
+        if key is None:
+            return None
+        partition = self._partitions.get(key)
+        if partition is not None:
+            return partition
+        
+        if getattr(self.documents, 'source_ids', None) is not None:
+            mask = self._store_mask(key)
+        else:
+            def matches(location):
+                return all(location.get(field) in values for field, values in key)
+            mask = np.fromiter(
+                (matches(chunk) or any(matches(location) for location in chunk.get('duplicates', ()))
+                 for chunk in self.documents),
+                dtype=bool, count=len(self.documents)
+            )
+        partition = Partition(np.flatnonzero(mask).astype(np.int64))
+        if len(self._partitions) >= MAX_CACHED_PARTITIONS:
+            self._partitions.clear()
+        self._partitions[key] = partition
+        return partition
+    
+    def _store_mask(self, key):
+        """partition() over a ChunkStore: kept rows and duplicate locations are matched by id"""
+        duplicates = getattr(self.documents, 'duplicates', None)
+        duplicates = np.asarray(duplicates) if duplicates is not None else np.empty((0, len(DUPLICATE_COLUMNS)))
+        mask = np.ones(len(self.documents), dtype=bool)
+        duplicate_mask = np.ones(len(duplicates), dtype=bool)
+        for field, values in key:
+            id_column, names, duplicate_column = FILTER_FIELDS[field]
+            wanted = [i for i, name in enumerate(getattr(self.documents, names) or []) if name in values]
+            ids = getattr(self.documents, id_column, None)
+            mask &= np.isin(np.asarray(ids), wanted) if ids is not None else False
+            duplicate_mask &= np.isin(duplicates[:, duplicate_column], wanted)
+        mask[duplicates[duplicate_mask, 0].astype(np.int64)] = True
+        return mask
+    
+    def _exact_search(self, query_embeddings, top_k, rows):
+        """Brute-force (scores, rows) over the given rows only, best first"""
+        top_k = min(top_k, len(rows))
+        # Larger is better for inner product, smaller for L2 distance
+        sign = 1.0 if self.metric == "ip" else -1.0
+        best_scores = np.empty((len(query_embeddings), 0), dtype='float32')
+        best_rows = np.empty((len(query_embeddings), 0), dtype=np.int64)
+        for start in range(0, len(rows), PARTITION_BLOCK_ROWS):
+            block = rows[start:start + PARTITION_BLOCK_ROWS]
+            if int(block[-1]) - int(block[0]) + 1 == len(block):
+                vectors = self.embeddings[int(block[0]):int(block[-1]) + 1]
+            else:
+                vectors = self.embeddings[block]
+            vectors = np.asarray(vectors, dtype='float32')
+            scores = query_embeddings @ vectors.T
+            if self.metric != "ip":
+                scores = (np.sum(query_embeddings ** 2, axis=1)[:, None] - 2 * scores
+                          + np.sum(vectors ** 2, axis=1)[None, :])
+            best_scores = np.concatenate([best_scores, scores.astype('float32')], axis=1)
+            best_rows = np.concatenate([best_rows, np.broadcast_to(block, scores.shape)], axis=1)
+            if best_scores.shape[1] > top_k:
+                keep = np.argpartition(-sign * best_scores, top_k - 1, axis=1)[:, :top_k]
+                best_scores = np.take_along_axis(best_scores, keep, axis=1)
+                best_rows = np.take_along_axis(best_rows, keep, axis=1)
+        order = np.argsort(-sign * best_scores, axis=1, kind='stable')
+        return np.take_along_axis(best_scores, order, axis=1), np.take_along_axis(best_rows, order, axis=1)
+    
+    def _search_parameters(self, partition):
+        """FAISS search parameters restricted to a partition, keeping the index's nprobe/efSearch"""
+        ivf = faiss.try_extract_index_ivf(self.index)
+        if ivf is not None:
+            return faiss.SearchParametersIVF(sel=partition.selector, nprobe=ivf.nprobe)
+        index = faiss.downcast_index(self.index)
+        if isinstance(index, faiss.IndexHNSW):
+            return faiss.SearchParametersHNSW(sel=partition.selector, efSearch=index.hnsw.efSearch)
+        return faiss.SearchParameters(sel=partition.selector)
+    
+    def _dense_search(self, query_embeddings, top_k, partition=None):
+        """
+        FAISS-style (scores, rows) for the queries, restricted to a partition
+        when one is given. Rows past the last result are -1.
+        """
+        if partition is None:
+            return self.index.search(query_embeddings, top_k)
+        rows = partition.rows
+        if len(rows) == 0:
+            return (np.empty((len(query_embeddings), 0), dtype='float32'),
+                    np.empty((len(query_embeddings), 0), dtype=np.int64))
+        if self.index_spec == "flat" or len(rows) <= EXACT_PARTITION_ROWS:
+            return self._exact_search(query_embeddings, top_k, rows)
+        
+        scores, indices = self.index.search(query_embeddings, top_k, params=self._search_parameters(partition))
+        # The probed IVF lists / HNSW neighbourhood may hold too few matching rows
+        if (indices[:, min(top_k, len(rows)) - 1] < 0).any():
+            return self._exact_search(query_embeddings, top_k, rows)
+        return scores, indices
+    
+    def search(self, query_embeddings, top_k=3, filters=None):
+        """
+        Searches the index for a matrix of query embeddings.
+        Returns per-query lists of (chunk, score). With the "ip" metric the
+        score is the cosine similarity (higher is closer), with "l2" the L2
+        distance (lower is closer). Each chunk also carries it as 'score'.
+        With filters, only chunks whose metadata matches are searched.
+        """
+        distances, indices = self._dense_search(query_embeddings, top_k, self.partition(filters))
+        
+        # ANN indexes return -1 when they find fewer than top_k results
+        results = []
+        for row_distances, row_indices in zip(distances, indices):
+            results.append([
+                (self._scored(int(i), float(distance)), float(distance))
+                for distance, i in zip(row_distances, row_indices) if i >= 0
+            ])
+        return results
+    
+    def hybrid_search(self, queries, query_embeddings, top_k=3, filters=None):
+        """
+        Fuses the dense ranking with the BM25 ranking of each query by
+        reciprocal rank fusion, over hybrid_candidates results of each.
+        Returns per-query lists of (chunk, score) where score is the fused
+        RRF score (higher is closer). Each chunk carries its dense score as
+        'score' (computed directly for lexical-only hits) and 'rrf_score'.
+        With filters, both rankings only cover the matching partition.
+        """
+        depth = max(top_k, self.hybrid_candidates)
+        partition = self.partition(filters)
+        dense_scores, dense_indices = self._dense_search(query_embeddings, depth, partition)
+        
+        results = []
+        for query, query_vector, row_scores, row_indices in zip(queries, query_embeddings, dense_scores, dense_indices):
+            fused = {}
+            dense = {int(i): float(score) for score, i in zip(row_scores, row_indices) if i >= 0}
+            lexical_rows, _ = self.lexical_index.search(
+                query, depth, rows=partition.rows if partition is not None else None
+            )
+            for ranking in (list(dense), lexical_rows):
+                for rank, row in enumerate(ranking, start=1):
+                    fused[int(row)] = fused.get(int(row), 0.0) + 1.0 / (self.rrf_k + rank)
+            best = sorted(fused.items(), key=lambda item: item[1], reverse=True)[:top_k]
+            
+            scored = []
+            for row, rrf_score in best:
+                if row not in dense:
+                    vector = np.asarray(self.embeddings[row], dtype='float32')
+                    dense[row] = (float(vector @ query_vector) if self.metric == "ip"
+                                  else float(np.sum((vector - query_vector) ** 2)))
+                scored.append((self._scored(row, dense[row], rrf_score=rrf_score), rrf_score))
+            results.append(scored)
+        return results
+    
+    def retrieve_batch(self, queries, top_k=3, filters=None):
+        """
+        Retrieves the top_k chunks for several queries at once, with one
+        encoder forward pass and one vectorized FAISS search.
+        filters (e.g. {"category": "academic_docs"}) applies to every query.
+        Returns a list (one entry per query) of (chunk, score) pairs.
+        """
+        if not queries:
+            return []
+        queries = list(queries)
+        query_embeddings = self.encode_queries(queries)
+        if self.lexical_index is not None:
+            return self.hybrid_search(queries, query_embeddings, top_k, filters=filters)
+        return self.search(query_embeddings, top_k, filters=filters)
+    
+    def retrieve_with_scores(self, query, top_k=3, filters=None):
+        """
+        Like retrieve, but returns (chunk, score) pairs.
+        """
+        return self.retrieve_batch([query], top_k, filters=filters)[0]
+    
+    def retrieve(self, query, top_k=3, filters=None):
+        """
+        Takes a query, generates its embedding, and searches the index for
+        the top_k most similar document chunks. With filters, only chunks
+        whose category/source matches are considered.
+        """
+        results = self.retrieve_with_scores(query, top_k, filters=filters)
+        retrieved_chunks = [chunk for chunk, _ in results]
         
-        return retrieved_chunks
\ No newline at end of file
+        return retrieved_chunks
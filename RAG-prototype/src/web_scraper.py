@@ -2,13 +2,97 @@ import requests
 import os
 from bs4 import BeautifulSoup
 import time
-import random
-from urllib.parse import urljoin, urlparse
+import threading
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from requests.adapters import HTTPAdapter
+from urllib.parse import urljoin, urlparse, urlencode
 import re
 
 class FetchFromNet:
     API_URL = "https://tokari-core.onrender.com/api/v1/ai/chat-completion"
     API_KEY = os.getenv("API_KEY")
+    USER_AGENT = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
+
+    def __init__(self, max_workers=4, time_budget=8.0, per_host_interval=1.0,
+                 cache=None, keyword_ttl=86400, search_ttl=6 * 3600, page_ttl=86400):
+        """
+        Args:
+            max_workers (int): pages scraped in parallel
+            time_budget (float): seconds search_and_scrape may spend scraping;
+                whatever finished by then is returned
+            per_host_interval (float): minimum seconds between requests to the same host
+            cache (HTTPCache): optional persistent cache for keywords, search
+                results and extracted page text
+            keyword_ttl, search_ttl, page_ttl (float): default freshness in seconds,
+                used when the response does not send Cache-Control max-age
+        """
+        self.time_budget = time_budget
+        self.per_host_interval = per_host_interval
+        self.cache = cache
+        self.keyword_ttl = keyword_ttl
+        self.search_ttl = search_ttl
+        self.page_ttl = page_ttl
+        
+        # One pooled session so repeated hosts reuse keep-alive connections
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=max_workers * 2, pool_maxsize=max_workers * 2)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.session.headers.update({'User-Agent': self.USER_AGENT})
+        
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="scraper")
+        self._host_lock = threading.Lock()
+        self._host_next_slot = {}
+
+    def _response_ttl(self, response, default_ttl):
+        """Freshness lifetime from Cache-Control, or None if the response must not be stored"""
+        cache_control = response.headers.get('Cache-Control', '').lower()
+        if 'no-store' in cache_control:
+            return None
+        match = re.search(r'max-age=(\d+)', cache_control)
+        if match:
+            return int(match.group(1))
+        return default_ttl
+
+    def _cached_get(self, namespace, url, parse, default_ttl, params=None, timeout=10, polite=False):
+        """
+        GET through the HTTP cache.
+        
+        Fresh entries skip the network entirely. Stale entries are revalidated
+        with If-None-Match / If-Modified-Since and reused on a 304. Otherwise
+        parse(response) turns the response into the value that is cached.
+        """
+        key = url if not params else url + "?" + urlencode(sorted(params.items()))
+        cached = self.cache.get(namespace, key) if self.cache is not None else None
+        if cached is not None and cached['fresh']:
+            return cached['value']
+        
+        headers = {}
+        if cached is not None:
+            if cached['etag']:
+                headers['If-None-Match'] = cached['etag']
+            if cached['last_modified']:
+                headers['If-Modified-Since'] = cached['last_modified']
+        
+        if polite:
+            self._wait_for_host(url)
+        response = self.session.get(url, params=params, headers=headers, timeout=timeout)
+        
+        if cached is not None and response.status_code == 304:
+            self.cache.refresh(namespace, key, self._response_ttl(response, default_ttl) or default_ttl)
+            return cached['value']
+        
+        response.raise_for_status()
+        value = parse(response)
+        
+        ttl = self._response_ttl(response, default_ttl)
+        if self.cache is not None and value and ttl:
+            self.cache.set(
+                namespace, key, value, ttl,
+                etag=response.headers.get('ETag'),
+                last_modified=response.headers.get('Last-Modified')
+            )
+        return value
 
     def get_keyword(self, user_prompt):
         """Extract keywords from user prompt for better search results"""
@@ -19,11 +103,19 @@ class FetchFromNet:
         """
         headers = {"x-api-key": self.API_KEY}
         payload = {"prompt": prompt}
+        cache_key = re.sub(r'\s+', ' ', user_prompt.strip().lower())
+        
+        if self.cache is not None:
+            cached = self.cache.get('keyword', cache_key)
+            if cached is not None and cached['fresh']:
+                return cached['value']
         
         try:
-            response = requests.post(self.API_URL, json=payload, headers=headers, timeout=20)
+            response = self.session.post(self.API_URL, json=payload, headers=headers, timeout=20)
             response.raise_for_status()
             keyword = response.json().get('response', '').strip()
+            if keyword and self.cache is not None:
+                self.cache.set('keyword', cache_key, keyword, self.keyword_ttl)
             return keyword if keyword else user_prompt  # Fallback to original prompt
         except Exception as e:
             print(f"Error getting keyword: {e}")
@@ -42,130 +134,212 @@ class FetchFromNet:
         }
         
         try:
-            response = requests.get(url, params=params, timeout=15)
-            response.raise_for_status()
-            data = response.json()
-            
-            sources = []
-            
-            # Get results from RelatedTopics
-            for result in data.get('RelatedTopics', [])[:5]:
-                if isinstance(result, dict) and 'Text' in result and 'FirstURL' in result:
-                    sources.append({
-                        "Text": result['Text'][:150] + '...' if len(result['Text']) > 150 else result['Text'],
-                        "Link": result['FirstURL']
-                    })
-            
-            # If no RelatedTopics, try Abstract
-            if not sources and data.get('Abstract'):
-                sources.append({
-                    "Text": data['Abstract'][:150] + '...' if len(data['Abstract']) > 150 else data['Abstract'],
-                    "Link": data.get('AbstractURL', '')
-                })
-            
-            # If still no results, try Answer
-            if not sources and data.get('Answer'):
-                sources.append({
-                    "Text": data['Answer'][:150] + '...' if len(data['Answer']) > 150 else data['Answer'],
-                    "Link": data.get('AnswerURL', '')
-                })
-            
-            return sources
-            
+            return self._cached_get('search', url, self._parse_search_results, self.search_ttl,
+                                    params=params, timeout=15)
+        
         except Exception as e:
             print(f"Error searching DuckDuckGo: {e}")
             return []
 
-    def scrape_website_content(self, url, max_chars=2000):
-        """Scrape content from a single website"""
+    def _parse_search_results(self, response):
+        """Turn a DuckDuckGo API response into a list of sources"""
+        data = response.json()
+        
+        sources = []
+        
+        # Get results from RelatedTopics
+        for result in data.get('RelatedTopics', [])[:5]:
+            if isinstance(result, dict) and 'Text' in result and 'FirstURL' in result:
+                sources.append({
+                    "Text": result['Text'][:150] + '...' if len(result['Text']) > 150 else result['Text'],
+                    "Link": result['FirstURL']
+                })
+        
+        # If no RelatedTopics, try Abstract
+        if not sources and data.get('Abstract'):
+            sources.append({
+                "Text": data['Abstract'][:150] + '...' if len(data['Abstract']) > 150 else data['Abstract'],
+                "Link": data.get('AbstractURL', '')
+            })
+        
+        # If still no results, try Answer
+        if not sources and data.get('Answer'):
+            sources.append({
+                "Text": data['Answer'][:150] + '...' if len(data['Answer']) > 150 else data['Answer'],
+                "Link": data.get('AnswerURL', '')
+            })
+        
+        return sources
+
+    def _reserve_host_slot(self, url, not_after=None):
+        """
+        Per-host politeness: reserve the next time (time.monotonic()) a
+        request may go to url's host, spacing requests per_host_interval
+        apart. Returns None, reserving nothing, if that is after not_after.
+        """
+        host = urlparse(url).netloc
+        with self._host_lock:
+            now = time.monotonic()
+            slot = max(now, self._host_next_slot.get(host, now))
+            if not_after is not None and slot > not_after:
+                return None
+            self._host_next_slot[host] = slot + self.per_host_interval
+        return slot
+
+    def _wait_for_host(self, url):
+        """Sleep until url's host may be requested; only for callers outside the scraper pool"""
+        delay = self._reserve_host_slot(url) - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+
+    def _extract_content(self, html, max_chars=2000):
+        """Extract the main readable text from an HTML page"""
+        soup = BeautifulSoup(html, 'html.parser')
+        
+        # Remove unwanted elements
+        for element in soup(['script', 'style', 'nav', 'header', 'footer', 'aside', 'menu']):
+            element.decompose()
+        
+        # Try to find main content areas
+        content_selectors = [
+            'article', 'main', '.content', '#content', '.post', '.article',
+            '.entry-content', '.post-content', '.article-content'
+        ]
+        
+        content_text = ""
+        for selector in content_selectors:
+            content_elem = soup.select_one(selector)
+            if content_elem:
+                content_text = content_elem.get_text(separator=' ', strip=True)
+                break
+        
+        # If no specific content area found, get body text
+        if not content_text:
+            body = soup.find('body')
+            if body:
+                content_text = body.get_text(separator=' ', strip=True)
+        
+        # Clean up the text
+        content_text = re.sub(r'\s+', ' ', content_text)  # Remove extra whitespace
+        content_text = content_text.strip()
+        
+        # Truncate if too long
+        if len(content_text) > max_chars:
+            content_text = content_text[:max_chars] + "..."
+        
+        return content_text
+
+    def scrape_website_content(self, url, max_chars=2000, timeout=10, polite=True):
+        """
+        Scrape content from a single website.
+        
+        Extracted text is cached per URL. With polite, network fetches first
+        wait for the host's politeness slot; search_and_scrape passes False
+        because it schedules pages by slot before they reach the pool.
+        """
         try:
-            # Add random delay to be respectful
-            time.sleep(random.uniform(1, 2))
-            
-            headers = {
-                'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
-            }
-            
-            response = requests.get(url, headers=headers, timeout=10)
-            response.raise_for_status()
-            
-            soup = BeautifulSoup(response.content, 'html.parser')
-            
-            # Remove unwanted elements
-            for element in soup(['script', 'style', 'nav', 'header', 'footer', 'aside', 'menu']):
-                element.decompose()
-            
-            # Try to find main content areas
-            content_selectors = [
-                'article', 'main', '.content', '#content', '.post', '.article',
-                '.entry-content', '.post-content', '.article-content'
-            ]
-            
-            content_text = ""
-            for selector in content_selectors:
-                content_elem = soup.select_one(selector)
-                if content_elem:
-                    content_text = content_elem.get_text(separator=' ', strip=True)
-                    break
-            
-            # If no specific content area found, get body text
-            if not content_text:
-                body = soup.find('body')
-                if body:
-                    content_text = body.get_text(separator=' ', strip=True)
-            
-            # Clean up the text
-            content_text = re.sub(r'\s+', ' ', content_text)  # Remove extra whitespace
-            content_text = content_text.strip()
-            
-            # Truncate if too long
-            if len(content_text) > max_chars:
-                content_text = content_text[:max_chars] + "..."
-            
-            return content_text
-            
+            return self._cached_get(
+                'page', url,
+                lambda response: self._extract_content(response.content, max_chars),
+                self.page_ttl, timeout=timeout, polite=polite
+            )
+        
         except Exception as e:
             print(f"Error scraping {url}: {e}")
             return ""
 
-    def search_and_scrape(self, user_prompt, max_sites=3):
-        """Search DuckDuckGo and scrape content from the results"""
+    def search_and_scrape(self, user_prompt, max_sites=3, cancel_event=None):
+        """
+        Search DuckDuckGo and scrape content from the results.
+        
+        Pages are scraped in parallel on pooled connections. A failed page is
+        replaced by the next search result, scraping stops once cancel_event
+        (a threading.Event) is set, and after time_budget seconds whatever
+        has finished is returned.
+        
+        Politeness delays are waited out here, not in the shared pool: a page
+        is submitted only once its host's slot has come (pages fresh in the
+        cache need no slot), pages whose slot falls after the deadline are
+        skipped, and each fetch times out within the remaining budget.
+        """
         # Get search results
         search_results = self.search_duckduckgo(user_prompt)
         
         if not search_results:
             return []
         
-        enriched_results = []
+        candidates = [
+            (position, result) for position, result in enumerate(search_results)
+            if result.get('Link', '') and self._is_valid_url(result.get('Link', ''))
+        ]
+        
+        deadline = time.monotonic() + self.time_budget
+        pending = {}
+        # (slot, position, result) of pages waiting for their host's slot
+        scheduled = []
+        finished = []
         scraped_count = 0
+        next_candidate = 0
         
-        for result in search_results:
-            if scraped_count >= max_sites:
+        while True:
+            if cancel_event is not None and cancel_event.is_set():
                 break
-                
-            link = result.get('Link', '')
-            if not link or not self._is_valid_url(link):
-                continue
             
-            print(f"Scraping: {link}")
-            scraped_content = self.scrape_website_content(link)
+            # Keep enough scrapes scheduled or in flight to reach max_sites successful pages
+            while next_candidate < len(candidates) and scraped_count + len(pending) + len(scheduled) < max_sites:
+                position, result = candidates[next_candidate]
+                next_candidate += 1
+                url = result['Link']
+                if self.cache is not None and self.cache.is_fresh('page', url):
+                    slot = time.monotonic()
+                else:
+                    slot = self._reserve_host_slot(url, not_after=deadline)
+                if slot is None:
+                    print(f"Skipping {url}: its host is busy past the time budget")
+                    continue
+                scheduled.append((slot, position, result))
             
-            if scraped_content:
-                enriched_results.append({
-                    "Title": result.get('Text', 'No title'),
-                    "Link": link,
-                    "Content": scraped_content,
-                    "Summary": result.get('Text', '')
-                })
-                scraped_count += 1
-            else:
-                # Keep the original result even if scraping failed
-                enriched_results.append({
-                    "Title": result.get('Text', 'No title'),
-                    "Link": link,
-                    "Content": "",
-                    "Summary": result.get('Text', '')
-                })
+            for item in [item for item in scheduled if item[0] <= time.monotonic()]:
+                scheduled.remove(item)
+                _, position, result = item
+                print(f"Scraping: {result['Link']}")
+                timeout = min(10, max(deadline - time.monotonic(), 0.1))
+                future = self.executor.submit(
+                    self.scrape_website_content, result['Link'], timeout=timeout, polite=False
+                )
+                pending[future] = (position, result)
+            
+            remaining = deadline - time.monotonic()
+            if (not pending and not scheduled) or remaining <= 0:
+                break
+            
+            # Wake up for a finished page, the next slot or a cancellation check
+            next_slot = min((slot for slot, _, _ in scheduled), default=deadline)
+            timeout = max(min(remaining, 0.25, next_slot - time.monotonic()), 0)
+            if not pending:
+                time.sleep(timeout)
+                continue
+            done, _ = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+            for future in done:
+                position, result = pending.pop(future)
+                scraped_content = future.result()
+                finished.append((position, result, scraped_content))
+                if scraped_content:
+                    scraped_count += 1
+        
+        # Pages still loading are abandoned, not waited for
+        for future in pending:
+            future.cancel()
+        
+        enriched_results = []
+        for _, result, scraped_content in sorted(finished, key=lambda item: item[0]):
+            # Keep the original result even if scraping failed
+            enriched_results.append({
+                "Title": result.get('Text', 'No title'),
+                "Link": result['Link'],
+                "Content": scraped_content,
+                "Summary": result.get('Text', '')
+            })
         
         return enriched_results
 
@@ -177,9 +351,9 @@ class FetchFromNet:
         except:
             return False
 
-    def get_search_summary(self, user_prompt):
+    def get_search_summary(self, user_prompt, cancel_event=None):
         """Get a concise summary of search results for RAG integration"""
-        results = self.search_and_scrape(user_prompt, max_sites=2)
+        results = self.search_and_scrape(user_prompt, max_sites=2, cancel_event=cancel_event)
         
         if not results:
             return "No additional information found online."
@@ -196,7 +370,7 @@ class FetchFromNet:
             return " | ".join(summary_parts)
         else:
             return "Search results found but content extraction failed."
-
+    
     # Legacy method name for backward compatibility
     def search_google(self, user_prompt):
         """Legacy method - now uses DuckDuckGo"""
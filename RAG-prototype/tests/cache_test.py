@@ -1,4 +1,3 @@
-import os
 import time
 from train_rag_model import main, get_rag_manager
 
@@ -9,20 +8,20 @@ def test_cache_system():
     
     # Get RAG manager
     rag_manager = get_rag_manager()
-    cache_file = rag_manager.cache_file
+    index_store = rag_manager.index_store
     
     # Test 1: First run (should create cache)
     print("\n1️⃣ First run (cold start - should create cache):")
-    if os.path.exists(cache_file):
-        os.remove(cache_file)
-        print(f"   Removed existing cache: {cache_file}")
+    if index_store.exists():
+        index_store.clear()
+        print(f"   Removed existing index: {rag_manager.config.index_dir}")
     
     start_time = time.time()
     response1 = main("What is FUTA?")
     first_run_time = time.time() - start_time
     
     print(f"   ✅ First run completed in {first_run_time:.2f} seconds")
-    print(f"   Cache file created: {os.path.exists(cache_file)}")
+    print(f"   Index created: {index_store.exists()}")
     print(f"   Response length: {len(response1)} characters")
     
     # Test 2: Second run (should use cache)
@@ -32,7 +31,7 @@ def test_cache_system():
     second_run_time = time.time() - start_time
     
     print(f"   ✅ Second run completed in {second_run_time:.2f} seconds")
-    print(f"   Cache file exists: {os.path.exists(cache_file)}")
+    print(f"   Index exists: {index_store.exists()}")
     print(f"   Response length: {len(response2)} characters")
     
     # Test 3: Performance comparison
@@ -1,54 +1,111 @@
 import os
-import pickle
+import atexit
 import hashlib
-from src.document_processor import load_documents, chunk_documents, generate_embeddings
+from dataclasses import replace
+from itertools import islice
+import numpy as np
+from src.config import RAGConfig
+from src.document_processor import (
+    EMBEDDING_MODEL_NAME, iter_document_paths, iter_documents, file_hash, load_embedding_model
+)
+from src.encoder_backend import PARITY_TEXTS, check_parity
+from src.index_store import IndexStore
+from src.ingestion import IngestionPipeline
+from src.dedup import ChunkDeduplicator
+from src.reranker import CrossEncoderReranker
 from src.retriever import Retriever
+from src.batcher import RetrievalBatcher
+from src.query_cache import QueryEmbeddingCache
+from src.answer_cache import SemanticAnswerCache
+from src.http_cache import HTTPCache
 from src.rag_system import RAGSystem
 
 class RAGManager:
-    def __init__(self, data_directory="data", cache_file="rag_cache.pkl"):
-        self.data_directory = data_directory
-        self.cache_file = cache_file
+    def __init__(self, config=None, **overrides):
+        """
+        Args:
+            config (RAGConfig): settings; the defaults when None
+            overrides: RAGConfig fields to change, e.g. index_dir="other_index"
+        """
+        self.config = replace(config or RAGConfig(), **overrides)
+        config = self.config
+        self.index_store = IndexStore(config.index_dir, dtype=config.embedding_dtype)
+        self.embedding_model_name = EMBEDDING_MODEL_NAME
+        self.embedding_parity = None
+        self.ingestion_stats = None
+        self.chunking = {
+            'max_length': config.chunk_max_tokens,
+            'overlap': config.chunk_overlap,
+            'boundary': config.chunk_boundary
+        }
+        self.dedup_config = (
+            ChunkDeduplicator(threshold=config.dedup_threshold).config if config.dedup_threshold else None
+        )
+        
+        # Shared across rebuilds: query vectors only depend on the encoder
+        self.query_cache = None
+        if config.query_cache_size > 0:
+            self.query_cache = QueryEmbeddingCache(
+                max_size=config.query_cache_size,
+                ttl_seconds=config.query_cache_ttl,
+                persist_path=config.query_cache_path,
+                model_name=self.embedding_model_name
+            )
+            if config.query_cache_path:
+                atexit.register(self.query_cache.save)
+        
+        # Rerank scores are keyed by chunk text, so they survive rebuilds too;
+        # the cross-encoder is loaded with the other models
+        self.reranker = None
+        
+        # Web results do not depend on the index and persist across restarts
+        self.web_cache = HTTPCache(config.web_cache_path) if config.web_cache_path else None
+        
+        # Cached answers are tied to the index and cleared whenever it is (re)built
+        self.answer_cache = None
+        if config.answer_cache_size > 0:
+            self.answer_cache = SemanticAnswerCache(
+                similarity_threshold=config.answer_cache_threshold,
+                max_size=config.answer_cache_size,
+                ttl_seconds=config.answer_cache_ttl
+            )
         self.rag_system = None
         
-    def _get_data_hash(self, documents):
-        """Generate hash of document content to detect changes"""
-        content = ""
-        for doc in documents:
-            content += doc['text'] + doc['source']
-        return hashlib.md5(content.encode()).hexdigest()
-    
-    def _save_rag_components(self, embeddings, chunked_docs, embedding_model, data_hash):
-        """Save RAG components to cache file"""
-        try:
-            cache_data = {
-                'embeddings': embeddings,
-                'chunked_docs': chunked_docs,
-                'embedding_model': embedding_model,
-                'data_hash': data_hash,
-                'cache_version': '1.0'
-            }
-            
-            with open(self.cache_file, 'wb') as f:
-                pickle.dump(cache_data, f)
-            print(f"RAG components saved to {self.cache_file}")
-            
-        except Exception as e:
-            print(f"Error saving cache: {e}")
+    def _hash_documents(self, paths):
+        """
+        Hash the corpus (to detect changes) and each file (to find which
+        changed) in one pass over the raw bytes, so binary formats need no
+        parsing. paths may be a lazy iterator.
+        
+        Returns:
+            tuple: (data_hash, {source: content hash})
+        """
+        data_hash = hashlib.md5()
+        doc_hashes = {}
+        for path in paths:
+            doc_hashes[path] = file_hash(path)
+            data_hash.update((doc_hashes[path] + path).encode())
+        return data_hash.hexdigest(), doc_hashes
     
     def _load_rag_components(self):
-        """Load RAG components from cache file"""
-        if not os.path.exists(self.cache_file):
-            return None
-            
+        """Open RAG components from the on-disk index (memory-mapped)"""
         try:
-            with open(self.cache_file, 'rb') as f:
-                cache_data = pickle.load(f)
+            cache_data = self.index_store.load()
+            if cache_data is None:
+                print("No compatible index found")
+                return None
+            
+            # An index built with another encoder cannot be reused
+            if cache_data['manifest'].get('embedding_model') != self.embedding_model_name:
+                print("Index was built with a different embedding model")
+                return None
             
-            # Check if cache has required keys
-            required_keys = ['embeddings', 'chunked_docs', 'embedding_model', 'data_hash']
-            if not all(key in cache_data for key in required_keys):
-                print("Cache file is corrupted or outdated")
+            # Chunks made with other settings would be mixed with new ones
+            if cache_data['manifest'].get('chunking') != self.chunking:
+                print("Index was built with different chunking settings")
+                return None
+            if cache_data['manifest'].get('dedup') != self.dedup_config:
+                print("Index was built with different deduplication settings")
                 return None
                 
             print("RAG components loaded from cache")
@@ -58,58 +115,254 @@ class RAGManager:
             print(f"Error loading cache: {e}")
             return None
     
+    def _build_retriever(self, stored, embedding_model, index=None):
+        """Create a retriever over a loaded index with the configured spec, search parameters and mode"""
+        return Retriever(
+            stored['embeddings'], stored['chunks'], embedding_model, index=index,
+            index_spec=self.config.index_spec, index_params=self.config.index_params,
+            nprobe=self.config.nprobe, ef_search=self.config.ef_search, query_cache=self.query_cache,
+            lexical_index=stored['lexical'] if self.config.retrieval_mode == "hybrid" else None,
+            hybrid_candidates=self.config.hybrid_candidates
+        )
+    
+    def _load_embedding_model(self, sample_documents):
+        """
+        Load the encoder in the configured backend. Optimized backends must
+        pass a parity check against the float32 model on the questions and
+        documents at hand, otherwise the float32 model is used instead.
+        
+        Args:
+            sample_documents (callable): returns the document units for the
+                parity check; only called for optimized backends
+        """
+        embedding_model = load_embedding_model(self.embedding_model_name, backend=self.config.embedding_backend)
+        if self.config.embedding_backend == "torch":
+            return embedding_model
+        
+        reference = load_embedding_model(self.embedding_model_name)
+        sample_texts = PARITY_TEXTS + [doc['text'][:1000] for doc in sample_documents()]
+        self.embedding_parity = check_parity(
+            embedding_model, reference, sample_texts, tolerance=self.config.embedding_parity_tolerance
+        )
+        print(
+            f"🔬 {self.config.embedding_backend} encoder parity: min cosine {self.embedding_parity['min_cosine']:.4f}, "
+            f"max similarity error {self.embedding_parity['max_similarity_error']:.4f}"
+        )
+        if not self.embedding_parity['passed']:
+            print(f"⚠️ {self.config.embedding_backend} encoder drifts beyond tolerance, using the float32 encoder")
+            return reference
+        return embedding_model
+    
+    def _diff_documents(self, cached_hashes, doc_hashes):
+        """Compare per-document hashes and return (added, changed, removed) sources"""
+        added = [source for source in doc_hashes if source not in cached_hashes]
+        changed = [
+            source for source in doc_hashes
+            if source in cached_hashes and cached_hashes[source] != doc_hashes[source]
+        ]
+        removed = [source for source in cached_hashes if source not in doc_hashes]
+        return added, changed, removed
+    
+    def _new_deduplicator(self):
+        """A fresh chunk deduplicator for one index build, or None when disabled"""
+        return ChunkDeduplicator(**self.dedup_config) if self.dedup_config else None
+    
+    def _ingest(self, writer, paths, embedding_model, deduplicator=None):
+        """Stream files through the ingestion pipeline into the index writer"""
+        pipeline = IngestionPipeline(
+            embedding_model,
+            workers=self.config.ingestion_workers,
+            batch_size=self.config.ingestion_batch_size,
+            queue_size=self.config.ingestion_queue_size,
+            chunking=self.chunking,
+            deduplicator=deduplicator,
+            data_directory=self.config.data_directory
+        )
+        stats = pipeline.run(writer, paths)
+        print(
+            f"📥 Ingested {stats['files']} files / {stats['chunks']} chunks in {stats['wall_seconds']:.1f}s "
+            f"({stats['chunks_per_second']:.1f} chunks/s) - chunking {stats['chunk_seconds']:.1f}s "
+            f"(worker time), embedding {stats['embed_seconds']:.1f}s, writing {stats['write_seconds']:.1f}s, "
+            f"backpressure {stats['backpressure_seconds']:.1f}s"
+        )
+        if deduplicator is not None:
+            stats['dedup'] = deduplicator.stats()
+            print(
+                f"🧹 Dropped {stats['dedup']['exact_duplicates']} exact and "
+                f"{stats['dedup']['near_duplicates']} near-duplicate chunks"
+            )
+        return stats
+    
+    def _update_rag_components(self, writer, cached_data, embedding_model, deduplicator, added, changed, removed):
+        """Copy untouched chunks into the writer, then re-chunk and re-embed only the added/changed documents"""
+        stale_sources = set(changed) | set(removed)
+        cached_chunks = cached_data['chunks']
+        cached_embeddings = cached_data['embeddings']
+        duplicates = cached_chunks.duplicates
+        cached_sources = cached_chunks.sources
+        
+        # A source whose duplicate chunks point at a stale chunk loses them with it,
+        # so it has to be re-ingested too (until nothing more is affected)
+        stale_ids = {i for i, source in enumerate(cached_sources) if source in stale_sources}
+        while len(duplicates):
+            stale_rows = np.isin(cached_chunks.source_ids, list(stale_ids))
+            affected = {int(source_id) for row, source_id in duplicates[:, :2] if stale_rows[row]} - stale_ids
+            if not affected:
+                break
+            stale_ids |= affected
+            stale_sources |= {cached_sources[source_id] for source_id in affected}
+        
+        # Keep untouched chunks and their embedding rows as they are
+        keep_rows = [
+            i for i, chunk in enumerate(cached_chunks)
+            if chunk['source'] not in stale_sources
+        ]
+        new_rows = {}
+        for start in range(0, len(keep_rows), 4096):
+            rows = keep_rows[start:start + 4096]
+            chunks = [cached_chunks[i] for i in rows]
+            writer.append(cached_embeddings[rows], chunks)
+            for row, chunk in zip(rows, chunks):
+                new_rows[row] = len(new_rows)
+                if deduplicator is not None:
+                    deduplicator.keep(deduplicator.fingerprint(chunk['text']))
+        
+        # Carry over duplicate locations of kept chunks from untouched sources
+        for row, source_id, start, end, page, heading_id, category_id in duplicates:
+            if int(row) in new_rows and int(source_id) not in stale_ids:
+                location = {"source": cached_sources[int(source_id)], "start": int(start), "end": int(end),
+                            "page": int(page)}
+                if heading_id >= 0:
+                    location["heading"] = cached_chunks.headings[int(heading_id)]
+                if category_id >= 0:
+                    location["category"] = cached_chunks.categories[int(category_id)]
+                writer.add_duplicate(new_rows[int(row)], location)
+        cached_chunks.close()
+        
+        new_sources = (set(added) | stale_sources) - set(removed)
+        new_paths = [path for path in iter_document_paths(self.config.data_directory) if path in new_sources]
+        if new_paths:
+            print(f"Chunking and embedding {len(new_paths)} new/changed documents...")
+            return self._ingest(writer, new_paths, embedding_model, deduplicator)
+        return None
+    
     def _initialize_rag_system(self, force_rebuild=False):
         """Initialize or load RAG system with caching"""
         print("Initializing RAG System...")
         
-        # 1. Load documents
-        print("Loading documents...")
-        documents = load_documents(directory=self.data_directory)
-        
-        if not documents:
-            raise ValueError(f"No documents found in {self.data_directory}")
+        # 1. Hash document files, one at a time
+        print("Scanning documents...")
+        data_hash, doc_hashes = self._hash_documents(iter_document_paths(self.config.data_directory))
         
-        data_hash = self._get_data_hash(documents)
+        if not doc_hashes:
+            raise ValueError(f"No documents found in {self.config.data_directory}")
         
-        # 2. Try to load from cache - THIS IS WHERE CACHE IS USED!
-        cached_data = None
-        if not force_rebuild:
-            print("🔍 Checking for cached RAG components...")
-            cached_data = self._load_rag_components()  # CACHE LOADING HERE
-            
-        # 3. Check if cache is valid - CACHE VALIDATION
-        use_cache = (
-            cached_data is not None and
-            cached_data.get('data_hash') == data_hash
+        # The encoder is always loaded by name, never from the cache. Backends
+        # that pass the parity check produce vectors compatible with the index.
+        embedding_model = self._load_embedding_model(
+            lambda: list(islice(iter_documents(self.config.data_directory), 16))
         )
         
-        if use_cache:
-            print("✅ Using cached RAG components (CACHE HIT)...")
-            # USING CACHED DATA INSTEAD OF REBUILDING
-            embeddings = cached_data['embeddings']
-            chunked_docs = cached_data['chunked_docs']
-            embedding_model = cached_data['embedding_model']
-        else:
-            print("❌ Cache miss - Building RAG components from scratch...")
+        # Other processes sharing index_dir (e.g. gunicorn workers) wait here
+        # and then find the index this one built instead of building it again
+        with self.index_store.lock():
+            # 2. Try to load from cache - THIS IS WHERE CACHE IS USED!
+            cached_data = None
+            if not force_rebuild:
+                print("🔍 Checking for cached RAG components...")
+                cached_data = self._load_rag_components()  # CACHE LOADING HERE
             
-            # Process documents
-            print("Chunking documents...")
-            chunked_docs = chunk_documents(documents)
+            # 3. Check if cache is valid - CACHE VALIDATION
+            use_cache = (
+                cached_data is not None and
+                cached_data['manifest'].get('data_hash') == data_hash
+            )
             
-            # Generate embeddings (EXPENSIVE OPERATION - AVOIDED WITH CACHE)
-            print("Generating embeddings...")
-            embeddings, embedding_model = generate_embeddings(chunked_docs)
-            
-            # Save to cache - CACHE SAVING HERE
-            print("💾 Saving to cache for future use...")
-            self._save_rag_components(embeddings, chunked_docs, embedding_model, data_hash)
+            if use_cache:
+                print("✅ Using cached RAG components (CACHE HIT)...")
+                # USING CACHED DATA INSTEAD OF REBUILDING
+                print("Initializing retriever...")
+                if cached_data['manifest'].get('index_spec') == self.config.index_spec:
+                    retriever = self._build_retriever(cached_data, embedding_model, index=cached_data['index'])
+                else:
+                    # Embeddings are still valid; only the ANN index is retrained
+                    print(f"Building '{self.config.index_spec}' index from cached embeddings...")
+                    retriever = self._build_retriever(cached_data, embedding_model)
+                    self.index_store.save_index(retriever.index, self.config.index_spec)
+            else:
+                # Chunks and embeddings are appended to the on-disk index as they are produced
+                writer = self.index_store.writer()
+                try:
+                    if cached_data is not None:
+                        added, changed, removed = self._diff_documents(
+                            cached_data['manifest']['doc_hashes'], doc_hashes
+                        )
+                        print(
+                            f"♻️ Partial cache hit - {len(added)} added, {len(changed)} changed, "
+                            f"{len(removed)} removed documents"
+                        )
+                        
+                        # Only the affected documents are re-chunked and re-embedded
+                        self.ingestion_stats = self._update_rag_components(
+                            writer, cached_data, embedding_model, self._new_deduplicator(), added, changed, removed
+                        )
+                    else:
+                        print("❌ Cache miss - Building RAG components from scratch...")
+                        
+                        # Chunk and embed (EXPENSIVE OPERATION - AVOIDED WITH CACHE)
+                        print("Chunking and embedding documents...")
+                        self.ingestion_stats = self._ingest(
+                            writer, iter_document_paths(self.config.data_directory), embedding_model,
+                            self._new_deduplicator()
+                        )
+                    
+                    print("💾 Saving to cache for future use...")
+                    writer.finish(
+                        self.embedding_model_name, data_hash, doc_hashes,
+                        chunking=self.chunking, dedup=self.dedup_config
+                    )
+                except BaseException:
+                    writer.abort()
+                    raise
+                
+                # Serve from the memory-mapped index that was just written
+                stored = self.index_store.load()
+                print("Initializing retriever...")
+                retriever = self._build_retriever(stored, embedding_model)
+                self.index_store.save_index(retriever.index, self.config.index_spec)
+                print(f"RAG components saved to {self.config.index_dir}")
         
-        # 4. Initialize retriever and RAG system
-        print("Initializing retriever...")
-        retriever = Retriever(embeddings, chunked_docs, embedding_model)
+        # Coalesce concurrent queries into batched encode + search calls
+        if self.config.retrieval_batch_window_ms > 0:
+            print(f"Batching retrieval within {self.config.retrieval_batch_window_ms}ms windows...")
+            retriever = RetrievalBatcher(
+                retriever,
+                max_wait_ms=self.config.retrieval_batch_window_ms,
+                max_batch_size=self.config.retrieval_max_batch_size
+            )
         
+        # Stop the batching workers of the system being replaced
+        if self.rag_system is not None and isinstance(self.rag_system.retriever, RetrievalBatcher):
+            self.rag_system.retriever.close()
+        if self.rag_system is not None and self.rag_system.generation_batcher is not None:
+            self.rag_system.generation_batcher.close()
+        
+        if self.answer_cache is not None:
+            self.answer_cache.clear()
+        
+        if self.config.reranking and self.reranker is None:
+            print("Loading cross-encoder reranker...")
+            self.reranker = CrossEncoderReranker(batch_size=self.config.rerank_batch_size)
+        
+        # 4. Initialize RAG system
         print("Initializing RAG system...")
-        self.rag_system = RAGSystem(retriever)
+        self.rag_system = RAGSystem(
+            retriever,
+            self.config,
+            answer_cache=self.answer_cache,
+            web_cache=self.web_cache,
+            reranker=self.reranker
+        )
         
         print("RAG System initialized successfully!")
         return self.rag_system
@@ -121,13 +374,12 @@ class RAGManager:
         return self.rag_system
     
     def clear_cache(self):
-        """Clear the cache file"""
+        """Clear the on-disk index"""
         try:
-            if os.path.exists(self.cache_file):
-                os.remove(self.cache_file)
-                print(f"Cache file {self.cache_file} removed")
+            if self.index_store.clear():
+                print(f"Index directory {self.config.index_dir} removed")
             else:
-                print("No cache file to remove")
+                print("No index to remove")
         except Exception as e:
             print(f"Error removing cache: {e}")
 
@@ -138,16 +390,18 @@ def get_rag_manager():
     """Get global RAG manager instance"""
     global _rag_manager
     if _rag_manager is None:
-        _rag_manager = RAGManager()
+        _rag_manager = RAGManager(RAGConfig.from_env())
     return _rag_manager
 
-def main(query, force_rebuild=False):
+def main(query, force_rebuild=False, filters=None):
     """
     Main function to get response from RAG system
     
     Args:
         query (str): User query
         force_rebuild (bool): Force rebuild of RAG components
+        filters (dict): Optional metadata filters for retrieval, e.g.
+            {"category": "academic_docs"} or {"source": [...]}
     
     Returns:
         str: Generated response
@@ -163,7 +417,7 @@ def main(query, force_rebuild=False):
         # Generate response
         print(f"Processing query: {query[:50]}...")
         print("Thinking...")
-        response = rag_system.generate_response(query)
+        response = rag_system.generate_response(query, filters=filters)
         
         print(f"Response generated successfully")
         return response
@@ -173,6 +427,26 @@ def main(query, force_rebuild=False):
         print(error_msg)
         return error_msg
 
+def main_stream(query, filters=None):
+    """
+    Streaming variant of main: yields the response text as it is generated.
+    
+    Args:
+        query (str): User query
+        filters (dict): Optional metadata filters for retrieval
+    
+    Yields:
+        str: Pieces of the generated response
+    """
+    if not query or not isinstance(query, str):
+        raise ValueError("Invalid query provided")
+    
+    rag_manager = get_rag_manager()
+    rag_system = rag_manager.get_rag_system()
+    
+    print(f"Streaming response for query: {query[:50]}...")
+    yield from rag_system.generate_response_stream(query, filters=filters)
+
 def rebuild_rag_system():
     """Force rebuild RAG system (useful for updates)"""
     try: